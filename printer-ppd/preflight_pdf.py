@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Prepares PDFs for the reMarkable printer (see remarkable-pdf-printer.ppd)
+before they're sent to the device, so large PDFs with high-resolution images
+take less time to transfer and render on the tablet.
+
+Each page is processed one after the other:
+* it is scaled to fit the imageable area of the PPD's media size (157x210 mm
+  by default) and centered,
+* its embedded images are converted to grayscale and downsampled to the
+  panel's resolution (1404x1872) - images shared by several pages are only
+  processed once.
+
+The result is written to a file, to stdout or sent to the printer via
+AppSocket (raw TCP, port 9100), i.e. without any further processing by CUPS.
+
+This script also works as CUPS filter (CUPS passes the job id, user, title,
+copies, options and optionally the filename; the PPD is given via the PPD
+environment variable), the result is written to stdout then.
+
+To test it without a tablet, run a local stand-in for the printer, which
+stores each received job as PDF:
+  python3 preflight_pdf.py --serve 9100 --output-dir received
+  python3 preflight_pdf.py document.pdf --send localhost:9100
+
+Requires pikepdf and Pillow (pip install pikepdf pillow).
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import re
+import socket
+import sys
+import tempfile
+import zlib
+
+try:
+    import pikepdf
+    from PIL import Image
+except ImportError:
+    pikepdf = None
+
+
+# Resolution of the e-ink panel (portrait)
+PANEL_WIDTH_PX = 1404
+PANEL_HEIGHT_PX = 1872
+
+# Default PPD (located next to this script) and media size
+DEFAULT_PPD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'remarkable-pdf-printer.ppd')
+DEFAULT_MEDIA = 'remarkable'
+
+# Default port of the printer on the device (AppSocket/HP JetDirect)
+APPSOCKET_PORT = 9100
+
+
+def parse_ppd_media(ppd_filename, media=None):
+    """
+    Returns the paper size (width, height) and the imageable area (left,
+    bottom, right, top) in [pt] of the given media size, or of the PPD's
+    default media size.
+    """
+    with open(ppd_filename, 'r', encoding='latin-1') as f:
+        ppd = f.read()
+    if media is None:
+        match = re.search(r'^\*DefaultPageSize:\s*(\S+)', ppd, re.MULTILINE)
+        media = DEFAULT_MEDIA if match is None else match.group(1)
+    dimension = re.search(rf'^\*PaperDimension {re.escape(media)}(/[^:]*)?:\s*"([^"]+)"', ppd, re.MULTILINE)
+    if dimension is None:
+        raise ValueError(f'Media size "{media}" is not defined in {ppd_filename}')
+    paper = tuple(float(v) for v in dimension.group(2).split())
+    area = re.search(rf'^\*ImageableArea {re.escape(media)}(/[^:]*)?:\s*"([^"]+)"', ppd, re.MULTILINE)
+    imageable = (0, 0) + paper if area is None else tuple(float(v) for v in area.group(2).split())
+    return paper, imageable
+
+
+def fit_page(page, paper, imageable):
+    """
+    Scales and centers the page's content to fit into the imageable area of
+    the given paper size (in [pt]). Rotated pages (/Rotate) are fit into the
+    rotated paper, so they're displayed in portrait mode, too. Returns False
+    if the page already has the paper size.
+    """
+    x0, y0, x1, y1 = [float(v) for v in page.cropbox]
+    x0, x1 = min(x0, x1), max(x0, x1)
+    y0, y1 = min(y0, y1), max(y0, y1)
+    width, height = paper
+    left, bottom, right, top = imageable
+    if int(page.obj.get('/Rotate', 0)) % 180 != 0:
+        # Fit into the paper as seen in the page's (unrotated) user space
+        width, height = height, width
+        left, bottom, right, top = bottom, left, top, right
+    if abs(x1 - x0 - width) < 1 and abs(y1 - y0 - height) < 1:
+        return False
+    scale = min((right - left) / (x1 - x0), (top - bottom) / (y1 - y0))
+    tx = left + ((right - left) - (x1 - x0) * scale) / 2 - x0 * scale
+    ty = bottom + ((top - bottom) - (y1 - y0) * scale) / 2 - y0 * scale
+    page.contents_add(f'q {scale:g} 0 0 {scale:g} {tx:g} {ty:g} cm\n'.encode(), prepend=True)
+    page.contents_add(b'\nQ')
+    page.obj.MediaBox = pikepdf.Array([0, 0, width, height])
+    for box in ['/CropBox', '/TrimBox', '/BleedBox', '/ArtBox']:
+        if box in page.obj:
+            del page.obj[box]
+    # Keep links/annotations at their (transformed) position
+    for annot in page.obj.get('/Annots', list()):
+        if '/Rect' in annot:
+            ax0, ay0, ax1, ay1 = [float(v) for v in annot.Rect]
+            annot.Rect = pikepdf.Array([ax0 * scale + tx, ay0 * scale + ty, ax1 * scale + tx, ay1 * scale + ty])
+    return True
+
+
+def page_images(resources, visited):
+    """Yields all image XObjects of the resources, including the ones of nested form XObjects."""
+    xobjects = resources.get('/XObject', dict()) if resources is not None else dict()
+    for _, xobj in xobjects.items():
+        if xobj.objgen != (0, 0):
+            if xobj.objgen in visited:
+                continue
+            visited.add(xobj.objgen)
+        if xobj.get('/Subtype') == '/Image':
+            yield xobj
+        elif xobj.get('/Subtype') == '/Form':
+            yield from page_images(xobj.get('/Resources'), visited)
+
+
+def convert_image(xobj, jpeg_quality):
+    """
+    Converts the image XObject to grayscale and downsamples it to the panel's
+    resolution (in-place). The image is only replaced if that saves bytes.
+    Returns the number of saved bytes.
+    """
+    if xobj.get('/ImageMask', False) or int(xobj.get('/BitsPerComponent', 8)) == 1:
+        # Stencil masks and bilevel images are already small
+        return 0
+    if isinstance(xobj.get('/Mask'), pikepdf.Array) or '/Matte' in xobj.get('/SMask', dict()):
+        # Color key masks and the matte color of soft masks (pre-multiplied
+        # alpha) refer to the image's original color space (and size)
+        print('  Skipping image with a color key mask or a pre-multiplied soft mask')
+        return 0
+    try:
+        try:
+            # Masks are separate objects, which are kept as they are
+            img = pikepdf.PdfImage(xobj).as_pil_image(apply_mask=False)
+        except TypeError:
+            # Older pikepdf versions don't apply masks
+            img = pikepdf.PdfImage(xobj).as_pil_image()
+    except (pikepdf.PdfError, NotImplementedError, ValueError, OSError) as e:
+        print(f'  Skipping unsupported image: {e}')
+        return 0
+    # Downsample (keep the aspect ratio) to the panel's resolution in either orientation
+    long_side, short_side = max(img.size), min(img.size)
+    scale = min(1, PANEL_HEIGHT_PX / long_side, PANEL_WIDTH_PX / short_side)
+    gray = img.convert('L')
+    if scale < 1:
+        gray = gray.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    if xobj.get('/Filter') == '/DCTDecode':
+        buffer = io.BytesIO()
+        gray.save(buffer, format='JPEG', quality=jpeg_quality, optimize=True)
+        data, stream_filter = buffer.getvalue(), pikepdf.Name.DCTDecode
+    else:
+        data, stream_filter = zlib.compress(gray.tobytes(), 9), pikepdf.Name.FlateDecode
+    saved = len(xobj.read_raw_bytes()) - len(data)
+    if saved <= 0:
+        return 0
+    xobj.write(data, filter=stream_filter)
+    xobj.Width, xobj.Height = gray.width, gray.height
+    xobj.ColorSpace = pikepdf.Name.DeviceGray
+    xobj.BitsPerComponent = 8
+    for key in ['/Decode', '/DecodeParms']:
+        if key in xobj:
+            del xobj[key]
+    return saved
+
+
+def preflight(input_file, output_stream, paper, imageable, fit=True, images=True, jpeg_quality=85):
+    """
+    Processes the PDF (filename or file object) page by page and writes the
+    result to the output stream. Returns a dict with the number of pages,
+    fitted pages, converted images and the saved image bytes.
+    """
+    stats = dict(pages=0, fitted=0, images=0, image_bytes_saved=0)
+    visited = set()
+    with pikepdf.open(input_file) as pdf:
+        for page in pdf.pages:
+            stats['pages'] += 1
+            if fit and fit_page(page, paper, imageable):
+                stats['fitted'] += 1
+            if images:
+                for xobj in page_images(page.obj.get('/Resources'), visited):
+                    saved = convert_image(xobj, jpeg_quality)
+                    if saved > 0:
+                        stats['images'] += 1
+                        stats['image_bytes_saved'] += saved
+        pdf.remove_unreferenced_resources()
+        pdf.save(output_stream, compress_streams=True,
+                 object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    return stats
+
+
+class CountingWriter(io.RawIOBase):
+    """Writable stream which forwards the data to a socket and counts the sent bytes."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.num_bytes = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.sock.sendall(data)
+        self.num_bytes += len(data)
+        return len(data)
+
+
+def parse_address(address, default_port=APPSOCKET_PORT):
+    """Splits 'host[:port]' into (host, port)."""
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        return address, default_port
+    return host, int(port)
+
+
+def serve(address, output_dir):
+    """
+    Stand-in for the printer (for testing): accepts AppSocket connections
+    and stores each received job as PDF in the output directory.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    host, port = parse_address(address) if ':' in address else ('localhost', int(address))
+    with socket.create_server((host, port)) as server:
+        print(f'* Waiting for print jobs on {host}:{port} (Ctrl+C to stop)')
+        job = 0
+        while True:
+            conn, peer = server.accept()
+            job += 1
+            filename = os.path.join(output_dir, f'job-{job:04d}.pdf')
+            num_bytes = 0
+            with conn, open(filename, 'wb') as f:
+                for chunk in iter(lambda: conn.recv(1 << 16), b''):
+                    f.write(chunk)
+                    num_bytes += len(chunk)
+            print(f'* Received {num_bytes} bytes from {peer[0]}, saved as "{filename}"')
+            sys.stdout.flush()
+
+
+def parse_args():
+    """Returns the parsed command line arguments."""
+
+    parser = argparse.ArgumentParser(description='Prepare PDFs for the reMarkable printer')
+
+    parser.add_argument('input', action='store', nargs='?', type=str, default=None,
+        help='PDF to print (default: read from stdin)')
+
+    parser.add_argument('--output', dest='output', action='store', type=str, default=None,
+        help='Write the result to this file (- for stdout)')
+
+    parser.add_argument('--send', dest='printer', action='store', type=str, default=None,
+        help=f'Send the result to the printer at HOST[:PORT] via AppSocket (default port: {APPSOCKET_PORT})')
+
+    parser.add_argument('--ppd', dest='ppd', action='store', type=str, default=DEFAULT_PPD,
+        help='PPD which defines the media size, default: %(default)s')
+
+    parser.add_argument('--media', dest='media', action='store', type=str, default=None,
+        help="Media size (as defined in the PPD, e.g. 'A5'), default: the PPD's default media size")
+
+    parser.add_argument('--no-fit', dest='fit', action='store_false', default=True,
+        help="Don't scale the pages to the media size")
+
+    parser.add_argument('--no-images', dest='images', action='store_false', default=True,
+        help="Don't convert/downsample the embedded images")
+
+    parser.add_argument('--jpeg-quality', dest='jpeg_quality', action='store', type=int, default=85,
+        help='Quality of the re-encoded JPEG images, default: %(default)d')
+
+    parser.add_argument('--timeout', dest='timeout', action='store', type=int,
+        default=10, help='Specify connection timeout in seconds, default: %(default)d')
+
+    parser.add_argument('--serve', dest='serve', action='store', type=str, default=None,
+        help='Run a stand-in for the printer on [HOST:]PORT instead (stores the received jobs, see --output-dir)')
+
+    parser.add_argument('--output-dir', dest='output_dir', action='store', type=str, default='received',
+        help='Directory to store the jobs received via --serve, default: %(default)s')
+
+    args = parser.parse_args()
+    if args.serve is None and args.output is None and args.printer is None:
+        parser.error('Specify where to put the result (--output and/or --send)')
+    if args.output is not None and args.printer is not None:
+        parser.error('--output and --send are mutually exclusive')
+    return args
+
+
+def cups_filter():
+    """
+    Runs as CUPS filter: argv is job-id user title copies options [filename],
+    the PPD is given via the environment. Returns the exit code.
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        paper, imageable = parse_ppd_media(os.environ.get('PPD', DEFAULT_PPD))
+        if len(sys.argv) == 7:
+            input_file = sys.argv[6]
+        else:
+            # pikepdf needs a seekable input
+            input_file = tempfile.TemporaryFile()
+            input_file.write(sys.stdin.buffer.read())
+            input_file.seek(0)
+        stats = preflight(input_file, sys.__stdout__.buffer, paper, imageable)
+        print(f"INFO: Preflight: {stats['pages']} page(s), {stats['fitted']} fitted, "
+              f"{stats['images']} image(s) converted")
+    return 0
+
+
+if __name__ == '__main__':
+    if pikepdf is None:
+        print('[ERROR] This script requires pikepdf and Pillow (pip install pikepdf pillow)', file=sys.stderr)
+        sys.exit(2)
+    if len(sys.argv) in [6, 7] and 'PPD' in os.environ and not sys.argv[1].startswith('-'):
+        sys.exit(cups_filter())
+
+    args = parse_args()
+    if args.serve is not None:
+        try:
+            serve(args.serve, args.output_dir)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    try:
+        paper, imageable = parse_ppd_media(args.ppd, args.media)
+    except (OSError, ValueError) as e:
+        print(f'[ERROR] {e}')
+        sys.exit(2)
+    if args.input is None:
+        input_file = tempfile.TemporaryFile()
+        input_file.write(sys.stdin.buffer.read())
+        input_file.seek(0)
+        input_bytes = os.fstat(input_file.fileno()).st_size
+    else:
+        if not os.path.isfile(args.input):
+            print(f'[ERROR] Input file "{args.input}" does not exist')
+            sys.exit(2)
+        input_file = args.input
+        input_bytes = os.path.getsize(args.input)
+
+    # Messages go to stderr if the PDF is written to stdout
+    log = sys.stderr if args.output == '-' else sys.stdout
+    try:
+        with contextlib.redirect_stdout(log):
+            if args.printer is not None:
+                host, port = parse_address(args.printer)
+                print(f'* Sending to {host}:{port}')
+                with socket.create_connection((host, port), timeout=args.timeout) as sock:
+                    writer = CountingWriter(sock)
+                    stats = preflight(input_file, writer, paper, imageable,
+                                      args.fit, args.images, args.jpeg_quality)
+                    sock.shutdown(socket.SHUT_WR)
+                output_bytes = writer.num_bytes
+            elif args.output == '-':
+                stats = preflight(input_file, sys.__stdout__.buffer, paper, imageable,
+                                  args.fit, args.images, args.jpeg_quality)
+                output_bytes = None
+            else:
+                stats = preflight(input_file, args.output, paper, imageable,
+                                  args.fit, args.images, args.jpeg_quality)
+                output_bytes = os.path.getsize(args.output)
+    except (OSError, pikepdf.PdfError) as e:
+        print(f'[ERROR] {e}', file=log)
+        sys.exit(1)
+    print(f"> {stats['pages']} page(s), {stats['fitted']} fitted to the media size, "
+          f"{stats['images']} image(s) converted ({stats['image_bytes_saved'] / 2**10:.0f} KB saved)"
+          + ('' if output_bytes is None else f', {input_bytes} -> {output_bytes} bytes'), file=log)
+    sys.exit(0)
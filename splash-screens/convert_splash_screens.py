@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Converts arbitrary images into device-ready splash screens, i.e. 1404x1872
+8-bit grayscale PNGs (see the splash screen section of the README), which
+are dithered to the gray levels of the e-ink panel.
+
+Each image is resized (fit into the screen, cropped or stretched), blended
+over a white background, converted to grayscale and dithered, either via
+error diffusion (Floyd-Steinberg) or ordered (Bayer) dithering. The images
+are converted in parallel and the outputs are cached by content hash, i.e.
+only new or changed images (or images converted with different options)
+are processed again.
+
+Requires numpy and Pillow.
+
+Usage:
+  python3 convert_splash_screens.py --output-dir converted my-images/*.jpg
+  scp converted/suspended-xyz.png root@<HOSTNAME>:/usr/share/remarkable/suspended.png
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+from PIL import Image, ImageOps
+
+
+# The e-ink panel displays 16 gray levels
+PANEL_GRAY_LEVELS = 16
+
+# Normalized 8x8 Bayer threshold map (values in (0, 1))
+BAYER_8X8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21]], dtype=np.float64)
+BAYER_8X8 = (BAYER_8X8 + 0.5) / 64
+
+DITHER_METHODS = ['floyd-steinberg', 'ordered', 'none']
+FIT_MODES = ['pad', 'crop', 'stretch']
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.webp']
+
+# Cache of the converted images (stored within the output directory)
+CONVERSION_MANIFEST = 'conversion_manifest.json'
+
+
+def load_grayscale(filename, background=255):
+    """Loads the image (respecting its EXIF orientation) as float grayscale array in [0, 255]."""
+    with Image.open(filename) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ['RGBA', 'LA', 'PA'] or (img.mode == 'P' and 'transparency' in img.info):
+            # Blend transparent regions over the background
+            img = img.convert('RGBA')
+            bg = Image.new('RGBA', img.size, (background, background, background, 255))
+            img = Image.alpha_composite(bg, img)
+        return np.asarray(img.convert('L'), dtype=np.float64)
+
+
+def resize(gray, width, height, fit='pad', rotate=False, background=255):
+    """
+    Resizes the grayscale image to the screen size. The fit mode can be 'pad'
+    (keep the aspect ratio, fill the borders with the background), 'crop'
+    (keep the aspect ratio, crop the center) or 'stretch'. If rotate is set,
+    landscape images are rotated by 90 degrees to fill the portrait screen.
+    """
+    if rotate and gray.shape[1] > gray.shape[0] and width < height:
+        gray = np.rot90(gray)
+    if gray.shape == (height, width):
+        return gray
+    img = Image.fromarray(gray.astype(np.float32))
+    if fit == 'stretch':
+        return np.asarray(img.resize((width, height), Image.LANCZOS), dtype=np.float64)
+    if fit == 'crop':
+        scale = max(width / img.width, height / img.height)
+    else:
+        scale = min(width / img.width, height / img.height)
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    scaled = np.asarray(img.resize(size, Image.LANCZOS), dtype=np.float64)
+    canvas = np.full((height, width), float(background))
+    # Center the scaled image (negative offsets crop it)
+    left, top = (width - size[0]) // 2, (height - size[1]) // 2
+    src_x, src_y = max(0, -left), max(0, -top)
+    dst_x, dst_y = max(0, left), max(0, top)
+    w, h = min(width - dst_x, size[0] - src_x), min(height - dst_y, size[1] - src_y)
+    canvas[dst_y:dst_y + h, dst_x:dst_x + w] = scaled[src_y:src_y + h, src_x:src_x + w]
+    return canvas
+
+
+def quantize(values, levels):
+    """Rounds the gray values (in [0, 255]) to the nearest of the evenly spaced levels."""
+    step = 255 / (levels - 1)
+    return np.clip(np.rint(values / step), 0, levels - 1) * step
+
+
+def dither_ordered(gray, levels):
+    """Ordered dithering via the tiled 8x8 Bayer threshold map."""
+    height, width = gray.shape
+    thresholds = np.tile(BAYER_8X8, (height // 8 + 1, width // 8 + 1))[:height, :width]
+    scaled = np.clip(gray, 0, 255) * ((levels - 1) / 255)
+    idx = np.clip(np.floor(scaled + thresholds), 0, levels - 1)
+    return idx * (255 / (levels - 1))
+
+
+def dither_floyd_steinberg(gray, levels):
+    """
+    Floyd-Steinberg error diffusion, vectorized along anti-diagonal wavefronts.
+
+    A pixel (y, x) only depends on its left neighbor and on the three pixels
+    above (left, center, right). Thus, all pixels with the same x + 2y are
+    independent of each other and can be processed at once, i.e. we need
+    width + 2 * height vectorized steps instead of width * height iterations.
+    """
+    height, width = gray.shape
+    # Padding: one column left/right and one row at the bottom
+    buf = np.zeros((height + 1, width + 2))
+    buf[:height, 1:width + 1] = gray
+    out = np.empty((height, width))
+    for t in range(width + 2 * (height - 1)):
+        y0 = max(0, (t - width + 2) // 2)
+        y1 = min(height - 1, t // 2)
+        ys = np.arange(y0, y1 + 1)
+        xs = t - 2 * ys
+        old = buf[ys, xs + 1]
+        new = quantize(old, levels)
+        out[ys, xs] = new
+        err = old - new
+        buf[ys, xs + 2] += err * (7 / 16)
+        buf[ys + 1, xs] += err * (3 / 16)
+        buf[ys + 1, xs + 1] += err * (5 / 16)
+        buf[ys + 1, xs + 2] += err * (1 / 16)
+    return out
+
+
+def dither(gray, levels=PANEL_GRAY_LEVELS, method='floyd-steinberg'):
+    """Dithers the grayscale image to the given number of gray levels, returns an uint8 array."""
+    if method == 'floyd-steinberg':
+        result = dither_floyd_steinberg(gray, levels)
+    elif method == 'ordered':
+        result = dither_ordered(gray, levels)
+    elif method == 'none':
+        result = quantize(gray, levels)
+    else:
+        raise ValueError(f'Unknown dithering method "{method}", use one of {DITHER_METHODS}')
+    return np.clip(np.rint(result), 0, 255).astype(np.uint8)
+
+
+def convert_image(src_filename, dst_filename, options):
+    """
+    Converts a single image (see conversion_options) and saves it as 8-bit
+    grayscale PNG. Returns a dict with the keys src, dst, success and error.
+    """
+    result = dict(src=src_filename, dst=dst_filename, success=False, error=None)
+    try:
+        gray = load_grayscale(src_filename, options['background'])
+        gray = resize(gray, options['width'], options['height'], options['fit'],
+                      options['rotate'], options['background'])
+        pixels = dither(gray, options['levels'], options['dither'])
+        tmp_filename = f'{dst_filename}.tmp.png'
+        Image.fromarray(pixels).save(tmp_filename, optimize=True)
+        os.replace(tmp_filename, dst_filename)
+        result['success'] = True
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def conversion_options(args):
+    """Returns the options which affect the outputs (also part of the cache key)."""
+    return dict(width=args.width, height=args.height, levels=args.levels,
+                dither=args.dither, fit=args.fit, rotate=args.rotate,
+                background=args.background)
+
+
+def file_digest(filename):
+    """Returns the SHA-256 hex digest of the file's content."""
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def conversion_digest(src_filename, options):
+    """
+    Returns the cache key of a conversion, i.e. a digest over the source
+    image, the options and this script (so changes to the dithering
+    invalidate the cache, too).
+    """
+    sha = hashlib.sha256()
+    sha.update(file_digest(src_filename).encode('utf-8'))
+    sha.update(file_digest(os.path.abspath(__file__)).encode('utf-8'))
+    sha.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def load_manifest(filename):
+    """Loads the conversion manifest (or returns an empty one)."""
+    if not os.path.exists(filename):
+        return dict()
+    try:
+        with open(filename, 'r') as jf:
+            return json.load(jf)
+    except ValueError:
+        print(f'[WARNING] Ignoring corrupt conversion manifest "{filename}"')
+        return dict()
+
+
+def save_manifest(manifest, filename):
+    """Writes the conversion manifest (via a temporary file to avoid partial writes)."""
+    with open(f'{filename}.tmp', 'w') as jf:
+        json.dump(manifest, jf, indent=2, sort_keys=True)
+        jf.write('\n')
+    os.replace(f'{filename}.tmp', filename)
+
+
+def is_up_to_date(manifest_entry, digest, dst_filename):
+    """Checks whether the cached output matches the digest and hasn't been modified since."""
+    return manifest_entry is not None and manifest_entry.get('digest') == digest\
+        and os.path.exists(dst_filename) and file_digest(dst_filename) == manifest_entry.get('output')
+
+
+def collect_images(inputs):
+    """Returns the image files given directly or contained in the given directories (sorted)."""
+    filenames = list()
+    for path in inputs:
+        if os.path.isdir(path):
+            filenames.extend(sorted(os.path.join(path, f) for f in os.listdir(path)
+                                    if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS))
+        else:
+            filenames.append(path)
+    return filenames
+
+
+def convert_images(src_filenames, output_dir, options, num_workers, force=False):
+    """
+    Converts all given images into the output directory, either sequentially
+    (num_workers = 1) or via a process pool. Images which have already been
+    converted with the same options (according to the conversion manifest)
+    are skipped, unless force is set.
+
+    Returns the list of failed and the list of skipped images.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_filename = os.path.join(output_dir, CONVERSION_MANIFEST)
+    manifest = load_manifest(manifest_filename)
+    failed = list()
+    skipped = list()
+    jobs = list()
+    # Output name => source image, to detect inputs which would overwrite each other (e.g. foo.jpg and foo.png)
+    outputs = dict()
+    for src in src_filenames:
+        name = f'{os.path.splitext(os.path.basename(src))[0]}.png'
+        dst = os.path.join(output_dir, name)
+        if name in outputs:
+            print(f'[ERROR] "{src}" and "{outputs[name]}" would both be converted to "{dst}", rename one of them.')
+            failed.append(src)
+            continue
+        outputs[name] = src
+        if os.path.abspath(src) == os.path.abspath(dst):
+            print(f'[ERROR] Cannot convert "{src}" in-place, choose a different output directory.')
+            failed.append(src)
+            continue
+        digest = conversion_digest(src, options)
+        if not force and is_up_to_date(manifest.get(name), digest, dst):
+            print(f'* "{src}" is up to date, skipping.')
+            skipped.append(src)
+            continue
+        jobs.append((src, dst, name, digest))
+
+    def report(result, name, digest):
+        if result['success']:
+            print(f'* Converted "{result["src"]}" to "{result["dst"]}"')
+            manifest[name] = dict(source=os.path.basename(result['src']), digest=digest,
+                                  output=file_digest(result['dst']))
+        else:
+            print(f'[ERROR] Cannot convert "{result["src"]}": {result["error"]}')
+            manifest.pop(name, None)
+            failed.append(result['src'])
+        sys.stdout.flush()
+
+    if num_workers == 1:
+        for src, dst, name, digest in jobs:
+            report(convert_image(src, dst, options), name, digest)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as pool:
+            futures = {pool.submit(convert_image, src, dst, options): (name, digest)
+                       for src, dst, name, digest in jobs}
+            for future in concurrent.futures.as_completed(futures):
+                report(future.result(), *futures[future])
+    save_manifest(manifest, manifest_filename)
+    return failed, skipped
+
+
+def parse_args():
+    """Returns the parsed command line arguments."""
+
+    parser = argparse.ArgumentParser(description='Convert images into device-ready splash screens')
+
+    parser.add_argument('inputs', action='store', nargs='+', type=str,
+        help='Image files or directories containing the images to convert')
+
+    parser.add_argument('--output-dir', dest='output_dir', action='store', type=str, default='converted',
+        help='Directory to store the converted splash screens, default: %(default)s')
+
+    parser.add_argument('--width', dest='width', action='store', type=int, default=1404,
+        help='Width of the splash screens in pixels, default: %(default)d')
+
+    parser.add_argument('--height', dest='height', action='store', type=int, default=1872,
+        help='Height of the splash screens in pixels, default: %(default)d')
+
+    parser.add_argument('--levels', dest='levels', action='store', type=int, default=PANEL_GRAY_LEVELS,
+        help='Number of gray levels to dither to (the e-ink panel displays 16), default: %(default)d')
+
+    parser.add_argument('--dither', dest='dither', action='store', choices=DITHER_METHODS,
+        default='floyd-steinberg',
+        help='Dithering method (error diffusion, ordered/Bayer or plain quantization), default: %(default)s')
+
+    parser.add_argument('--fit', dest='fit', action='store', choices=FIT_MODES, default='pad',
+        help="How to resize images with a different aspect ratio ('pad' fills the borders with "
+             "the background, 'crop' cuts off the borders), default: %(default)s")
+
+    parser.add_argument('--rotate', dest='rotate', action='store_true', default=False,
+        help='Rotate landscape images by 90 degrees to fill the portrait screen, default: %(default)s')
+
+    parser.add_argument('--background', dest='background', action='store', type=int, default=255,
+        help='Gray value of the background (padding and transparent regions), default: %(default)d')
+
+    parser.add_argument('--workers', dest='num_workers', action='store', type=int,
+        default=os.cpu_count(),
+        help='Number of worker processes converting the images in parallel (1 disables the process pool), default: %(default)d')
+
+    parser.add_argument('--force', dest='force', action='store_true', default=False,
+        help=f'Convert all images, even if they are up to date according to {CONVERSION_MANIFEST}, default: %(default)s')
+
+    args = parser.parse_args()
+    if args.num_workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.levels < 2 or args.levels > 256:
+        parser.error('--levels must be between 2 and 256')
+    if args.width < 1 or args.height < 1:
+        parser.error('--width and --height must be positive')
+    if args.background < 0 or args.background > 255:
+        parser.error('--background must be between 0 and 255')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    src_filenames = collect_images(args.inputs)
+    if len(src_filenames) == 0:
+        print('[ERROR] No images to convert.')
+        sys.exit(2)
+    failed, skipped = convert_images(src_filenames, args.output_dir, conversion_options(args),
+                                     args.num_workers, args.force)
+    print()
+    if len(failed) > 0:
+        print(f'[ERROR] {len(failed)} of {len(src_filenames)} image(s) failed: {failed}')
+        sys.exit(1)
+    print(f'> Successfully converted {len(src_filenames) - len(skipped)} image(s), {len(skipped)} were up to date.')
+    sys.exit(0)
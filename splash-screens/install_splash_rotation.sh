@@ -0,0 +1,96 @@
+#!/bin/bash --
+#
+# Uploads all suspend screens (suspended-*.png) to the device once and installs
+# a systemd timer, which rotates the active suspend screen on the device itself
+# (see rotate_suspend_screen.sh). Re-run this script after changing the set of
+# suspend screens.
+#
+# Usage:
+#   ./install_splash_rotation.sh HOSTNAME [TIMER_SPEC [IMAGE_DIR]]
+#   ./install_splash_rotation.sh HOSTNAME --uninstall
+#
+# Params:
+# HOSTNAME   The device's hostname/IP (requires SSH access as root)
+# TIMER_SPEC systemd calendar specification of the rotation, e.g. daily
+#            (must not contain '/'), default: hourly
+# IMAGE_DIR  Directory containing the suspended-*.png images, default: the
+#            directory this script is located at
+
+if [[ $# < 1 ]]
+then
+  echo "Usage: $0 HOSTNAME [TIMER_SPEC [IMAGE_DIR]] | HOSTNAME --uninstall"
+  exit 2
+fi
+host="$1"
+timerspec="${2:-hourly}"
+
+# Get the directory this script is located at (not from where it's called!)
+scriptdir="${BASH_SOURCE%/*}"
+if [[ ! -d "$scriptdir" ]];
+then
+  scriptdir="$PWD"
+fi
+imgdir="${3:-$scriptdir}"
+
+# Location of the suspend screens and the rotation script on the device (the
+# home directory survives firmware updates)
+rotdir=/home/root/splash-rotation
+unit=rotate-suspend-screen
+
+if [ "${timerspec}" = "--uninstall" ]
+then
+  ssh root@${host} /bin/bash -s <<EOS
+cd "${rotdir}" || exit 1
+source ./bashfun.sh
+uninstall_systemd_unit ${unit}.timer
+uninstall_systemd_unit ${unit}.service
+# Restore the stock suspend screen
+target=/usr/share/remarkable/suspended.png
+if [ -L "\${target}" ] && [ -f suspended.png.orig ]
+then
+  cp suspended.png.orig "\${target}.tmp" && mv -f "\${target}.tmp" "\${target}"
+fi
+cd / && rm -rf "${rotdir}"
+EOS
+  exit $?
+fi
+
+shopt -s nullglob
+images=("${imgdir}"/suspended-*.png)
+if [ ${#images[@]} -eq 0 ]
+then
+  echo "[ERROR] No suspend screens (suspended-*.png) found in ${imgdir}"
+  exit 1
+fi
+echo "* Uploading ${#images[@]} suspend screen(s) to ${host}:${rotdir}"
+names=("${images[@]##*/}")
+printf '%s\n' "${names[@]}" > "${scriptdir}/.rotation-images.txt"
+
+# Upload everything as a single tar stream (a single connection instead of
+# one scp per file)
+tar -c -C "${imgdir}" "${names[@]}" \
+    -C "${scriptdir}" rotate_suspend_screen.sh ${unit}.service ${unit}.timer .rotation-images.txt \
+    -C "${scriptdir}/../templates" bashfun.sh \
+  | ssh root@${host} "mkdir -p ${rotdir} && tar -x -C ${rotdir}"
+rv=$?
+rm -f "${scriptdir}/.rotation-images.txt"
+if [ $rv -ne 0 ]
+then
+  echo "[ERROR] Uploading the suspend screens failed"
+  exit $rv
+fi
+
+echo "* Installing the rotation timer (${timerspec})"
+ssh root@${host} /bin/bash -s <<EOS
+cd "${rotdir}" || exit 1
+# Remove suspend screens which are no longer part of the set
+for f in suspended-*.png
+do
+  grep -qxF "\${f}" .rotation-images.txt || rm -f "\${f}"
+done
+source ./bashfun.sh
+install_service ${unit} false "${rotdir}"
+install_timer ${unit} "${timerspec}"
+# Activate the first/next suspend screen right away
+systemctl start ${unit}.service
+EOS
@@ -0,0 +1,46 @@
+#!/bin/bash --
+#
+# Activates the next suspend screen (round-robin), i.e. replaces the device's
+# suspended.png by a symlink to the next suspended-*.png of the rotation
+# directory. The images are already stored on the device, so a rotation
+# doesn't transfer any data and doesn't require restarting xochitl (it loads
+# the suspend screen whenever the device goes to sleep).
+# Invoked by the rotate-suspend-screen service (see install_splash_rotation.sh).
+#
+# Params:
+# $1 ROTATION_DIR (optional, default: the directory this script is located at)
+# $2 SUSPEND_SCREEN (optional, default: /usr/share/remarkable/suspended.png)
+
+rotdir="${1:-$(cd "$(dirname "${BASH_SOURCE[0]}")" >/dev/null 2>&1 && pwd)}"
+target="${2:-/usr/share/remarkable/suspended.png}"
+
+shopt -s nullglob
+images=("${rotdir}"/suspended-*.png)
+if [ ${#images[@]} -eq 0 ]
+then
+  echo "No suspend screens (suspended-*.png) found in ${rotdir}"
+  exit 1
+fi
+
+# Keep the stock suspend screen, so it can be restored upon uninstalling
+if [ -f "${target}" ] && [ ! -L "${target}" ] && [ ! -f "${rotdir}/suspended.png.orig" ]
+then
+  cp "${target}" "${rotdir}/suspended.png.orig"
+fi
+
+# Pick the image after the currently active one
+current="$(readlink "${target}")"
+next="${images[0]}"
+for i in "${!images[@]}"
+do
+  if [ "${images[$i]}" = "${current}" ]
+  then
+    next="${images[$(( (i + 1) % ${#images[@]} ))]}"
+    break
+  fi
+done
+
+# Swap the symlink atomically (rename), so xochitl never sees a missing file
+ln -sf "${next}" "${target}.tmp"
+mv -f "${target}.tmp" "${target}"
+echo "Activated suspend screen: ${next}"
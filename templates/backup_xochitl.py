@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Incremental backup (and restore) of the device's content directory, i.e.
+all notebooks, PDFs, ebooks and their metadata.
+
+Instead of copying every file via 'scp -r' each time, this script:
+* lists the remote directory (size, modification time and - for all files
+  which changed since the last backup - the MD5 checksum) via a single
+  remote command,
+* pulls only the new or changed files as compressed tar streams (in
+  batches, via parallel streams over the same connection),
+* verifies their checksums and moves them into place,
+* and records the backed up state in a manifest (backup_manifest.json
+  within the backup directory), so the next backup only transfers the delta.
+
+Files which have been removed from the device are kept in the backup (and
+flagged as removed in the manifest) unless --delete is given.
+
+The restore mode (--restore) pushes all files of the backup which are
+missing or differ on the device back in parallel tar streams, verifies their
+checksums on the device and restarts the UI. Files which have been removed
+from the device are only restored with --include-removed.
+
+Usage:
+  python3 backup_xochitl.py --host 10.11.99.1 --output rm2-backup/xochitl
+  python3 backup_xochitl.py --host 10.11.99.1 --output rm2-backup/xochitl --restore
+  python3 backup_xochitl.py --host 10.11.99.1 --output rm2-backup/xochitl --restore --include-removed
+"""
+
+import argparse
+import concurrent.futures
+import io
+import os
+import shlex
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+
+from jsonstore import load_json, save_json
+from transport import TransportError, create_transport, file_checksum, make_tar, parse_checksums, unpack_command
+
+
+# Location of the user's content on the device
+REMOTE_XOCHITL_DIR = '/home/root/.local/share/remarkable/xochitl'
+
+# Manifest of the backed up files (stored within the backup directory)
+BACKUP_MANIFEST = 'backup_manifest.json'
+
+# Maximum number of files per batch, since all paths of a batch are passed
+# on a single remote command line (limited to 128 KiB)
+MAX_BATCH_FILES = 200
+
+
+def listing_command(remote_dir):
+    """
+    Returns the remote shell command which lists all files of the remote
+    directory as 'size mtime ./path' lines, followed by a '--' separator
+    line and the MD5 checksums of all files which aren't listed (with the
+    same size and mtime) in the command's stdin, i.e. the known files.
+    """
+    # The known files are passed via stdin. awk's NR==FNR idiom requires a
+    # non-empty stdin, thus the caller always sends a header line.
+    # Note: xochitl names its files by UUIDs, so they don't contain whitespace.
+    return (f'cd {shlex.quote(remote_dir)} && listing=$(mktemp) && trap \'rm -f "$listing"\' EXIT && '
+            'find . -type f -exec stat -c \'%s %Y %n\' {} + > "$listing" && cat "$listing" && echo -- && '
+            'awk \'NR == FNR { known[$0] = 1; next } !($0 in known) { sub(/^[0-9]+ [0-9]+ /, ""); print }\' '
+            '- "$listing" | xargs -r md5sum')
+
+
+def list_remote(session, remote_dir, known):
+    """
+    Lists the files of the remote directory via a single remote command.
+    Returns a dict (relative path: dict(size, mtime, md5)). The checksums
+    of files which are known (same path, size and mtime as in the given
+    dict of the same format) aren't recomputed on the device, but taken from
+    the known entries.
+    """
+    lines = ['# known files'] + [f"{e['size']} {e['mtime']} ./{path}" for path, e in known.items()]
+    output = session.run(listing_command(remote_dir), input=('\n'.join(lines) + '\n').encode('utf-8'))
+    lines = output.decode('utf-8').splitlines()
+    separator = lines.index('--')
+    checksums = {f[2:]: c for f, c in parse_checksums('\n'.join(lines[separator + 1:])).items()}
+    files = dict()
+    for line in lines[:separator]:
+        size, mtime, path = line.split(' ', 2)
+        path = path[2:]
+        entry = dict(size=int(size), mtime=int(mtime), md5=checksums.get(path))
+        if entry['md5'] is None and path in known:
+            entry['md5'] = known[path]['md5']
+        files[path] = entry
+    return files
+
+
+def split_batches(paths, files, max_bytes, max_files=MAX_BATCH_FILES):
+    """
+    Splits the paths into batches of at most max_bytes (a larger file forms
+    its own batch) and max_files.
+    """
+    batches = list()
+    batch, batch_bytes = list(), 0
+    for path in paths:
+        size = files[path]['size']
+        if len(batch) > 0 and (batch_bytes + size > max_bytes or len(batch) >= max_files):
+            batches.append(batch)
+            batch, batch_bytes = list(), 0
+        batch.append(path)
+        batch_bytes += size
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def load_manifest(backup_dir):
+    """Loads the backup manifest (or returns an empty one)."""
+    return load_json(os.path.join(backup_dir, BACKUP_MANIFEST),
+                     lambda: dict(files=dict()), 'backup manifest')
+
+
+def save_manifest(manifest, backup_dir):
+    """Writes the backup manifest (via a temporary file to avoid partial writes)."""
+    save_json(manifest, os.path.join(backup_dir, BACKUP_MANIFEST))
+
+
+def pull_batch(session, remote_dir, backup_dir, paths, files, compress):
+    """
+    Downloads the files as a single tar stream into a staging directory,
+    verifies their checksums and moves them into place. Returns the lists
+    of the backed up and the failed paths, and the number of transferred bytes.
+    """
+    names = ' '.join(shlex.quote(p) for p in paths)
+    data = session.run(f'cd {shlex.quote(remote_dir)} && tar -c{"z" if compress else ""}f - {names}')
+    staging = tempfile.mkdtemp(prefix='.download.', dir=backup_dir)
+    done, failed = list(), list()
+    try:
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz' if compress else 'r') as tar:
+            # Only extract the requested files (the archive comes from the device)
+            requested = set(paths)
+            tar.extractall(staging, members=[m for m in tar.getmembers()
+                                             if m.isfile() and os.path.normpath(m.name) in requested])
+        for path in paths:
+            filename = os.path.join(staging, path)
+            if not os.path.exists(filename) or file_checksum(filename) != files[path]['md5']:
+                # E.g. the file changed since it was listed
+                failed.append(path)
+                continue
+            target = os.path.join(backup_dir, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(filename, target)
+            done.append(path)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return done, failed, len(data)
+
+
+def push_batch(session, remote_dir, backup_dir, paths, files, compress):
+    """
+    Uploads the files as a single tar stream, moves them into place on the
+    device and verifies their checksums (within the same remote command).
+    Returns the lists of the restored and the failed paths, and the number
+    of transferred bytes.
+    """
+    data = make_tar([(os.path.join(backup_dir, p), p) for p in paths], compress)
+    dirs = sorted(set(os.path.dirname(p) for p in paths if os.path.dirname(p)))
+    commands = [f'mkdir -p {" ".join(shlex.quote(d) for d in dirs)}'] if dirs else list()
+    commands += [f'mv -f "$staging"/{shlex.quote(p)} {shlex.quote(p)}' for p in paths]
+    commands.append(f'md5sum {" ".join(shlex.quote(p) for p in paths)}')
+    output = session.run(unpack_command(None, remote_dir, compress, ' && '.join(commands)), input=data)
+    checksums = parse_checksums(output.decode('utf-8'))
+    done = [p for p in paths if checksums.get(p) == files[p]['md5']]
+    failed = [p for p in paths if checksums.get(p) != files[p]['md5']]
+    return done, failed, len(data)
+
+
+def transfer_batches(transfer, batches, num_workers):
+    """
+    Runs the transfer function for each batch, in parallel streams (over the
+    same connection) if num_workers > 1. Returns the lists of the transferred
+    and the failed paths, and the total number of transferred bytes.
+    """
+    done, failed, num_bytes = list(), list(), 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as pool:
+        futures = {pool.submit(transfer, batch): batch for batch in batches}
+        for future in concurrent.futures.as_completed(futures):
+            batch = futures[future]
+            try:
+                batch_done, batch_failed, batch_bytes = future.result()
+            except (TransportError, OSError, tarfile.TarError) as e:
+                print(f'[ERROR] Transfer of {len(batch)} file(s) failed: {e}')
+                batch_done, batch_failed, batch_bytes = list(), batch, 0
+            done.extend(batch_done)
+            failed.extend(batch_failed)
+            num_bytes += batch_bytes
+            print(f'* Transferred {len(done) + len(failed)} file(s), {num_bytes / 2**20:.1f} MB so far')
+            sys.stdout.flush()
+    return done, failed, num_bytes
+
+
+def backup(args, session):
+    """Pulls all new/changed files from the device. Returns the number of failed files."""
+    os.makedirs(args.backup_dir, exist_ok=True)
+    manifest = load_manifest(args.backup_dir)
+    if manifest.get('remote_dir', args.remote_dir) != args.remote_dir:
+        print(f"[WARNING] The backup was created from {manifest['remote_dir']}, not {args.remote_dir}")
+    known = manifest['files']
+    print(f'* Listing {args.remote_dir} on the device')
+    files = list_remote(session, args.remote_dir, known)
+    changed = [p for p, e in files.items()
+               if p not in known or known[p]['md5'] != e['md5']
+               or not os.path.exists(os.path.join(args.backup_dir, p))]
+    removed = [p for p in known if p not in files]
+    num_removed = sum(1 for p in removed if not known[p].get('removed', False))
+    print(f'* {len(files)} file(s) on the device, {len(changed)} new/changed, {num_removed} removed')
+
+    # Files which only got a new mtime (but have the same content) don't
+    # need to be transferred
+    backed_up = {p: e for p, e in files.items() if p not in changed}
+    batches = split_batches(sorted(changed), files, args.batch_bytes)
+    done, failed, num_bytes = transfer_batches(
+        lambda batch: pull_batch(session, args.remote_dir, args.backup_dir, batch, files, args.compress),
+        batches, args.num_workers)
+    backed_up.update({p: files[p] for p in done})
+
+    for path in removed:
+        if args.delete:
+            filename = os.path.join(args.backup_dir, path)
+            if os.path.exists(filename):
+                os.remove(filename)
+        elif os.path.exists(os.path.join(args.backup_dir, path)):
+            # Keep the file (e.g. an accidentally deleted notebook), so it
+            # can be restored via --include-removed
+            if not known[path].get('removed', False):
+                print(f'* Keeping "{path}" (removed from the device, see --delete)')
+            backed_up[path] = dict(known[path], removed=True)
+    save_manifest(dict(remote_dir=args.remote_dir, files=backed_up), args.backup_dir)
+    print(f'* Pulled {len(done)} file(s), {num_bytes / 2**20:.1f} MB')
+    for path in failed:
+        print(f'[ERROR] Cannot back up "{path}" (changed during the backup or transfer failed)')
+    return len(failed)
+
+
+def restore(args, session):
+    """Pushes all files of the backup which are missing/differ on the device. Returns the number of failed files."""
+    manifest = load_manifest(args.backup_dir)
+    if len(manifest['files']) == 0:
+        print(f'[ERROR] No backup found in {args.backup_dir}')
+        return 1
+    files = {p: e for p, e in manifest['files'].items()
+             if args.include_removed or not e.get('removed', False)}
+    num_skipped = len(manifest['files']) - len(files)
+    print(f'* Listing {args.remote_dir} on the device')
+    session.run(f'mkdir -p {shlex.quote(args.remote_dir)}')
+    remote = list_remote(session, args.remote_dir, files)
+    outdated = [p for p, e in files.items() if p not in remote or remote[p]['md5'] != e['md5']]
+    print(f'* {len(files)} file(s) in the backup, {len(outdated)} missing/differ on the device')
+    if num_skipped > 0:
+        print(f'* Skipping {num_skipped} file(s) which have been removed from the device (see --include-removed)')
+    if len(outdated) == 0:
+        print('> Nothing to restore.')
+        return 0
+    batches = split_batches(sorted(outdated), files, args.batch_bytes)
+    done, failed, num_bytes = transfer_batches(
+        lambda batch: push_batch(session, args.remote_dir, args.backup_dir, batch, files, args.compress),
+        batches, args.num_workers)
+    print(f'* Pushed and verified {len(done)} file(s), {num_bytes / 2**20:.1f} MB')
+    for path in failed:
+        print(f'[ERROR] Cannot restore "{path}" (checksum mismatch or transfer failed)')
+    if args.restart and len(done) > 0:
+        # xochitl only picks up the restored documents after a restart
+        print('* Restarting the UI')
+        session.restart_ui()
+    return len(failed)
+
+
+def parse_args():
+    """Returns the parsed command line arguments."""
+
+    parser = argparse.ArgumentParser(description='Incremental backup/restore of the notebooks and documents')
+
+    parser.add_argument('--host', dest='hostname', action='store', type=str,
+        default='10.11.99.1', help='IP or hostname of the device, default: %(default)s')
+
+    parser.add_argument('--transport', dest='transport', action='store',
+        choices=['ssh', 'paramiko'], default='ssh',
+        help="Connect via the ssh/scp tools ('ssh') or the in-process SSH client ('paramiko', "
+             "requires pip install paramiko), default: %(default)s")
+
+    parser.add_argument('--timeout', dest='timeout', action='store', type=int,
+        default=10, help='Specify connection timeout in seconds, default: %(default)d')
+
+    parser.add_argument('--output', dest='backup_dir', action='store', type=str,
+        default='rm2-backup/xochitl', help='Local backup directory, default: %(default)s')
+
+    parser.add_argument('--remote-dir', dest='remote_dir', action='store', type=str,
+        default=REMOTE_XOCHITL_DIR, help='Content directory on the device, default: %(default)s')
+
+    parser.add_argument('--restore', dest='restore', action='store_true', default=False,
+        help='Push the backup to the device instead (only files which are missing or differ), default: %(default)s')
+
+    parser.add_argument('--workers', dest='num_workers', action='store', type=int,
+        default=4, help='Number of parallel transfer streams, default: %(default)d')
+
+    parser.add_argument('--batch-size', dest='batch_mb', action='store', type=float,
+        default=32, help='Maximum size of a single tar stream in MB, default: %(default)s')
+
+    parser.add_argument('--no-compress', dest='compress', action='store_false', default=True,
+        help="Don't compress the tar streams (gzip), e.g. via the USB connection")
+
+    parser.add_argument('--delete', dest='delete', action='store_true', default=False,
+        help='Delete files from the backup which have been removed from the device, default: %(default)s')
+
+    parser.add_argument('--include-removed', dest='include_removed', action='store_true', default=False,
+        help='Also restore files which have been removed from the device since, default: %(default)s')
+
+    parser.add_argument('--no-restart', dest='restart', action='store_false', default=True,
+        help="Don't restart the UI after restoring files")
+
+    args = parser.parse_args()
+    if args.num_workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.batch_mb <= 0:
+        parser.error('--batch-size must be positive')
+    args.batch_bytes = int(args.batch_mb * 2**20)
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    start_time = time.perf_counter()
+    try:
+        with create_transport(args.transport, args.hostname, args.timeout) as session:
+            num_failed = restore(args, session) if args.restore else backup(args, session)
+            stats = session.stats
+    except TransportError as e:
+        print(f'[ERROR] {e}')
+        sys.exit(1)
+    print(f"* {stats['commands']} remote command(s), {stats['bytes_sent'] / 2**20:.1f} MB sent, "
+          f"{stats['bytes_received'] / 2**20:.1f} MB received in {time.perf_counter() - start_time:.1f} s")
+    print()
+    if num_failed > 0:
+        print(f'[ERROR] {num_failed} file(s) failed')
+        sys.exit(1)
+    print(f"> {'Restore' if args.restore else 'Backup'} finished successfully.")
+    sys.exit(0)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Benchmarks the scripted templates, i.e. times each step of building a
+template (svgwrite drawing, saving, text conversion and PNG export) and
+records the output sizes, so we can spot changes to scripted_templates.py
+which make the build slower or the outputs larger.
+
+Usage:
+  python benchmark_templates.py --output baseline.json
+  # ... change something ...
+  python benchmark_templates.py --output current.json --compare baseline.json
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import rasterizer
+import scripted_templates as st
+
+
+def count_elements(dwg):
+    """Returns the number of XML elements of the drawing."""
+    return sum(1 for _ in dwg.get_xml().iter())
+
+
+def timed(func, repeat):
+    """
+    Runs func repeat times and returns (min, median) runtime in [s] and the
+    result of the last run.
+    """
+    runtimes = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        runtimes.append(time.perf_counter() - start)
+    return dict(min_s=min(runtimes), median_s=statistics.median(runtimes)), result
+
+
+def benchmark_template(job, out_dir, repeat, font_filename, use_inkscape):
+    """
+    Benchmarks a single (registered) template. Returns a dict holding the
+    runtimes of each step, the number of SVG elements and the output sizes.
+    Steps which cannot run (e.g. no font or inkscape available, or the
+    rasterizer doesn't support the drawing) are skipped.
+    """
+    rmfilename = job['rmfilename']
+    svg_filename = os.path.join(out_dir, f'{rmfilename}.svg')
+    steps = dict()
+    png_bytes = dict()
+
+    generator, params = job['export']
+    steps['build'], dwg = timed(lambda: generator(svg_filename, **params), repeat)
+    dwg_display = None
+    if job['display'] is not None:
+        generator, params = job['display']
+        steps['build_display'], dwg_display = timed(
+            lambda: generator(os.path.join(out_dir, f'{rmfilename}.display.svg'), **params), repeat)
+    elif job['display_overlay'] is not None:
+        steps['build_display'], dwg_display = timed(lambda: st.display_overlay(job)(dwg), repeat)
+    steps['save'], _ = timed(dwg.save, repeat)
+    result = dict(steps=steps, elements=count_elements(dwg),
+                  svg_bytes=os.path.getsize(svg_filename), png_bytes=png_bytes)
+
+    text = st.has_text(dwg)
+    if text and font_filename is not None:
+        def outline():
+            tmp = copy.deepcopy(dwg)
+            st.glyphs.outline_text(tmp, font_filename)
+            return tmp
+        steps['text_to_path:glyphs'], outlined = timed(outline, repeat)
+        outlined_filename = os.path.join(out_dir, f'{rmfilename}.glyphs.svg')
+        outlined.saveas(outlined_filename)
+        result['svg_bytes:glyphs'] = os.path.getsize(outlined_filename)
+    if text and use_inkscape:
+        inkscape_filename = os.path.join(out_dir, f'{rmfilename}.inkscape.svg')
+        def inkscape_text():
+            shutil.copyfile(svg_filename, inkscape_filename)
+            st.InkscapeConverter().text_to_path(rmfilename, inkscape_filename)
+        steps['text_to_path:inkscape'], _ = timed(inkscape_text, repeat)
+        result['svg_bytes:inkscape'] = os.path.getsize(inkscape_filename)
+
+    # The PNG is rendered from the display template (if there is one)
+    png_dwg = dwg if dwg_display is None else dwg_display
+    png_filename = os.path.join(out_dir, f'{rmfilename}.png')
+    try:
+        steps['png:numpy'], _ = timed(
+            lambda: rasterizer.save_png(png_dwg, png_filename, *st.rm2dimensions()[:2],
+                                        bit_depth=st.DEFAULT_BUILD_OPTIONS['png_bit_depth'],
+                                        levels=st.DEFAULT_BUILD_OPTIONS['gray_levels']), repeat)
+        png_bytes['numpy'] = os.path.getsize(png_filename)
+    except rasterizer.UnsupportedSVG as e:
+        print(f'  Built-in rasterizer cannot render {rmfilename}: {e}')
+    if use_inkscape:
+        png_svg_filename = os.path.join(out_dir, f'{rmfilename}.png.svg')
+        png_dwg.saveas(png_svg_filename)
+        if text:
+            st.InkscapeConverter().text_to_path(rmfilename, png_svg_filename)
+        steps['png:inkscape'], _ = timed(
+            lambda: st.InkscapeConverter().export_png(rmfilename, png_svg_filename, png_filename), repeat)
+        png_bytes['inkscape'] = os.path.getsize(png_filename)
+    return result
+
+
+def run_benchmark(templates, repeat, font_filename, use_inkscape):
+    """Benchmarks the given templates and returns the results (JSON serializable)."""
+    results = dict()
+    with tempfile.TemporaryDirectory() as out_dir:
+        for job in templates:
+            print(f'* Benchmarking {job["rmfilename"]}')
+            results[job['rmfilename']] = benchmark_template(
+                job, out_dir, repeat, font_filename, use_inkscape)
+    return dict(
+        meta=dict(timestamp=datetime.datetime.now().isoformat(timespec='seconds'),
+                  python=platform.python_version(),
+                  platform=platform.platform(),
+                  repeat=repeat,
+                  font=None if font_filename is None else os.path.basename(font_filename),
+                  inkscape=use_inkscape),
+        templates=results)
+
+
+def compare_results(baseline, current, time_tolerance, size_tolerance, min_time_delta):
+    """
+    Compares the current benchmark results to the baseline. Runtimes (median)
+    are a regression if they are more than time_tolerance (relative) and
+    min_time_delta (absolute, in [s]) slower; sizes and element counts if they
+    grow by more than size_tolerance (relative). Returns the list of
+    regressions as (template, metric, baseline value, current value) tuples.
+    """
+    def sizes(result):
+        values = {k: v for k, v in result.items() if k == 'elements' or k.startswith('svg_bytes')}
+        values.update({f'png_bytes:{k}': v for k, v in result.get('png_bytes', dict()).items()})
+        return values
+
+    regressions = list()
+    print(f"{'Template':<14} {'Metric':<24} {'Baseline':>12} {'Current':>12} {'Change':>8}")
+    for rmfilename, result in current['templates'].items():
+        if rmfilename not in baseline['templates']:
+            print(f'{rmfilename:<14} (not in baseline)')
+            continue
+        base = baseline['templates'][rmfilename]
+        metrics = list()
+        for step, runtime in result['steps'].items():
+            if step in base['steps']:
+                old, new = base['steps'][step]['median_s'], runtime['median_s']
+                regressed = new > old * (1 + time_tolerance) and new - old > min_time_delta
+                metrics.append((f'{step} [ms]', old * 1e3, new * 1e3, old, new, regressed))
+        base_sizes = sizes(base)
+        for metric, new in sizes(result).items():
+            if metric in base_sizes:
+                old = base_sizes[metric]
+                metrics.append((metric, old, new, old, new, new > old * (1 + size_tolerance)))
+        for metric, old_display, new_display, old, new, regressed in metrics:
+            change = f'{(new - old) / old * 100:+.1f}%' if old > 0 else 'n/a'
+            flag = '  [REGRESSION]' if regressed else ''
+            print(f'{rmfilename:<14} {metric:<24} {old_display:>12.1f} {new_display:>12.1f} {change:>8}{flag}')
+            if regressed:
+                regressions.append((rmfilename, metric, old, new))
+    return regressions
+
+
+def parse_args():
+    """Returns the parsed command line arguments."""
+
+    parser = argparse.ArgumentParser(description='Benchmark the scripted templates')
+
+    parser.add_argument('--repeat', dest='repeat', action='store', type=int, default=5,
+        help='Number of runs per step (the median and minimum runtime are reported), default: %(default)d')
+
+    parser.add_argument('--output', dest='output', action='store', type=str, default=None,
+        help='Write the results to this JSON file (e.g. to use them as baseline later on)')
+
+    parser.add_argument('--compare', dest='baseline', action='store', type=str, default=None,
+        help='Compare the results to this baseline JSON file and exit with 1 upon regressions')
+
+    parser.add_argument('--time-tolerance', dest='time_tolerance', action='store', type=float, default=0.2,
+        help='Relative slowdown which is flagged as regression, default: %(default).2f')
+
+    parser.add_argument('--min-time-delta', dest='min_time_delta', action='store', type=float, default=0.002,
+        help='Ignore slowdowns below this absolute delta in [s] (timer noise), default: %(default).3f')
+
+    parser.add_argument('--size-tolerance', dest='size_tolerance', action='store', type=float, default=0.01,
+        help='Relative growth of output sizes/element counts which is flagged as regression, default: %(default).2f')
+
+    parser.add_argument('--inkscape', dest='use_inkscape', action='store_true', default=False,
+        help='Also benchmark the inkscape conversions (requires inkscape), default: %(default)s')
+
+    parser.add_argument('--font', dest='font_filename', action='store', type=str, default=None,
+        help='Font file (xkcd) to benchmark the glyph conversion, default: look up via fontconfig')
+
+    parser.add_argument('--only', dest='names', action='store', nargs='+', type=str,
+        help='Only benchmark the templates with these names or filenames')
+
+    parser.add_argument('--category', dest='categories', action='store', nargs='+', type=str,
+        help='Only benchmark the templates of these categories')
+
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    if args.use_inkscape and shutil.which('inkscape') is None:
+        parser.error('--inkscape requires inkscape to be installed')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        templates = st.select_templates(st.TEMPLATES, args.names, args.categories)
+    except ValueError as e:
+        print(f'[ERROR] {e}')
+        sys.exit(2)
+    # Reuse the build's font lookup (also checks whether fontTools is available)
+    args.inkscape_text = False
+    font_filename = st.text_font(args)
+
+    results = run_benchmark(templates, args.repeat, font_filename, args.use_inkscape)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'* Results written to {args.output}')
+
+    if args.baseline is None:
+        print()
+        print(f"{'Template':<14} {'Step':<24} {'Median [ms]':>12} {'Min [ms]':>12}")
+        for rmfilename, result in results['templates'].items():
+            for step, runtime in result['steps'].items():
+                print(f"{rmfilename:<14} {step:<24} {runtime['median_s']*1e3:>12.1f} {runtime['min_s']*1e3:>12.1f}")
+            png = ', '.join(f'{k}: {v}' for k, v in result['png_bytes'].items())
+            print(f"{rmfilename:<14} {result['elements']} elements, {result['svg_bytes']} bytes SVG, PNG bytes ({png})")
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print()
+    regressions = compare_results(baseline, results, args.time_tolerance,
+                                  args.size_tolerance, args.min_time_delta)
+    print()
+    if len(regressions) > 0:
+        print(f'[ERROR] {len(regressions)} regression(s) compared to {args.baseline}')
+        sys.exit(1)
+    print(f'> No regressions compared to {args.baseline}')
+    sys.exit(0)
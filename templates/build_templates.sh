@@ -12,5 +12,5 @@ source "$scriptdir/bashfun.sh"
 
 # Run the python script inside a virtualenv
 ensure_venv "$scriptdir/venv" "$scriptdir/requirements.txt"
-python "$scriptdir/scripted_templates.py"
+python "$scriptdir/scripted_templates.py" "$@"
 
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Vectorized geometry helpers for the scripted templates.
+
+Instead of stepping through each millimeter (and creating an SVG element per
+step), the generators compute all grid line/tick positions, classes and label
+anchors as NumPy arrays at once and hand them to the SVG emitter in bulk (see
+scripted_templates.StrokeLayer.add_many).
+"""
+
+import numpy as np
+
+
+# Tolerance (in [mm]) to compensate floating point errors, e.g. for 0.1 mm steps
+EPS_MM = 1e-6
+
+
+def steps(start_mm, stop_mm, step_mm):
+    """Returns the positions start, start + step, ... <= stop (i.e. including stop)."""
+    num = int(np.floor((stop_mm - start_mm) / step_mm + EPS_MM)) + 1
+    return start_mm + np.arange(max(num, 0)) * step_mm
+
+
+def is_multiple(values_mm, base_mm):
+    """Returns a boolean mask, which values are (approximately) multiples of base_mm."""
+    remainder = np.remainder(values_mm, base_mm)
+    return (remainder < EPS_MM) | (remainder > base_mm - EPS_MM)
+
+
+def runs(mask):
+    """Returns the (start index, length) tuples of all consecutive runs of True in the mask."""
+    padded = np.concatenate([[False], np.asarray(mask, dtype=bool), [False]])
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    return [(int(start), int(stop - start)) for start, stop in zip(changes[::2], changes[1::2])]
+
+
+def ruler_ticks(length_mm, tick_step_mm=1.0, major_step_mm=5.0, label_step_mm=10.0):
+    """
+    Computes the ticks of a ruler which spans length_mm (starting at 0).
+
+    Returns a tuple of numpy arrays (positions_mm, is_major, is_labeled), i.e.
+    the tick positions, whether a tick is a major tick (i.e. a multiple of
+    major_step_mm) and whether it should be labeled (multiples of label_step_mm,
+    except for the first/last tick).
+    """
+    positions_mm = steps(0, length_mm, tick_step_mm)
+    is_major = is_multiple(positions_mm, major_step_mm)
+    is_labeled = is_multiple(positions_mm, label_step_mm)\
+        & (positions_mm > 0) & (positions_mm < length_mm)
+    return positions_mm, is_major, is_labeled
+
+
+def format_px(values):
+    """
+    Formats pixel coordinates compactly (at most 3 decimals) for SVG path data.
+    Returns a string for a single value, otherwise a numpy array of strings.
+    """
+    txt = np.char.mod('%.3f', np.asarray(values, dtype=float))
+    txt = np.char.rstrip(np.char.rstrip(txt, '0'), '.')
+    txt = np.where(txt == '-0', '0', txt)
+    return str(txt) if txt.ndim == 0 else txt
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Converts SVG text of the scripted templates to glyph paths without inkscape.
+
+Each character of the font is converted to an SVG path only once (and cached
+per process). A drawing stores the outlines of all characters it uses within
+its <defs> and references them via <use>, so e.g. the ruler labels only
+contain the digits 0-9 once.
+
+Note: this requires fontTools (pip install fonttools) and the TrueType/OpenType
+file of the template font (xkcd). Kerning is not applied.
+"""
+
+import functools
+import re
+import subprocess
+
+import svgwrite
+from fontTools.pens.svgPathPen import SVGPathPen
+from fontTools.ttLib import TTFont
+
+from rasterizer import parse_css
+
+
+def find_font_file(family='xkcd'):
+    """Looks up the font file of the given family via fontconfig (returns None if not installed)."""
+    try:
+        proc = subprocess.run(['fc-match', '-f', '%{family}|%{file}', family],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True)
+    except OSError:
+        return None
+    if proc.returncode != 0 or '|' not in proc.stdout:
+        return None
+    families, filename = proc.stdout.rsplit('|', 1)
+    # fc-match always returns a font, so we must check that it's not a fallback
+    if family.lower() not in [f.strip().lower() for f in families.split(',')]:
+        return None
+    return filename
+
+
+class GlyphCache(object):
+    """Caches the outlines (SVG path data in font units) and advances of a font's glyphs."""
+
+    def __init__(self, font_filename):
+        self.font = TTFont(font_filename)
+        self.glyph_set = self.font.getGlyphSet()
+        self.cmap = self.font.getBestCmap()
+        self.units_per_em = self.font['head'].unitsPerEm
+        self.ascender = self.font['hhea'].ascent
+        self.descender = self.font['hhea'].descent
+        self.glyphs = dict()
+
+    def glyph(self, char):
+        """Returns (glyph name, path data, advance width) of the character."""
+        if char not in self.glyphs:
+            if ord(char) not in self.cmap:
+                raise KeyError(f'Font has no glyph for "{char}"')
+            name = self.cmap[ord(char)]
+            pen = SVGPathPen(self.glyph_set)
+            self.glyph_set[name].draw(pen)
+            self.glyphs[char] = (name, pen.getCommands(), self.glyph_set[name].width)
+        return self.glyphs[char]
+
+
+@functools.lru_cache(maxsize=None)
+def glyph_cache(font_filename):
+    """Returns the (per-process) GlyphCache of the given font file."""
+    return GlyphCache(font_filename)
+
+
+def glyph_id(char):
+    """Returns the id of the character's glyph path within the <defs>."""
+    return f'glyph-u{ord(char):04x}'
+
+
+def outline_text(dwg, font_filename, font_family='xkcd'):
+    """
+    Replaces all text tags of the drawing (which use the given font family)
+    by references to glyph paths. Returns the number of replaced text tags.
+
+    Supports the text features our templates use: font-family and font-size
+    (via CSS class), text-anchor, dominant-baseline (central) and transforms.
+    Text with characters which the font doesn't provide is kept as it is
+    (i.e. it is left to inkscape's text-to-path conversion).
+    """
+    cache = glyph_cache(font_filename)
+    css = dict()
+    for style in dwg.defs.elements:
+        if style.elementname == 'style':
+            css.update(parse_css(''.join(style.get_xml().itertext())))
+    defined = set()
+
+    def text_style(elem):
+        props = dict()
+        for cls in elem.attribs.get('class', '').split():
+            props.update(css.get(cls, dict()))
+        props.update({k: str(v) for k, v in elem.attribs.items()
+                      if k in ['font-size', 'font-family', 'text-anchor', 'dominant-baseline']})
+        return props
+
+    def outline(elem):
+        props = text_style(elem)
+        families = [f.strip().strip('\'"').lower() for f in props.get('font-family', '').split(',')]
+        if font_family.lower() not in families or len(elem.elements) > 0:
+            return None
+        size_px = float(re.sub('px$', '', props.get('font-size', '16').strip()))
+        scale = size_px / cache.units_per_em
+        try:
+            glyphs = [cache.glyph(c) for c in elem.text]
+        except KeyError as e:
+            print(f'[WARNING] {e.args[0]}, keeping the text "{elem.text}" for inkscape')
+            return None
+        width = sum(g[2] for g in glyphs)
+        x = float(elem.attribs.get('x', 0))
+        y = float(elem.attribs.get('y', 0))
+        anchor = props.get('text-anchor', 'start')
+        if anchor == 'middle':
+            x -= width * scale / 2
+        elif anchor == 'end':
+            x -= width * scale
+        if props.get('dominant-baseline', 'auto') == 'central':
+            # Center of the em box (descender is negative)
+            y += (cache.ascender + cache.descender) / 2 * scale
+        transform = elem.attribs.get('transform', '')
+        transform = f'{transform} translate({x:g},{y:g}) scale({scale:g},{-scale:g})'.strip()
+        group = dwg.g(transform=transform)
+        if 'class' in elem.attribs:
+            group['class'] = elem.attribs['class']
+        if 'fill' in elem.attribs:
+            group['fill'] = elem.attribs['fill']
+        advance = 0
+        for char, (_, path, char_width) in zip(elem.text, glyphs):
+            if len(path) > 0:
+                if char not in defined:
+                    dwg.defs.add(dwg.path(d=path, id=glyph_id(char)))
+                    defined.add(char)
+                use = group.add(dwg.use(f'#{glyph_id(char)}'))
+                if advance != 0:
+                    use['x'] = advance
+            advance += char_width
+        return group
+
+    num_replaced = 0
+    containers = [dwg]
+    while len(containers) > 0:
+        container = containers.pop()
+        for idx, elem in enumerate(container.elements):
+            if isinstance(elem, svgwrite.text.Text):
+                group = outline(elem)
+                if group is not None:
+                    container.elements[idx] = group
+                    num_replaced += 1
+            elif hasattr(elem, 'elements') and elem is not dwg.defs:
+                containers.append(elem)
+    return num_replaced
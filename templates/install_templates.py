@@ -9,15 +9,39 @@ More specifically, it will try to:
 * check which of the custom templates should be added (or overwritten,
   see command line arguments/help)
 * optionally, remove existing templates (if you provide them via --remove)
+* plan the changes (only print this plan if --plan is given)
 * upload the required files
-* restart the system UI
+* restart the system UI (once, and only if anything changed)
+
+Alternatively (--merge device), the configuration is merged on the device
+by merge_agent.py, so templates.json doesn't have to be transferred at all.
+
+All transfers and remote commands share a single connection (see
+transport.py, e.g. SSH via --transport ssh or paramiko; --transport local
+installs to a local directory instead, which is useful for testing).
+
+Multiple devices (--host a b c, or an --inventory file) are processed in
+parallel, followed by a summary of each device's status.
 """
 
 import argparse
+import concurrent.futures
+import contextlib
+import copy
+import io
 import os
 import sys
-import subprocess
 import json
+import tempfile
+import time
+
+import merge_agent
+from merge_agent import merge_template_configs, synced_templates
+from transport import TRANSPORTS, TransportError, create_transport, file_checksum
+
+
+# Location of the templates on the device
+REMOTE_TEMPLATE_DIR = '/usr/share/remarkable/templates'
 
 
 def parse_args():
@@ -25,11 +49,27 @@ def parse_args():
 
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('--host', dest='hostname', action='store', type=str,
-        default='10.11.99.1', help='Specify IP or hostname of the device, default: %(default)s')
+    parser.add_argument('--host', dest='hostnames', action='store', nargs='+', type=str,
+        default=None, help='Specify IP(s) or hostname(s) of the device(s), default: 10.11.99.1')
+
+    parser.add_argument('--inventory', dest='inventory', action='store', type=str,
+        default=None, help='Text file listing the devices to install to (one IP/hostname per line, # starts a comment)')
+
+    parser.add_argument('--workers', dest='num_workers', action='store', type=int,
+        default=8, help='Maximum number of devices to install to in parallel, default: %(default)d')
+
+    parser.add_argument('--transport', dest='transport', action='store',
+        choices=TRANSPORTS, default='ssh',
+        help="Connect via the ssh/scp tools ('ssh'), the in-process SSH client ('paramiko', requires "
+             "pip install paramiko) or install to a local directory which stands in for the device's "
+             "template directory ('local', the hosts are paths then), default: %(default)s")
+
+    parser.add_argument('--report', dest='report_filename', action='store', type=str, default=None,
+        help='Write the status, runtime and transfer statistics of each device to this JSON file')
 
     parser.add_argument('--timeout', dest='timeout', action='store', type=int,
-        default=10, help='Specify connection timeout in seconds, default: %(default)d')
+        default=10, help='Specify connection timeout in seconds (a stalled connection is aborted after about '
+             'three times as long), default: %(default)d')
 
     parser.add_argument('--template-dir', dest='template_dir', action='store',
         type=str, default='.',
@@ -38,10 +78,55 @@ def parse_args():
     parser.add_argument('--overwrite', dest='overwrite', action='store_true', default=False,
         help='Enable overwriting already existing (custom) templates, default: %(default)s')
     
+    parser.add_argument('--upload', dest='upload_mode', action='store',
+        choices=['tar', 'scp'], default='tar',
+        help="Upload all files as a single tar stream ('tar') or via scp, default: %(default)s")
+
+    parser.add_argument('--compress', dest='compress', action='store_true', default=False,
+        help='Compress the tar stream (gzip), useful for slow WiFi connections, default: %(default)s')
+
+    parser.add_argument('--no-delta', dest='delta_sync', action='store_false', default=True,
+        help="Upload all files of the added/overwritten templates, even if they're identical on the device")
+
+    parser.add_argument('--merge', dest='merge', action='store',
+        choices=['host', 'device'], default='host',
+        help="Merge templates.json on the host (download, merge, upload) or directly on the device "
+             "(requires python3 on the device, e.g. via toltec), default: %(default)s")
+
+    parser.add_argument('--plan', dest='plan_only', action='store_true', default=False,
+        help="Only print the planned changes (templates.json, files to upload, UI restart), but don't change the device")
+
+    parser.add_argument('--no-restart', dest='restart', action='store_false', default=True,
+        help="Don't restart the UI after the changes have been applied (e.g. if you run other installers afterwards)")
+
     parser.add_argument('--remove', dest='remove_names', action='store', nargs='+', type=str,
         help='Specify the display names (don''t forget to use ''"'') of templates which should be removed from the device.')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.num_workers < 1:
+        parser.error('--workers must be at least 1')
+    return args
+
+
+def load_inventory(filename):
+    """Returns the hostnames listed in the inventory file."""
+    hostnames = list()
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                hostnames.append(line)
+    return hostnames
+
+
+def device_hostnames(args):
+    """Returns the (unique) hostnames of all devices to install to."""
+    hostnames = list() if args.hostnames is None else list(args.hostnames)
+    if args.inventory is not None:
+        hostnames.extend(load_inventory(args.inventory))
+    if args.hostnames is None and args.inventory is None:
+        hostnames = ['10.11.99.1']
+    return list(dict.fromkeys(hostnames))
 
 
 def load_custom_templates(search_folder):
@@ -61,172 +146,357 @@ def load_custom_templates(search_folder):
     return tpl_configs
 
 
-def add_template_configs(args, tpl_configs, tpl_json_filename='templates.json'):
-    print('Adding custom template configs:')
+def print_changes(changes):
+    """Prints the changes of merge_template_configs()."""
+    def label(cfg):
+        return f"{cfg['name']}{' (landscape)' if cfg.get('landscape', False) else ''}"
 
-    with open(tpl_json_filename, 'r') as jf:
-        tcfg = json.load(jf)
+    for cfg in changes['added']:
+        print(f'* Adding template {label(cfg)}.')
+    for cfg in changes['overwritten']:
+        print(f'* Overwriting existing template {label(cfg)}.')
+    for cfg in changes['unchanged']:
+        print(f'* Template {label(cfg)} is already configured.')
+    for cfg in changes['skipped']:
+        print(f"* Skipping template {label(cfg)} as it's already installed.")
+    if len(changes['removed']) > 0:
+        print(f"* Removing the following templates: {[e['name'] for e in changes['removed']]}")
 
-    # Append every custom template to the list of available templates
-    print(f"* Loaded {len(tcfg['templates'])} currently available template configurations.")
 
-    
-    def already_exists(cfg, templates):
-        for t in templates:
-            if t['name'] == cfg['name']:
-                tl = t['landscape'] if 'landscape' in t else False
-                cl = cfg['landscape'] if 'landscape' in cfg else False
-                if tl == cl:
-                    return True
+def download_tpl_conf(args, session, tpl_json_filename='templates.json'):
+    """Downloads the templates.json from the device."""
+    print(f'Downloading templates.json from "{args.hostname}"')
+    try:
+        session.download(f'{REMOTE_TEMPLATE_DIR}/templates.json', tpl_json_filename)
+    except TransportError as e:
+        print(f'[ERROR] {e}')
         return False
+    return True
 
-    added_cfgs = list()
-    to_replace = list()
-    for cfg in tpl_configs:
-        extra = ' (landscape)' if cfg['landscape'] else ''
 
-        if already_exists(cfg, tcfg['templates']):
-            if args.overwrite:
-                to_replace.append(cfg)
-            else:
-                print(f"* Skipping template {cfg['name']}{extra} as it's already installed.")
-        else:
-            print(f"* Adding template {cfg['name']}{extra}.")
-            tcfg['templates'].append(cfg)
-            added_cfgs.append(cfg)
-    # Replace (if some should be explicitly overwritten)
-    for cfg in to_replace:
-        extra = ' (landscape)' if cfg['landscape'] else ''
-        print(f"* Overwriting existing template {cfg['name']}{extra}.")
-        def keep(e):
-            if e['name'] != cfg['name']:
-                return True
-            el = e['landscape'] if 'landscape' in e else False
-            cl = cfg['landscape'] if 'landscape' in cfg else False
-            return el != cl
-
-        tcfg['templates'] = [e for e in tcfg['templates'] if keep(e)]
-        tcfg['templates'].append(cfg)
-        added_cfgs.append(cfg)
-
-    print(f"* Saving {len(tcfg['templates'])} template configurations.")
-    with open(tpl_json_filename, 'w') as jf:
-        json.dump(tcfg, jf, indent=2)
-    return added_cfgs
-
-
-def remove_unused_templates(unused_names, tpl_json_filename='templates.json'):
-    """Removes all matching configurations from the local templates.json"""
-    print('Removing unused template configs:')
+def upload_helper(args, session, filenames):
+    """Copies the list of given filenames to the device (via a single scp call)."""
+    if not isinstance(filenames, list):
+        filenames = [filenames]
+    try:
+        session.upload([os.path.join(args.template_dir, f) for f in filenames], REMOTE_TEMPLATE_DIR)
+    except TransportError as e:
+        print(f'[ERROR] {e}')
+        return False
+    return True
+
+
+def changed_templates(args, session, fnames):
+    """
+    Returns the template files (without extension) whose svg or png is
+    missing on the device or differs from the local version.
+    """
+    filenames = [f'{fname}.{ext}' for fname in fnames for ext in ['svg', 'png']]
+    try:
+        remote = session.checksums(REMOTE_TEMPLATE_DIR, filenames)
+    except TransportError as e:
+        print(f'[ERROR] {e}, uploading all template files.')
+        return fnames
+    return [fname for fname in fnames
+            if any(remote.get(f'{fname}.{ext}') != file_checksum(os.path.join(args.template_dir, f'{fname}.{ext}'))
+                   for ext in ['svg', 'png'])]
+
+
+def upload_templates(args, session, fnames, tpl_json_filename=None):
+    """
+    Uploads the svg/png files of the given templates (filenames without
+    extension) and the configuration (unless tpl_json_filename is None).
+    Returns False if the upload failed.
+    """
+    print('Uploading custom templates and configuration file:')
+    for fname in fnames:
+        print(f"* Uploading {fname}.[svg,png]")
+        if args.upload_mode == 'scp' and not upload_helper(args, session, [f'{fname}.svg', f'{fname}.png']):
+            print(f'[ERROR] Cannot upload template files {fname}.[svg,png]')
+            return False
+    if tpl_json_filename is not None:
+        print("* Uploading templates.json")
+    if args.upload_mode == 'tar':
+        # Single transfer, the configuration is moved into place last (i.e.
+        # after all template files it references)
+        files = [(os.path.join(args.template_dir, f'{fname}.{ext}'), f'{fname}.{ext}')
+                 for fname in fnames for ext in ['svg', 'png']]
+        if tpl_json_filename is not None:
+            files.append((tpl_json_filename, 'templates.json'))
+        try:
+            num_bytes = session.upload_tar(files, REMOTE_TEMPLATE_DIR, args.compress)
+            print(f'* Transferred {len(files)} files as a single tar stream ({num_bytes/1024:.1f} KiB).')
+        except (TransportError, OSError) as e:
+            print(f'[ERROR] {e}')
+            return False
+    # The downloaded configuration isn't located within the template dir
+    elif tpl_json_filename is not None and not upload_helper(args, session, os.path.abspath(tpl_json_filename)):
+        print('[ERROR] Cannot upload templates.json')
+        return False
+    return True
 
-    with open(tpl_json_filename, 'r') as jf:
-        tcfg = json.load(jf)
 
-    print(f"* Loaded {len(tcfg['templates'])} template configurations.")
-    
-    def keep(tpl_entry):
-        return tpl_entry['name'] not in unused_names
-
-    removed_names = [e['name'] for e in tcfg['templates'] if not keep(e)]
-    tcfg['templates'] = [e for e in tcfg['templates'] if keep(e)]
-    num_removed = len(removed_names)
-    if num_removed > 0:
-        print(f'Removed the following templates: {removed_names}')
-        print(f"There are {len(tcfg['templates'])} templates left.")
-        with open(tpl_json_filename, 'w') as jf:
-            json.dump(tcfg, jf, indent=2)
-    else:
-        print('No templates were removed.')
+def restart_ui(session):
+    """Restarts xochitl, returns False if that failed."""
+    print("* Restarting device UI")
+    try:
+        session.restart_ui()
+    except TransportError as e:
+        print(f'[ERROR] {e}')
+        return False
+    return True
 
-    return num_removed
 
+def unique_filenames(tpl_configs, remove_names=None):
+    """Returns the template files (without extension) of the configurations, skipping removed templates."""
+    fnames = list()
+    for cfg in tpl_configs:
+        # Portrait + landscape templates share their files
+        if cfg['filename'] not in fnames and cfg['name'] not in (remove_names or list()):
+            fnames.append(cfg['filename'])
+    return fnames
+
+
+def delta_filenames(args, session, fnames):
+    """Returns the templates whose files must be uploaded (all of them, unless delta sync is enabled)."""
+    if not args.delta_sync:
+        return fnames
+    changed = changed_templates(args, session, fnames)
+    print(f'* {len(fnames) - len(changed)} of {len(fnames)} template(s) are up to date on the device.')
+    return changed
+
+
+def plan_host_merge(args, session, tpls, tpl_json_filename):
+    """
+    Downloads the device's configuration, merges the custom templates and
+    checks which files need to be uploaded. Doesn't change anything on the
+    device. Returns the plan (see print_plan), which also holds the merged
+    configuration, or None if the download failed.
+    """
+    if not download_tpl_conf(args, session, tpl_json_filename):
+        print('[ERROR] Cannot download templates.json from the device - please verify the SSH connection!')
+        return None
 
-def download_tpl_conf(args):
-    """Downloads the templates.json from the device."""
-    print(f'Downloading templates.json from "{args.hostname}"')
-    rv = subprocess.call(f'scp -o ConnectTimeout={args.timeout} root@{args.hostname}:/usr/share/remarkable/templates/templates.json templates.json', shell=True)
-    return rv == 0
+    with open(tpl_json_filename, 'r') as jf:
+        device_tcfg = json.load(jf)
+
+    print(f"* Loaded {len(device_tcfg['templates'])} currently available template configurations.")
+    tcfg, changes = merge_template_configs(device_tcfg, tpls, args.overwrite, args.remove_names)
+    fnames = unique_filenames(synced_templates(changes, args.overwrite))
+    return dict(changes=changes, config=tcfg, config_changed=tcfg != device_tcfg,
+                num_templates=len(tcfg['templates']),
+                upload=delta_filenames(args, session, fnames))
+
+
+def run_merge_agent(args, session, tpls, fnames, dry_run):
+    """
+    Runs the merge agent on the device (see merge_agent.py) and returns its
+    report. Unless dry_run is set, the files of the given templates are sent
+    along (via a single tar stream) and the agent installs the ones which are
+    needed. Raises a TransportError or ValueError upon failure.
+    """
+    request = dict(templates=tpls, overwrite=args.overwrite,
+                   remove=list() if args.remove_names is None else args.remove_names,
+                   dry_run=dry_run,
+                   files=[f'{fname}.{ext}' for fname in fnames for ext in ['svg', 'png']])
+    with open(merge_agent.__file__, 'r') as f:
+        agent_source = f.read()
+    if dry_run:
+        # Nothing to stage, the request is passed via stdin
+        output = session.run_python(agent_source, ['templates.json'], REMOTE_TEMPLATE_DIR,
+                                    input=json.dumps(request).encode('utf-8'))
+    else:
+        files = [(os.path.join(args.template_dir, f), f) for f in request['files']]
+        output = session.run_python(agent_source, ['templates.json', '--staging', '{staging}'],
+                                    REMOTE_TEMPLATE_DIR, files, args.compress,
+                                    [('request.json', json.dumps(request).encode('utf-8'))])
+    return json.loads(output.decode('utf-8'))
+
+
+def plan_device_merge(args, session, tpls):
+    """
+    Lets the merge agent on the device compute the changes (dry run), see
+    plan_host_merge(). Returns None if the agent cannot be run.
+    """
+    # We don't know yet which templates will be added, so we check all files
+    # that differ - the agent reports the ones which are needed
+    fnames = delta_filenames(args, session, unique_filenames(tpls, args.remove_names))
+    try:
+        report = run_merge_agent(args, session, tpls, fnames, True)
+    except (TransportError, ValueError) as e:
+        print(f'[ERROR] {e}')
+        print('[ERROR] Cannot merge on the device - is python3 installed? Otherwise, use --merge host')
+        return None
+    installed = [fname for fname in fnames if f'{fname}.svg' in report['installed_files']
+                 or f'{fname}.png' in report['installed_files']]
+    return dict(changes=report, config=None, config_changed=report['config_changed'],
+                num_templates=report['num_templates'], upload=installed)
+
+
+def plan_has_changes(plan):
+    """Checks whether applying the plan would change anything on the device."""
+    return plan['config_changed'] or len(plan['upload']) > 0
+
+
+def print_plan(plan, restart=True):
+    """Prints the changes which will be applied to the device."""
+    print_changes(plan['changes'])
+    if len(plan['upload']) > 0:
+        print(f"* Upload {len(plan['upload'])} template(s): {plan['upload']}")
+    if plan['config_changed']:
+        print(f"* Update templates.json ({plan['num_templates']} template configurations)")
+    if plan_has_changes(plan):
+        print('* Restart device UI' if restart else '* No UI restart (--no-restart)')
+    else:
+        print('> Nothing to do!')
 
 
-def upload_helper(args, filenames):
-    """Runs a single SCP to copy the list of given filenames to the device."""
-    if not isinstance(filenames, list) or len(filenames) == 1:
-        fstr = os.path.join(args.template_dir, filenames[0] if isinstance(filenames, list) else filenames)
+def apply_plan(args, session, tpls, plan, tpl_json_filename):
+    """
+    Applies all changes of the plan in one go and restarts the UI once (only
+    if anything changed, unless --no-restart). Returns the exit code.
+    """
+    if not plan_has_changes(plan):
+        return 0
+    if args.merge == 'device':
+        try:
+            report = run_merge_agent(args, session, tpls, plan['upload'], False)
+        except (TransportError, OSError, ValueError) as e:
+            print(f'[ERROR] {e}')
+            return 2
+        if len(report['installed_files']) > 0:
+            print(f"* Installed {len(report['installed_files'])} template file(s): {report['installed_files']}")
+        if report['config_changed']:
+            print(f"* Saved {report['num_templates']} template configurations.")
+        if not report['config_changed'] and len(report['installed_files']) == 0:
+            # The device has been changed since we planned
+            print('> Nothing changed on the device!')
+            return 0
     else:
-        # Joining an empty path enforces a trailing slash/path separator
-        # fstr = os.path.join(args.template_dir, '') + '\\{' + ','.join(filenames) + '\\}'
-        fstr = ' '.join([os.path.join(args.template_dir, f) for f in filenames])
-    cmd = f'scp -o ConnectTimeout={args.timeout} {fstr} root@{args.hostname}:/usr/share/remarkable/templates/'
-    # print('WOULD RUN', cmd)
-    rv = subprocess.call(cmd, shell=True)
-    return rv == 0
+        if plan['config_changed']:
+            with open(tpl_json_filename, 'w') as jf:
+                json.dump(plan['config'], jf, indent=2)
+        if not upload_templates(args, session, plan['upload'],
+                                tpl_json_filename if plan['config_changed'] else None):
+            print('[ERROR] Cannot upload - please verify the SSH connection!')
+            return 2
+    if args.restart and not restart_ui(session):
+        return 2
+    return 0
 
 
-def upload_templates(args, tpl_configs, tpl_json_filename):
-    print('Uploading custom templates and configuration file:')
-    if len(tpl_configs) == 0:
-        print('> Nothing to upload!')
-        return True
-    uploaded_filenames = list()
-    for cfg in tpl_configs:
-        fname = cfg['filename']
-        if fname in uploaded_filenames:
-            # Skip second config entry for portrait + landscape templates
-            continue
-        uploaded_filenames.append(fname)
-        tname = cfg['name']
-        print(f"* Uploading {tname}")
-        
-        if not upload_helper(args, [f'{fname}.svg', f'{fname}.png']):
-            print(f'[ERROR] Cannot upload template files {fname}.[svg,png]')
-            return False
-    print(f"* Uploading {tpl_json_filename}")
-    if not upload_helper(args, tpl_json_filename):
-        print('[ERROR] Cannot upload templates.json')
-        return False
-    # Restart xochitl
-    print("* Restarting device UI")
-    rv = subprocess.call(f'ssh -o ConnectTimeout={args.timeout} root@{args.hostname} "systemctl restart xochitl"', shell=True)
-    return rv == 0
+def install_device(args, session, tpls):
+    """
+    Installs the custom templates to a single device (args.hostname) via the
+    given (not yet opened) transport, i.e. plans the changes and applies them
+    (unless --plan). Returns the exit code.
+    """
+    print(f'Connecting to "{args.hostname}"')
+    try:
+        session.open()
+    except TransportError as e:
+        print(f'[ERROR] {e} - please verify the SSH connection!')
+        return 2
+    # Each device needs its own copy of the configuration
+    with session, tempfile.TemporaryDirectory() as tmp_dir:
+        tpl_json_filename = os.path.join(tmp_dir, 'templates.json')
+        print()
+        if args.merge == 'device':
+            print('Planning changes (merging on the device):')
+            plan = plan_device_merge(args, session, tpls)
+        else:
+            print('Planning changes:')
+            plan = plan_host_merge(args, session, tpls, tpl_json_filename)
+        if plan is None:
+            return 2
+        print_plan(plan, args.restart)
+        if args.plan_only:
+            return 0
+        print()
+        return apply_plan(args, session, tpls, plan, tpl_json_filename)
+
+
+def install_device_job(args, hostname, tpls, capture_output):
+    """
+    Runs install_device() for the given host and measures its runtime. If
+    capture_output is set, the console output is captured, so that parallel
+    installs don't interleave their logs. Returns a dict with the keys
+    hostname, rv (exit code), seconds, stats (see transport.Transport.stats)
+    and log.
+    """
+    args = copy.copy(args)
+    args.hostname = hostname
+    session = create_transport(args.transport, hostname, args.timeout, REMOTE_TEMPLATE_DIR)
+    log = io.StringIO()
+    start_time = time.time()
+    with contextlib.redirect_stdout(log) if capture_output else contextlib.nullcontext():
+        try:
+            rv = install_device(args, session, tpls)
+        except Exception as e:
+            print(f'[ERROR] Installation failed: {e}')
+            rv = 2
+    return dict(hostname=hostname, rv=rv, seconds=time.time() - start_time,
+                stats=session.stats, log=log.getvalue())
+
+
+def print_device_summary(results):
+    """Prints the status and transfer statistics of each device."""
+    print(f"{'Device':<24} {'Status':<8} {'Time [s]':>8} {'Exit code':>9} {'Commands':>8} "
+          f"{'Transfers':>9} {'Sent [KiB]':>10} {'Restarts':>8}")
+    for result in results:
+        stats = result['stats']
+        print(f"{result['hostname']:<24} {'ok' if result['rv'] == 0 else 'failed':<8} "
+              f"{result['seconds']:>8.1f} {result['rv']:>9d} {stats['commands']:>8d} "
+              f"{stats['transfers']:>9d} {stats['bytes_sent']/1024:>10.1f} {stats['restarts']:>8d}")
+
+
+def save_report(filename, results):
+    """Stores the device results (without the logs) as JSON."""
+    with open(filename, 'w') as f:
+        json.dump([{k: v for k, v in r.items() if k != 'log'} for r in results], f, indent=2)
 
 
 def install_and_cleanup_templates():
     args = parse_args()
-    downloaded_templates_filename = 'templates.json'
+    try:
+        hostnames = device_hostnames(args)
+    except OSError as e:
+        print(f'[ERROR] Cannot load inventory: {e}')
+        return 1
+    if len(hostnames) == 0:
+        print('[ERROR] No devices given!')
+        return 1
 
     tpls = load_custom_templates(args.template_dir)
     if len(tpls) == 0:
         return 1
 
     print()
-    if not download_tpl_conf(args):
-        print('[ERROR] Cannot download templates.json from the device - please verify the SSH connection!')
-        return 2
-
-    print()
-    added_cfgs = add_template_configs(args, tpls, downloaded_templates_filename)
-    num_added = len(added_cfgs)
-    if num_added == 0:
-        print('> No custom templates have been added!')
-
-    if args.remove_names is not None:
-        print()
-        num_removed = remove_unused_templates(args.remove_names, downloaded_templates_filename)
-        if num_removed == 0:
-            print('> No unused templates have been removed!')
-    else:
-        num_removed = 0
-
-    if num_added == 0 and num_removed == 0:
-        return 0
-
+    if len(hostnames) == 1:
+        results = [install_device_job(args, hostnames[0], tpls, False)]
+        if args.report_filename is not None:
+            save_report(args.report_filename, results)
+        return results[0]['rv']
+
+    # Install to all devices in parallel (an offline device only blocks
+    # its own worker until the connection times out)
+    print(f'Installing to {len(hostnames)} devices:')
+    results = list()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(args.num_workers, len(hostnames))) as pool:
+        futures = [pool.submit(install_device_job, args, hostname, tpls, True) for hostname in hostnames]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            print()
+            print(f"===== {result['hostname']} " + '=' * max(0, 50 - len(result['hostname'])))
+            print(result['log'], end='')
+            sys.stdout.flush()
+            results.append(result)
     print()
-    if not upload_templates(args, added_cfgs, downloaded_templates_filename):
-        print('[ERROR] Cannot upload - please verify the SSH connection!')
-        return 2
-    # Clean up the downloaded templates.json
-    os.remove(downloaded_templates_filename)
-    return 0
+    results.sort(key=lambda r: hostnames.index(r['hostname']))
+    print_device_summary(results)
+    if args.report_filename is not None:
+        save_report(args.report_filename, results)
+    return max(r['rv'] for r in results)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Loading/saving the JSON state files of the tools, i.e. the build manifest
+(scripted_templates.py), the backup manifest (backup_xochitl.py) and the
+cached document index (xochitl_index.py).
+"""
+
+import json
+import os
+
+
+def load_json(filename, empty=dict, description='file'):
+    """
+    Loads the given JSON file. If it doesn't exist (or is corrupt), returns
+    empty() instead, i.e. the tools start over from scratch.
+    """
+    if not os.path.exists(filename):
+        return empty()
+    try:
+        with open(filename, 'r') as jf:
+            return json.load(jf)
+    except ValueError:
+        print(f'[WARNING] Ignoring corrupt {description} "{filename}"')
+        return empty()
+
+
+def save_json(data, filename):
+    """Writes the JSON file (via a temporary file to avoid partial writes)."""
+    with open(f'{filename}.tmp', 'w') as jf:
+        json.dump(data, jf, indent=2, sort_keys=True)
+        jf.write('\n')
+    os.replace(f'{filename}.tmp', filename)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+Merges custom template configurations into the reMarkable's templates.json.
+
+This module is used by install_templates.py to merge the configuration on
+the host, but it can also run on the device itself (requires python3 on the
+tablet, e.g. via toltec), so the device's templates.json doesn't have to be
+downloaded and uploaded again. In this case, install_templates.py sends the
+source of this script via ssh and streams a tar archive via stdin, which
+contains the merge request (the custom .inc.json entries, the names of the
+templates to remove and whether existing templates should be overwritten)
+and the template files to be installed. The agent then:
+* merges the configuration,
+* moves the files of the added/overwritten templates into place,
+* writes templates.json atomically (only if it changed),
+* and prints a JSON report of the changes to stdout.
+
+Standalone usage (within the template directory):
+  python3 merge_agent.py templates.json < request.json
+  python3 merge_agent.py templates.json --staging <dir with request.json and files>
+
+If the request's dry_run flag is set, the agent only reports the changes.
+
+Note: this script must only depend on the standard library.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+
+def template_key(cfg):
+    """Templates are identified by their display name and orientation."""
+    return (cfg['name'], cfg.get('landscape', False))
+
+
+def merge_template_configs(tcfg, tpl_configs, overwrite=False, remove_names=None):
+    """
+    Merges the custom template configurations into the device's configuration
+    (the parsed templates.json) and removes the templates with the given
+    display names - in a single pass over the device's templates, which keeps
+    their order (overwritten templates are replaced in place, new ones are
+    appended).
+
+    Returns the merged configuration and the changes, i.e. a dict holding the
+    lists of 'added', 'overwritten', 'unchanged' (already identically
+    configured) and 'skipped' (already installed, but not overwritten) custom
+    configurations, as well as the 'removed' device configurations.
+    """
+    remove_names = set() if remove_names is None else set(remove_names)
+    changes = dict(added=list(), overwritten=list(), unchanged=list(), skipped=list(), removed=list())
+    # Index the custom templates (if a template should be removed, we
+    # obviously don't install it)
+    custom = dict()
+    for cfg in tpl_configs:
+        if cfg['name'] not in remove_names:
+            custom[template_key(cfg)] = cfg
+    merged = list()
+    matched = set()
+    for entry in tcfg['templates']:
+        key = template_key(entry)
+        if entry['name'] in remove_names:
+            changes['removed'].append(entry)
+        elif key not in custom:
+            merged.append(entry)
+        elif key in matched:
+            # Duplicate entry of an overwritten template
+            if not overwrite:
+                merged.append(entry)
+        else:
+            matched.add(key)
+            cfg = custom[key]
+            if entry == cfg:
+                changes['unchanged'].append(cfg)
+                merged.append(entry)
+            elif overwrite:
+                changes['overwritten'].append(cfg)
+                merged.append(cfg)
+            else:
+                changes['skipped'].append(cfg)
+                merged.append(entry)
+    for key, cfg in custom.items():
+        if key not in matched:
+            changes['added'].append(cfg)
+            merged.append(cfg)
+    return dict(tcfg, templates=merged), changes
+
+
+def synced_templates(changes, overwrite):
+    """Returns the custom template configurations whose files should be installed."""
+    cfgs = changes['added'] + changes['overwritten']
+    if overwrite:
+        # Configured identically, but the files might have changed
+        cfgs += changes['unchanged']
+    return cfgs
+
+
+def write_atomic(filename, data):
+    """Replaces the file's content atomically (write a temporary file, then rename it)."""
+    tmp_filename = f'{filename}.tmp'
+    with open(tmp_filename, 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def apply_request(tpl_json_filename, request, staging_dir=None):
+    """
+    Merges the request into the given templates.json, installs the staged
+    template files (if any) and returns the report (JSON serializable).
+
+    If the request's dry_run flag is set, nothing is changed, but the report
+    lists the (requested) files which would be installed.
+    """
+    dry_run = request.get('dry_run', False)
+    with open(tpl_json_filename, 'r') as jf:
+        tcfg = json.load(jf)
+    merged, changes = merge_template_configs(tcfg, request['templates'],
+                                             request.get('overwrite', False),
+                                             request.get('remove', None))
+    # Move the files of the synced templates into place before the
+    # configuration references them
+    installed = list()
+    if staging_dir is not None:
+        available = os.listdir(staging_dir)
+    else:
+        available = request.get('files', list()) if dry_run else list()
+    target_dir = os.path.dirname(os.path.abspath(tpl_json_filename))
+    for cfg in synced_templates(changes, request.get('overwrite', False)):
+        for ext in ['svg', 'png']:
+            fname = f"{cfg['filename']}.{ext}"
+            if fname not in installed and fname in available:
+                if not dry_run:
+                    os.replace(os.path.join(staging_dir, fname), os.path.join(target_dir, fname))
+                installed.append(fname)
+    config_changed = merged != tcfg
+    if config_changed and not dry_run:
+        write_atomic(tpl_json_filename, json.dumps(merged, indent=2))
+    report = {k: [dict(name=e['name'], landscape=e.get('landscape', False)) for e in v]
+              for k, v in changes.items()}
+    report['config_changed'] = config_changed
+    report['num_templates'] = len(merged['templates'])
+    report['installed_files'] = installed
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('tpl_json_filename', help='Path to the templates.json')
+    parser.add_argument('--staging', dest='staging_dir', action='store', default=None,
+        help='Directory which contains the request.json and the template files to install (otherwise, the request is read from stdin)')
+    args = parser.parse_args()
+
+    if args.staging_dir is None:
+        request = json.load(sys.stdin)
+    else:
+        with open(os.path.join(args.staging_dir, 'request.json'), 'r') as f:
+            request = json.load(f)
+    json.dump(apply_request(args.tpl_json_filename, request, args.staging_dir), sys.stdout)
+    sys.exit(0)
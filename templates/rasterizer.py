@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Minimal NumPy rasterizer to export the scripted templates to PNG without
+inkscape.
+
+It only supports what the template generators emit for grids, rulers and
+guides, i.e. axis-aligned lines/paths, rects and circles with solid colors
+(plus translated <use> references, see scripted_templates.dot_row). Anything
+else (text, transforms, curves, ...) raises an UnsupportedSVG error, so that
+the caller can fall back to inkscape.
+
+Coverage is computed per pixel (exact box filter for axis-aligned shapes,
+supersampling for circles), which closely resembles inkscape's anti-aliased
+output.
+"""
+
+import math
+import re
+import struct
+import zlib
+
+import numpy as np
+
+
+class UnsupportedSVG(Exception):
+    """Raised if the SVG uses a feature which this rasterizer can't render."""
+    pass
+
+
+# Named colors used by our templates (extend if needed)
+NAMED_COLORS = {
+    'black': (0, 0, 0),
+    'white': (255, 255, 255),
+    'gray': (128, 128, 128),
+    'grey': (128, 128, 128)
+}
+
+# Presentation attributes/CSS properties which we resolve (all of them are
+# inherited by child elements)
+PAINT_PROPERTIES = ['fill', 'stroke', 'stroke-width']
+
+# Namespace of the href attribute of <use> elements (if parsed from a file)
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+
+# Properties which would change the rendering but aren't supported, along
+# with their (supported) default values
+UNSUPPORTED_PROPERTIES = {
+    'opacity': '1',
+    'fill-opacity': '1',
+    'stroke-opacity': '1',
+    'stroke-dasharray': 'none',
+    'stroke-linecap': 'butt',
+    'fill-rule': 'nonzero',
+    'transform': None,
+    'clip-path': None,
+    'mask': None,
+    'filter': None
+}
+
+# Number of samples per pixel (along each axis) to estimate circle coverage
+CIRCLE_SUPERSAMPLING = 8
+
+
+def local_name(tag):
+    """Strips the namespace from an XML tag."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_length(value):
+    """Returns the length in [px], only absolute pixel values are supported."""
+    txt = str(value).strip()
+    if txt.endswith('px'):
+        txt = txt[:-2]
+    try:
+        return float(txt)
+    except ValueError:
+        raise UnsupportedSVG(f'Unsupported length "{value}"')
+
+
+def parse_color(value):
+    """Returns the gray value (luma, in [0, 255]) of the color or None (for 'none')."""
+    txt = value.strip().lower()
+    if txt == 'none':
+        return None
+    if txt in NAMED_COLORS:
+        rgb = NAMED_COLORS[txt]
+    elif re.fullmatch(r'#[0-9a-f]{6}', txt):
+        rgb = [int(txt[i:i+2], 16) for i in [1, 3, 5]]
+    elif re.fullmatch(r'#[0-9a-f]{3}', txt):
+        rgb = [17 * int(c, 16) for c in txt[1:]]
+    else:
+        m = re.fullmatch(r'rgb\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)', txt)
+        if m is None:
+            raise UnsupportedSVG(f'Unsupported color "{value}"')
+        rgb = [int(c) for c in m.groups()]
+    return 0.299 * rgb[0] + 0.587 * rgb[1] + 0.114 * rgb[2]
+
+
+def parse_declarations(text):
+    """Parses CSS declarations, e.g. 'stroke: black; stroke-width: 1px'."""
+    props = dict()
+    for decl in text.split(';'):
+        if ':' in decl:
+            key, value = decl.split(':', 1)
+            props[key.strip()] = value.strip()
+    return props
+
+
+def parse_css(text):
+    """Parses the (class-only) style sheets of our templates into {class: properties}."""
+    css = dict()
+    for selector, body in re.findall(r'([^{}]+)\{([^}]*)\}', text):
+        selector = selector.strip()
+        if not re.fullmatch(r'\.[\w-]+', selector):
+            raise UnsupportedSVG(f'Unsupported CSS selector "{selector}"')
+        css.setdefault(selector[1:], dict()).update(parse_declarations(body))
+    return css
+
+
+class Canvas(object):
+    """Grayscale canvas which composites anti-aliased primitives."""
+
+    def __init__(self, width, height):
+        # The page starts out white (our templates draw an opaque background anyways)
+        self.pixels = np.full((height, width), 255.0)
+
+    def fill_box(self, x0, y0, x1, y1, gray, clip=None):
+        """Fills the axis-aligned box [x0, x1] x [y0, y1] with the given gray value."""
+        if clip is not None:
+            x0, y0 = max(x0, clip[0]), max(y0, clip[1])
+            x1, y1 = min(x1, clip[2]), min(y1, clip[3])
+        height, width = self.pixels.shape
+        c0, c1 = max(int(math.floor(x0)), 0), min(int(math.ceil(x1)), width)
+        r0, r1 = max(int(math.floor(y0)), 0), min(int(math.ceil(y1)), height)
+        if c1 <= c0 or r1 <= r0:
+            return
+        cols = np.arange(c0, c1)
+        rows = np.arange(r0, r1)
+        cov_x = np.clip(np.minimum(x1, cols + 1) - np.maximum(x0, cols), 0, 1)
+        cov_y = np.clip(np.minimum(y1, rows + 1) - np.maximum(y0, rows), 0, 1)
+        block = self.pixels[r0:r1, c0:c1]
+        block += (gray - block) * np.outer(cov_y, cov_x)
+
+    def fill_ring(self, cx, cy, r_inner, r_outer, gray, clip=None):
+        """Fills the ring (or disk, if r_inner <= 0) centered at (cx, cy)."""
+        x0, y0, x1, y1 = cx - r_outer, cy - r_outer, cx + r_outer, cy + r_outer
+        if clip is not None:
+            x0, y0 = max(x0, clip[0]), max(y0, clip[1])
+            x1, y1 = min(x1, clip[2]), min(y1, clip[3])
+        height, width = self.pixels.shape
+        c0, c1 = max(int(math.floor(x0)), 0), min(int(math.ceil(x1)), width)
+        r0, r1 = max(int(math.floor(y0)), 0), min(int(math.ceil(y1)), height)
+        if c1 <= c0 or r1 <= r0:
+            return
+        ss = CIRCLE_SUPERSAMPLING
+        offsets = (np.arange(ss) + 0.5) / ss
+        xs = (np.arange(c0, c1)[:, None] + offsets[None, :]).ravel()
+        ys = (np.arange(r0, r1)[:, None] + offsets[None, :]).ravel()
+        dist2 = (ys - cy)[:, None] ** 2 + (xs - cx)[None, :] ** 2
+        inside = dist2 <= r_outer ** 2
+        if r_inner > 0:
+            inside &= dist2 >= r_inner ** 2
+        inside &= ((xs >= x0) & (xs <= x1))[None, :]
+        inside &= ((ys >= y0) & (ys <= y1))[:, None]
+        coverage = inside.reshape(r1 - r0, ss, c1 - c0, ss).mean(axis=(1, 3))
+        block = self.pixels[r0:r1, c0:c1]
+        block += (gray - block) * coverage
+
+    def stroke_line(self, x0, y0, x1, y1, gray, width, clip=None):
+        """Strokes an axis-aligned line (butt caps)."""
+        hw = width / 2
+        if y0 == y1:
+            self.fill_box(min(x0, x1), y0 - hw, max(x0, x1), y0 + hw, gray, clip)
+        elif x0 == x1:
+            self.fill_box(x0 - hw, min(y0, y1), x0 + hw, max(y0, y1), gray, clip)
+        else:
+            raise UnsupportedSVG('Only axis-aligned lines are supported')
+
+    def to_uint8(self):
+        """Returns the canvas as 8-bit grayscale image."""
+        return np.clip(np.round(self.pixels), 0, 255).astype(np.uint8)
+
+
+class Rasterizer(object):
+    """Renders the (supported subset of an) SVG element tree onto a Canvas."""
+
+    def __init__(self, svg, width, height):
+        if local_name(svg.tag) != 'svg':
+            raise UnsupportedSVG('Root element must be <svg>')
+        if 'viewBox' in svg.attrib:
+            raise UnsupportedSVG('viewBox is not supported')
+        for key, size in [('width', width), ('height', height)]:
+            if key in svg.attrib and parse_length(svg.attrib[key]) != size:
+                raise UnsupportedSVG(f'SVG {key} must match the PNG {key} ({size}px)')
+        self.svg = svg
+        self.canvas = Canvas(width, height)
+        self.css = dict()
+        self.ids = dict()
+        for elem in svg.iter():
+            if not isinstance(elem.tag, str):
+                continue
+            if local_name(elem.tag) == 'style':
+                self.css.update(parse_css(''.join(elem.itertext())))
+            if 'id' in elem.attrib:
+                self.ids[elem.attrib['id']] = elem
+
+    def render(self):
+        """Renders the SVG and returns the 8-bit grayscale image."""
+        defaults = {'fill': 'black', 'stroke': 'none', 'stroke-width': '1'}
+        self.render_element(self.svg, defaults, (0, 0), None)
+        return self.canvas.to_uint8()
+
+    def style(self, elem, inherited):
+        """Resolves the paint properties of the element (attributes < CSS class < style)."""
+        props = dict(inherited)
+        specified = dict()
+        specified.update({k: v for k, v in elem.attrib.items()})
+        for cls in elem.attrib.get('class', '').split():
+            specified.update(self.css.get(cls, dict()))
+        if 'style' in elem.attrib:
+            specified.update(parse_declarations(elem.attrib['style']))
+        for key, default in UNSUPPORTED_PROPERTIES.items():
+            if key in specified and str(specified[key]).strip() != default:
+                raise UnsupportedSVG(f'Property "{key}" is not supported')
+        for key in PAINT_PROPERTIES:
+            if key in specified:
+                props[key] = specified[key]
+        return props
+
+    def render_element(self, elem, inherited, offset, clip):
+        if not isinstance(elem.tag, str):
+            # E.g. the CDATA pseudo-element of svgwrite's style tags
+            return
+        tag = local_name(elem.tag)
+        if tag in ['defs', 'style', 'title', 'desc', 'metadata']:
+            # Definitions are only rendered when referenced via <use>
+            return
+        if elem.attrib.get('display') == 'none':
+            return
+        props = self.style(elem, inherited)
+        if tag in ['svg', 'g']:
+            for child in elem:
+                self.render_element(child, props, offset, clip)
+        elif tag == 'rect':
+            self.render_rect(elem, props, offset, clip)
+        elif tag == 'line':
+            self.render_line(elem, props, offset, clip)
+        elif tag == 'path':
+            self.render_path(elem, props, offset, clip)
+        elif tag == 'circle':
+            self.render_circle(elem, props, offset, clip)
+        elif tag == 'use':
+            self.render_use(elem, props, offset, clip)
+        else:
+            raise UnsupportedSVG(f'Element <{tag}> is not supported')
+
+    def stroke(self, props):
+        """Returns (gray value, width) of the stroke or None."""
+        gray = parse_color(props['stroke'])
+        width = parse_length(props['stroke-width'])
+        if gray is None or width <= 0:
+            return None
+        return gray, width
+
+    def render_rect(self, elem, props, offset, clip):
+        if 'rx' in elem.attrib or 'ry' in elem.attrib:
+            raise UnsupportedSVG('Rounded rects are not supported')
+        x = parse_length(elem.attrib.get('x', 0)) + offset[0]
+        y = parse_length(elem.attrib.get('y', 0)) + offset[1]
+        w = parse_length(elem.attrib['width'])
+        h = parse_length(elem.attrib['height'])
+        gray = parse_color(props['fill'])
+        if gray is not None:
+            self.canvas.fill_box(x, y, x + w, y + h, gray, clip)
+        stroke = self.stroke(props)
+        if stroke is not None:
+            gray, sw = stroke
+            hw = sw / 2
+            self.canvas.fill_box(x - hw, y - hw, x + w + hw, y + hw, gray, clip)
+            self.canvas.fill_box(x - hw, y + h - hw, x + w + hw, y + h + hw, gray, clip)
+            self.canvas.fill_box(x - hw, y + hw, x + hw, y + h - hw, gray, clip)
+            self.canvas.fill_box(x + w - hw, y + hw, x + w + hw, y + h - hw, gray, clip)
+
+    def render_line(self, elem, props, offset, clip):
+        stroke = self.stroke(props)
+        if stroke is None:
+            return
+        x0 = parse_length(elem.attrib.get('x1', 0)) + offset[0]
+        y0 = parse_length(elem.attrib.get('y1', 0)) + offset[1]
+        x1 = parse_length(elem.attrib.get('x2', 0)) + offset[0]
+        y1 = parse_length(elem.attrib.get('y2', 0)) + offset[1]
+        self.canvas.stroke_line(x0, y0, x1, y1, stroke[0], stroke[1], clip)
+
+    def render_path(self, elem, props, offset, clip):
+        # Only absolute M/L/H/V commands (as emitted by StrokeLayer) are supported
+        data = elem.attrib.get('d', '')
+        tokens = re.findall(r'([A-Za-z])([^A-Za-z]*)', data)
+        segments = list()
+        points_per_subpath = list()
+        x = y = None
+        for cmd, args in tokens:
+            values = [float(v) for v in re.findall(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?', args)]
+            if cmd in 'ML':
+                if len(values) != 2:
+                    raise UnsupportedSVG(f'Unsupported path data "{cmd}{args}"')
+                nx, ny = values
+            elif cmd in 'HV':
+                if len(values) != 1 or x is None:
+                    raise UnsupportedSVG(f'Unsupported path data "{cmd}{args}"')
+                nx, ny = (values[0], y) if cmd == 'H' else (x, values[0])
+            else:
+                raise UnsupportedSVG(f'Path command "{cmd}" is not supported')
+            if cmd == 'M':
+                points_per_subpath.append(1)
+            else:
+                segments.append((x, y, nx, ny))
+                points_per_subpath[-1] += 1
+            x, y = nx, ny
+        if parse_color(props['fill']) is not None and any(n > 2 for n in points_per_subpath):
+            raise UnsupportedSVG('Filled paths are not supported')
+        stroke = self.stroke(props)
+        if stroke is None:
+            return
+        for x0, y0, x1, y1 in segments:
+            self.canvas.stroke_line(x0 + offset[0], y0 + offset[1],
+                                    x1 + offset[0], y1 + offset[1],
+                                    stroke[0], stroke[1], clip)
+
+    def render_circle(self, elem, props, offset, clip):
+        cx = parse_length(elem.attrib.get('cx', 0)) + offset[0]
+        cy = parse_length(elem.attrib.get('cy', 0)) + offset[1]
+        r = parse_length(elem.attrib['r'])
+        gray = parse_color(props['fill'])
+        if gray is not None:
+            self.canvas.fill_ring(cx, cy, 0, r, gray, clip)
+        stroke = self.stroke(props)
+        if stroke is not None:
+            gray, sw = stroke
+            self.canvas.fill_ring(cx, cy, r - sw / 2, r + sw / 2, gray, clip)
+
+    def render_use(self, elem, props, offset, clip):
+        # The referenced element inherits the style of the <use> element
+        href = elem.attrib.get('xlink:href', elem.attrib.get(f'{{{XLINK_NS}}}href', ''))
+        ref = self.ids.get(href[1:]) if href.startswith('#') else None
+        if ref is None:
+            raise UnsupportedSVG(f'Unsupported reference "{href}"')
+        if any(key in elem.attrib for key in ['width', 'height']):
+            raise UnsupportedSVG('Only translated <use> references are supported')
+        x = parse_length(elem.attrib.get('x', 0)) + offset[0]
+        y = parse_length(elem.attrib.get('y', 0)) + offset[1]
+        self.render_element(ref, props, (x, y), clip)
+
+
+def rasterize(svg, width=1404, height=1872):
+    """
+    Renders the SVG (an ElementTree element, e.g. svgwrite's Drawing.get_xml())
+    and returns it as 8-bit grayscale image (numpy array of shape height x width).
+    Raises UnsupportedSVG if the SVG cannot be rendered.
+    """
+    return Rasterizer(svg, width, height).render()
+
+
+# The e-ink panel displays 16 gray levels
+PANEL_GRAY_LEVELS = 16
+
+
+def quantize(gray, levels=PANEL_GRAY_LEVELS):
+    """
+    Quantizes the 8-bit grayscale image to the given number of evenly spaced
+    gray levels. Returns the level indices (0 = black, levels - 1 = white).
+    """
+    return np.rint(gray.astype(np.float64) * ((levels - 1) / 255)).astype(np.uint8)
+
+
+def write_png(filename, gray, bit_depth=8, levels=None):
+    """
+    Writes the 8-bit grayscale image as PNG (maximum zlib compression).
+
+    If levels is given, the image is quantized to this number of gray levels
+    first (which also compresses much better). Bit depths below 8 (i.e. 4, 2
+    or 1) store the quantized levels directly, so levels must not exceed
+    2**bit_depth (defaults to 2**bit_depth).
+    """
+    height, width = gray.shape
+    max_sample = 2**bit_depth - 1
+    if levels is None and bit_depth < 8:
+        levels = max_sample + 1
+    if levels is not None:
+        if levels < 2 or levels > max_sample + 1:
+            raise ValueError(f'Cannot store {levels} gray levels with a bit depth of {bit_depth}')
+        gray = np.rint(quantize(gray, levels) * (max_sample / (levels - 1))).astype(np.uint8)
+    if bit_depth < 8:
+        # Pack the samples (the leftmost pixel is the most significant one)
+        per_byte = 8 // bit_depth
+        padded = np.zeros((height, -(-width // per_byte) * per_byte), dtype=np.uint8)
+        padded[:, :width] = gray
+        shifts = (8 - bit_depth * np.arange(1, per_byte + 1)).astype(np.uint8)
+        gray = np.bitwise_or.reduce(padded.reshape(height, -1, per_byte) << shifts, axis=2).astype(np.uint8)
+    # Use the 'up' filter for all scanlines (rows are mostly identical for our templates)
+    raw = np.empty((height, gray.shape[1] + 1), dtype=np.uint8)
+    raw[:, 0] = 2
+    raw[0, 1:] = gray[0]
+    raw[1:, 1:] = gray[1:] - gray[:-1]
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data\
+            + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), 9)))
+        f.write(chunk(b'IEND', b''))
+
+
+def save_png(dwg, filename, width=1404, height=1872, bit_depth=8, levels=None):
+    """Rasterizes the svgwrite Drawing and saves it as PNG, see write_png (raises UnsupportedSVG)."""
+    write_png(filename, rasterize(dwg.get_xml(), width, height), bit_depth, levels)
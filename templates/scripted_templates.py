@@ -8,16 +8,48 @@ register/install these custom templates (see also
 
 Note: this script depends on inkscape (to export PNGs from
 the rendered SVGs and to convert SVG text to paths, needed
-for compatibility reasons).
+for compatibility reasons). Templates without text, which
+only consist of simple shapes, can be exported to PNG via
+the built-in NumPy rasterizer instead (see rasterizer.py).
+If fontTools and the xkcd font are available, text is
+converted to glyph paths without inkscape (see glyphs.py).
+PNGs are stored as low-bit grayscale images, quantized to the
+gray levels of the e-ink panel (re-encoding the PNGs exported
+by inkscape requires Pillow).
 """
 
+import argparse
+import concurrent.futures
+import contextlib
+import copy
+import hashlib
+import inspect
+import io
 import os
 import sys
 import subprocess
+import types
+import xml.etree.ElementTree as ET
 import svgwrite
 import json
 import math
 
+import numpy as np
+
+import geometry
+from jsonstore import load_json, save_json
+import rasterizer
+try:
+    import glyphs
+except ImportError:
+    # fontTools is not installed, text can only be converted via inkscape
+    glyphs = None
+try:
+    from PIL import Image
+except ImportError:
+    # Pillow is not installed, PNGs exported by inkscape are kept as they are
+    Image = None
+
 
 def rm2dimensions():
     """Returns the dimensions of the rm2 screen."""
@@ -30,15 +62,135 @@ def rm2dimensions():
     return w_px, h_px, w_mm, h_mm
 
 
-def grid5mm(filename, draw_markers=False):
+class StrokeLayer(object):
+    """
+    Collects the straight strokes of a template.
+
+    By default, each stroke is added as a separate <line> to the given
+    group. If coalesce is set, all strokes of the same CSS class are merged
+    into a single <path> instead (added to a 'strokes' group at the z-order
+    position where this layer has been created, once flush() is called).
+    This reduces the SVG size and loading time considerably.
+    """
+
+    def __init__(self, dwg, coalesce, layer_id='strokes'):
+        self.dwg = dwg
+        self.coalesce = coalesce
+        # Path data per CSS class (insertion ordered, to keep the z-order)
+        self.segments = dict()
+        self.group = dwg.add(dwg.g(id=layer_id)) if coalesce else None
+
+    def add(self, group, start, end, class_):
+        """Adds a line from start to end (both in [px])."""
+        if not self.coalesce:
+            group.add(self.dwg.line(start=start, end=end, class_=class_))
+            return
+        x0, y0 = geometry.format_px(start[0]), geometry.format_px(start[1])
+        x1, y1 = geometry.format_px(end[0]), geometry.format_px(end[1])
+        if y0 == y1:
+            seg = f'M{x0},{y0}H{x1}'
+        elif x0 == x1:
+            seg = f'M{x0},{y0}V{y1}'
+        else:
+            seg = f'M{x0},{y0}L{x1},{y1}'
+        self.segments.setdefault(class_, list()).append(seg)
+
+    def add_many(self, group, x0, y0, x1, y1, classes):
+        """
+        Adds multiple lines at once, from (x0, y0) to (x1, y1). Coordinates
+        (in [px]) and CSS classes can be numpy arrays or scalars (which will
+        be broadcast).
+        """
+        x0, y0, x1, y1, classes = np.broadcast_arrays(x0, y0, x1, y1, classes)
+        if not self.coalesce:
+            for sx, sy, ex, ey, class_ in zip(x0.tolist(), y0.tolist(), x1.tolist(),
+                                              y1.tolist(), classes.tolist()):
+                group.add(self.dwg.line(start=(sx, sy), end=(ex, ey), class_=class_))
+            return
+        fx0, fy0 = geometry.format_px(x0), geometry.format_px(y0)
+        fx1, fy1 = geometry.format_px(x1), geometry.format_px(y1)
+        start = np.char.add(np.char.add(np.char.add('M', fx0), ','), fy0)
+        segs = np.where(fy0 == fy1, np.char.add(np.char.add(start, 'H'), fx1),
+                        np.where(fx0 == fx1, np.char.add(np.char.add(start, 'V'), fy1),
+                                 np.char.add(np.char.add(np.char.add(np.char.add(start, 'L'), fx1), ','), fy1)))
+        # Keep the order of the segments (and of the classes' first appearance)
+        for class_ in dict.fromkeys(classes.tolist()):
+            self.segments.setdefault(class_, list()).extend(segs[classes == class_].tolist())
+
+    def flush(self):
+        """Emits a single path per CSS class (only needed if coalesce is set)."""
+        for class_, segs in self.segments.items():
+            self.group.add(self.dwg.path(d=''.join(segs), class_=class_, fill='none'))
+        self.segments = dict()
+
+
+def overlay_drawing(dwg):
+    """
+    Returns a shallow copy of the drawing to derive a variant of a template,
+    i.e. new elements can be added on top of the copy without affecting the
+    original drawing. The existing elements (including the defs) are shared,
+    so they must not be modified.
+    """
+    overlay = copy.copy(dwg)
+    overlay.attribs = dict(dwg.attribs)
+    overlay.elements = list(dwg.elements)
+    return overlay
+
+
+def grid_markers(dwg, left_mm, top_mm, grid_w_mm, grid_h_mm, coalesce_strokes=True):
+    """
+    Adds '+' markers at the center and the quadrant centers of the given
+    grid area (in [mm]) as a separate layer on top of the drawing (the
+    drawing's style must define the 'mark' class).
+    """
+    w_px, h_px, w_mm, h_mm = rm2dimensions()
+    strokes = StrokeLayer(dwg, coalesce_strokes, layer_id='mark-strokes')
+    center_marks = dwg.add(dwg.g(id='marks'))
+    length_mm = 3
+    lhx_px = length_mm / 2 / w_mm * w_px
+    lhy_px = length_mm / 2 / h_mm * h_px
+    for fx, fy in [(1/2, 1/2), (1/4, 1/4), (3/4, 1/4), (1/4, 3/4), (3/4, 3/4)]:
+        cx_px = (left_mm + fx * grid_w_mm) / w_mm * w_px
+        cy_px = (top_mm + fy * grid_h_mm) / h_mm * h_px
+        strokes.add(center_marks, (cx_px - lhx_px, cy_px), (cx_px + lhx_px, cy_px), 'mark')
+        strokes.add(center_marks, (cx_px, cy_px - lhy_px), (cx_px, cy_px + lhy_px), 'mark')
+    strokes.flush()
+    return dwg
+
+
+def dot_row(dwg, row_id, left, cell_width, num_cols, radius, class_):
+    """
+    Defines a row of num_cols guide dots at (left + i * cell_width, 0), which
+    is drawn via fill_dots(). Uses <defs>/<use> instead of a <pattern>, since
+    patterns aren't part of SVG Tiny.
+    """
+    row = dwg.defs.add(dwg.g(id=row_id))
+    for i in range(num_cols):
+        row.add(dwg.circle(center=(left + i * cell_width, 0), r=radius, class_=class_))
+    return row
+
+
+def fill_dots(dwg, group, row, row_ys):
+    """Adds a reference to the given dot_row for each of the vertical positions (in [px])."""
+    for y in row_ys:
+        group.add(dwg.use(row, insert=(0, y)))
+
+
+def grid5mm(filename, draw_markers=False, coalesce_strokes=True, grid_step_mm=5):
     """
     Renders a 5x5 mm grid.
 
     :filename: Output filename of the SVG.
 
-    :draw_markers: Draw '+' markers at the page and quadrant centers.
-                   These markers will not be aligned with the grid corners
-                   due to the display dimensions!
+    :draw_markers: Draw '+' markers at the page and quadrant centers (see
+                   grid5mm_markers). These markers will not be aligned with
+                   the grid corners due to the display dimensions!
+
+    :coalesce_strokes: Merge all lines of the same CSS class into a single
+                   SVG path (significantly smaller SVG) instead of adding
+                   a separate <line> per stroke.
+
+    :grid_step_mm: Size of the grid cells in [mm].
     """
     w_px, h_px, w_mm, h_mm = rm2dimensions()
 
@@ -50,10 +202,12 @@ def grid5mm(filename, draw_markers=False):
     dwg.attribs['width'] = f'{w_px}px'
 
     # Add style definitions
-    dwg.defs.add(dwg.style(".grid { stroke: rgb(128,128,128); stroke-width:0.3px; }"))
+    dwg.defs.add(dwg.style(".grid { stroke: rgb(128,128,128); stroke-width:0.3px; }"
+                           " .mark { stroke: rgb(128,128,128); stroke-width: 2px; }"))
 
     # Background should not be transparent
     dwg.add(dwg.rect(insert=(0, 0), size=(w_px, h_px), fill='white'))
+    strokes = StrokeLayer(dwg, coalesce_strokes)
 
     # Millimeter to pixel conversion
     def ymm2px(y_mm):
@@ -64,46 +218,33 @@ def grid5mm(filename, draw_markers=False):
 
     # Horizontal lines
     grid = dwg.add(dwg.g(id='hlines'))
-    for y_mm in range(0, h_mm+1, 5):
-        y_px = ymm2px(y_mm)
-        grid.add(dwg.line(start=(0, y_px), end=(w_px, y_px),
-                          class_='grid'))
+    y_px = ymm2px(geometry.steps(0, h_mm, grid_step_mm))
+    strokes.add_many(grid, 0, y_px, w_px, y_px, 'grid')
 
     # Vertical lines (shift to the right, to have the
     # rightmost line aligned with the display border)
     grid = dwg.add(dwg.g(id='vlines'))
-    offset_mm = w_mm % 5
-    for x_mm in range(0, w_mm+1, 5):
-        x_px = xmm2px(x_mm + offset_mm)
-        grid.add(dwg.line(start=(x_px, 0), end=(x_px, h_px),
-                          class_='grid'))
-    
+    offset_mm = w_mm % grid_step_mm
+    x_px = xmm2px(geometry.steps(0, w_mm, grid_step_mm) + offset_mm)
+    strokes.add_many(grid, x_px, 0, x_px, h_px, 'grid')
+    strokes.flush()
+
     # Draw '+' marks
     if draw_markers:
-        center_marks = dwg.add(dwg.g(id='marks'))
-        def draw_marker(gcx_mm, gcy_mm):
-            length_mm = 3
-            cx_px = xmm2px(gcx_mm)
-            cy_px = ymm2px(gcy_mm)
-            lh_px = xmm2px(length_mm / 2)
-            center_marks.add(dwg.line(start=(cx_px - lh_px, cy_px),
-                                    end=(cx_px + lh_px, cy_px),
-                                    class_='mark'))
-            lh_px = ymm2px(length_mm / 2)
-            center_marks.add(dwg.line(start=(cx_px, cy_px - lh_px),
-                                    end=(cx_px, cy_px + lh_px),
-                                    class_='mark'))
-
-        grid_w_mm = (w_mm // 5) * 5
-        grid_h_mm = h_mm
-        draw_marker(grid_w_mm/2 + offset_mm, grid_h_mm/2)
-        draw_marker(grid_w_mm/4 + offset_mm, grid_h_mm/4)
-        draw_marker(3*grid_w_mm/4 + offset_mm, grid_h_mm/4)
-        draw_marker(grid_w_mm/4 + offset_mm, 3*grid_h_mm/4)
-        draw_marker(3*grid_w_mm/4 + offset_mm, 3*grid_h_mm/4)
+        grid5mm_markers(dwg, coalesce_strokes=coalesce_strokes, grid_step_mm=grid_step_mm)
     return dwg
 
 
+def grid5mm_markers(dwg, coalesce_strokes=True, grid_step_mm=5, **kwargs):
+    """
+    Adds the '+' markers to a drawing of grid5mm (rendered with the same
+    parameters), e.g. to derive the display variant of the template.
+    """
+    w_mm, h_mm = rm2dimensions()[2:]
+    return grid_markers(dwg, w_mm % grid_step_mm, 0, (w_mm // grid_step_mm) * grid_step_mm,
+                        h_mm, coalesce_strokes)
+
+
 def ruled_grid5mm(filename,
                   major_tick_len_horz_mm=5.0,
                   major_tick_len_vert_mm=3.5,
@@ -112,7 +253,10 @@ def ruled_grid5mm(filename,
                   draw_corner_diagonals=False,
                   invert_vertical_axis=True,
                   font_size_px=21,
-                  landscape=False):
+                  landscape=False,
+                  coalesce_strokes=True,
+                  tick_step_mm=1,
+                  grid_step_mm=5):
     """
     Renders a 5x5 mm grid with rulers.
 
@@ -134,7 +278,8 @@ def ruled_grid5mm(filename,
             'text rotation' in SVGs to understand why making this
             exact would be overkill).
 
-    :draw_markers: Draw '+' markers at the page and quadrant centers.
+    :draw_markers: Draw '+' markers at the page and quadrant centers (see
+            ruled_grid5mm_markers).
 
     :draw_corner_diagonals: Draw diagonals in the corners (where the
             rulers overlap).
@@ -147,6 +292,15 @@ def ruled_grid5mm(filename,
 
     :landscape: Set to True for landscape, False for portrait version
             of this template.
+
+    :coalesce_strokes: Merge all lines of the same CSS class (grid, ruler,
+            ruler-major, mark) into a single SVG path each, instead of
+            adding a separate <line> per stroke.
+
+    :tick_step_mm: Distance between the rulers' ticks in [mm], e.g. 0.5
+            (every 5 mm there will be a major tick, every 10 mm a label).
+
+    :grid_step_mm: Size of the grid cells in [mm].
     """
     w_px, h_px, w_mm, h_mm = rm2dimensions()
 
@@ -168,6 +322,7 @@ def ruled_grid5mm(filename,
     # Background should not be transparent to avoid "funny" eraser or export 
     # behavior (according to some reddit posts I can't find anymore...)
     dwg.add(dwg.rect(insert=(0, 0), size=(w_px, h_px), fill='white'))
+    strokes = StrokeLayer(dwg, coalesce_strokes)
 
     # Millimeter to pixel conversion
     def ymm2px(y_mm):
@@ -178,21 +333,15 @@ def ruled_grid5mm(filename,
 
     # Draw grid: Horizontal lines
     grid = dwg.add(dwg.g(id='hlines'))
-    y_mm = 0
-    while y_mm + 2*major_tick_len_horz_mm <= h_mm:
-        y_px = ymm2px(y_mm + major_tick_len_horz_mm)
-        grid.add(dwg.line(start=(0, y_px), end=(w_px, y_px),
-                          class_='grid'))
-        y_mm += 5
+    y_px = ymm2px(geometry.steps(0, h_mm - 2*major_tick_len_horz_mm, grid_step_mm)
+                  + major_tick_len_horz_mm)
+    strokes.add_many(grid, 0, y_px, w_px, y_px, 'grid')
 
     # Draw grid: Vertical lines
     grid = dwg.add(dwg.g(id='vlines'))
-    x_mm = 0
-    while x_mm + 2*major_tick_len_vert_mm <= w_mm:
-        x_px = xmm2px(x_mm + major_tick_len_vert_mm)
-        grid.add(dwg.line(start=(x_px, 0), end=(x_px, h_px),
-                          class_='grid'))
-        x_mm += 5
+    x_px = xmm2px(geometry.steps(0, w_mm - 2*major_tick_len_vert_mm, grid_step_mm)
+                  + major_tick_len_vert_mm)
+    strokes.add_many(grid, x_px, 0, x_px, h_px, 'grid')
 
     # Compute length of minor ticks (every 5 mm)
     minor_tick_len_horz_mm = major_tick_len_horz_mm - 1.0
@@ -200,95 +349,68 @@ def ruled_grid5mm(filename,
 
     # Add the ruler ticks
     ruler = dwg.add(dwg.g(id='ruler'))
+    def add_labels(texts, xs, ys, anchor):
+        for txt, x, y in zip(texts, xs.tolist(), ys.tolist()):
+            txttag = dwg.text(txt,
+                              insert=(x, y),
+                              class_='txt',
+                              text_anchor=anchor)
+            if landscape:
+                txttag.rotate(angle=-90, center=(x, y))
+            ruler.add(txttag)
+            # ruler.add(dwg.circle(center=(x, y), r=2, fill="red"))  # To debug text alignment
+
+    # Horizontal rulers: offset (left) is the length (width) of the
+    # vertical ruler's major ticks!
+    ticks_mm, is_major, is_labeled = geometry.ruler_ticks(
+        w_mm - 2*major_tick_len_vert_mm, tick_step_mm)
+    max_x_tick = ((w_mm - 2*major_tick_len_vert_mm) // 10) * 10
+    if landscape and invert_vertical_axis:
+        labels = [f'{int(max_x_tick - x_mm)}' for x_mm in ticks_mm[is_labeled].tolist()]
+    else:
+        labels = [f'{int(x_mm)}' for x_mm in ticks_mm[is_labeled].tolist()]
+    tick_classes = np.where(is_major, 'ruler-major', 'ruler')
     def hruler(y_px, direction):
         minor_px = ymm2px(minor_tick_len_horz_mm)
         major_px = ymm2px(major_tick_len_horz_mm)
-        # Offset (left) is the length (width) of the
-        # vertical ruler's major ticks!
-        max_x_tick = ((w_mm - 2*major_tick_len_vert_mm) // 10) * 10
-        x_mm = 0
-        while x_mm + 2*major_tick_len_vert_mm <= w_mm:
-            x_px = xmm2px(x_mm + major_tick_len_vert_mm)
-            is_major = (x_mm % 5) == 0
-            y_end = y_px + direction * (major_px if is_major else minor_px)
-            ruler.add(dwg.line(start=(x_px, y_px), end=(x_px, y_end),
-                              class_='ruler-major' if is_major else 'ruler'))
-            if x_mm % 10 == 0 and x_mm > 0 and x_mm < w_mm - 2*major_tick_len_vert_mm:
-                y = y_px + direction * (major_px + ymm2px(tick_label_margin_mm) + font_size_px / 2)
-                if landscape:
-                    # qad: additional spacing required due to the rotation
-                    y += direction * (font_size_px / 4)
-                txt = f'{int(max_x_tick - x_mm)}' if (landscape and invert_vertical_axis) else f'{int(x_mm)}'
-                txttag = dwg.text(txt,
-                                  insert=(x_px, y),
-                                  class_='txt',
-                                  text_anchor='middle')
-                if landscape:
-                    txttag.rotate(angle=-90, center=(x_px, y))
-                ruler.add(txttag)
-                # ruler.add(dwg.circle(center=(x_px, y), r=2, fill="red"))  # To debug text alignment
-            x_mm += 1
+        x_px = xmm2px(ticks_mm + major_tick_len_vert_mm)
+        y_end = y_px + direction * np.where(is_major, major_px, minor_px)
+        strokes.add_many(ruler, x_px, y_px, x_px, y_end, tick_classes)
+        y = y_px + direction * (major_px + ymm2px(tick_label_margin_mm) + font_size_px / 2)
+        if landscape:
+            # qad: additional spacing required due to the rotation
+            y += direction * (font_size_px / 4)
+        x_px = x_px[is_labeled]
+        add_labels(labels, x_px, np.full_like(x_px, y), 'middle')
     hruler(0, +1)
     hruler(h_px, -1)
 
+    # Vertical rulers: offset (top/bottom) is the length of the
+    # horizontal ruler's major ticks!
+    ticks_mm, is_major, is_labeled = geometry.ruler_ticks(
+        h_mm - 2*major_tick_len_horz_mm, tick_step_mm)
+    max_y_tick = ((h_mm - 2*major_tick_len_horz_mm) // 10) * 10
+    if landscape or invert_vertical_axis:
+        labels = [f'{int(max_y_tick - y_mm)}' for y_mm in ticks_mm[is_labeled].tolist()]
+    else:
+        labels = [f'{int(y_mm)}' for y_mm in ticks_mm[is_labeled].tolist()]
+    tick_classes = np.where(is_major, 'ruler-major', 'ruler')
     def vruler(x_px, direction):
         minor_px = xmm2px(minor_tick_len_vert_mm)
         major_px = xmm2px(major_tick_len_vert_mm)
-        # Offset (top/bottom) is the length of the
-        # horizontal ruler's major ticks!
-        max_y_tick = ((h_mm - 2*major_tick_len_horz_mm) // 10) * 10
-        y_mm = 0
-        while y_mm + 2*major_tick_len_horz_mm <= h_mm:
-            y_px = ymm2px(y_mm + major_tick_len_horz_mm)
-            is_major = (y_mm % 5) == 0
-            x_end = x_px + direction * (major_px if is_major else minor_px)
-            ruler.add(dwg.line(start=(x_px, y_px), end=(x_end, y_px),
-                              class_='ruler-major' if is_major else 'ruler'))
-            if y_mm % 10 == 0 and y_mm > 0 and y_mm < h_mm - 2*major_tick_len_horz_mm:
-                x = x_px + direction * (major_px + xmm2px(tick_label_margin_mm))
-                if landscape:
-                    # qad: additional spacing required due to the rotation
-                    x += direction * (font_size_px / 3)
-                    txt = f'{int(max_y_tick - y_mm)}'
-                else:
-                    txt = f'{int(max_y_tick - y_mm)}' if invert_vertical_axis else f'{int(y_mm)}'
-                anchor = 'middle' if landscape else ('end' if direction < 0 else 'start')
-                txttag = dwg.text(txt,
-                                  insert=(x, y_px),
-                                  class_='txt',
-                                  text_anchor=anchor)
-                if landscape:
-                    txttag.rotate(angle=-90, center=(x, y_px))
-                ruler.add(txttag)
-                # ruler.add(dwg.circle(center=(x, y_px), r=2, fill="red"))  # To debug text alignment
-            y_mm += 1
+        y_px = ymm2px(ticks_mm + major_tick_len_horz_mm)
+        x_end = x_px + direction * np.where(is_major, major_px, minor_px)
+        strokes.add_many(ruler, x_px, y_px, x_end, y_px, tick_classes)
+        x = x_px + direction * (major_px + xmm2px(tick_label_margin_mm))
+        if landscape:
+            # qad: additional spacing required due to the rotation
+            x += direction * (font_size_px / 3)
+        anchor = 'middle' if landscape else ('end' if direction < 0 else 'start')
+        y_px = y_px[is_labeled]
+        add_labels(labels, np.full_like(y_px, x), y_px, anchor)
     vruler(0, +1)
     vruler(w_px, -1)
 
-    # Draw '+' marks
-    if draw_markers:
-        center_marks = dwg.add(dwg.g(id='marks'))
-        def draw_marker(gcx_mm, gcy_mm):
-            length_mm = 3
-            cx_px = xmm2px(gcx_mm + major_tick_len_vert_mm)
-            cy_px = ymm2px(gcy_mm + major_tick_len_horz_mm)
-            lh_px = xmm2px(length_mm / 2)
-            center_marks.add(dwg.line(start=(cx_px - lh_px, cy_px),
-                                    end=(cx_px + lh_px, cy_px),
-                                    class_='mark'))
-            lh_px = ymm2px(length_mm / 2)
-            center_marks.add(dwg.line(start=(cx_px, cy_px - lh_px),
-                                    end=(cx_px, cy_px + lh_px),
-                                    class_='mark'))
-
-        grid_w_mm = w_mm - 2 * major_tick_len_vert_mm
-        grid_h_mm = h_mm - 2 * major_tick_len_horz_mm
-        draw_marker(grid_w_mm/2, grid_h_mm/2)
-        draw_marker(grid_w_mm/4, grid_h_mm/4)
-        draw_marker(3*grid_w_mm/4, grid_h_mm/4)
-        draw_marker(grid_w_mm/4, 3*grid_h_mm/4)
-        draw_marker(3*grid_w_mm/4, 3*grid_h_mm/4)
-
     # Draw diagonals at the 4 courners (non-drawing/grid area)
     corners = dwg.add(dwg.g(id='corner'))
     lines = [
@@ -307,9 +429,7 @@ def ruled_grid5mm(filename,
 
     if draw_corner_diagonals:
         for ln in lines:
-            corners.add(dwg.line(start=mm2px(ln[0]),
-                                end=mm2px(ln[1]),
-                                class_='ruler'))
+            strokes.add(corners, mm2px(ln[0]), mm2px(ln[1]), 'ruler')
 
     # "Neatification" aka overkill at the corners:
     for x_mm in range(-1, -int(major_tick_len_vert_mm + 0.5), -1):
@@ -323,24 +443,16 @@ def ruled_grid5mm(filename,
         # Top-left
         x_px = xmm2px(xpos)
         y_px = ymm2px(y_mm)
-        corners.add(dwg.line(start=(x_px, 0),
-                             end=(x_px, y_px),
-                             class_='ruler'))
+        strokes.add(corners, (x_px, 0), (x_px, y_px), 'ruler')
         # Bottom-left
-        corners.add(dwg.line(start=(x_px, h_px),
-                             end=(x_px, h_px - y_px),
-                             class_='ruler'))
+        strokes.add(corners, (x_px, h_px), (x_px, h_px - y_px), 'ruler')
         # Top-right
         xpos = w_mm - major_tick_len_vert_mm - x_mm
         x_px = xmm2px(xpos)
         y_px = ymm2px(y_mm)
-        corners.add(dwg.line(start=(x_px, 0),
-                             end=(x_px, y_px),
-                             class_='ruler'))
+        strokes.add(corners, (x_px, 0), (x_px, y_px), 'ruler')
         # Bottom-right
-        corners.add(dwg.line(start=(x_px, h_px),
-                             end=(x_px, h_px - y_px),
-                             class_='ruler'))
+        strokes.add(corners, (x_px, h_px), (x_px, h_px - y_px), 'ruler')
 
     for y_mm in range(-1, -int(major_tick_len_horz_mm + 0.5), -1):
         # Don't forget: we have an offset between pixel 0 and drawing area/grid
@@ -352,26 +464,37 @@ def ruled_grid5mm(filename,
         # Top-left
         y_px = ymm2px(ypos)
         x_px = xmm2px(x_mm)
-        corners.add(dwg.line(start=(0, y_px),
-                             end=(x_px, y_px),
-                             class_='ruler'))
+        strokes.add(corners, (0, y_px), (x_px, y_px), 'ruler')
         # Top-right
-        corners.add(dwg.line(start=(w_px, y_px),
-                             end=(w_px - x_px, y_px),
-                             class_='ruler'))
+        strokes.add(corners, (w_px, y_px), (w_px - x_px, y_px), 'ruler')
         # Bottom-left
         ypos = h_mm - major_tick_len_horz_mm - y_mm
         y_px = ymm2px(ypos)
-        corners.add(dwg.line(start=(0, y_px),
-                             end=(x_px, y_px),
-                             class_='ruler'))
+        strokes.add(corners, (0, y_px), (x_px, y_px), 'ruler')
         # Bottom-right
-        corners.add(dwg.line(start=(w_px, y_px),
-                             end=(w_px - x_px, y_px),
-                             class_='ruler'))
+        strokes.add(corners, (w_px, y_px), (w_px - x_px, y_px), 'ruler')
+    strokes.flush()
+
+    # Draw '+' marks
+    if draw_markers:
+        ruled_grid5mm_markers(dwg, major_tick_len_horz_mm, major_tick_len_vert_mm,
+                              coalesce_strokes=coalesce_strokes)
     return dwg
 
 
+def ruled_grid5mm_markers(dwg, major_tick_len_horz_mm=5.0, major_tick_len_vert_mm=3.5,
+                          coalesce_strokes=True, **kwargs):
+    """
+    Adds the '+' markers to a drawing of ruled_grid5mm or print3d_template
+    (rendered with the same parameters), e.g. to derive the display variant
+    of the template.
+    """
+    w_mm, h_mm = rm2dimensions()[2:]
+    return grid_markers(dwg, major_tick_len_vert_mm, major_tick_len_horz_mm,
+                        w_mm - 2 * major_tick_len_vert_mm, h_mm - 2 * major_tick_len_horz_mm,
+                        coalesce_strokes)
+
+
 
 def print3d_template(filename,
                      major_tick_len_horz_mm=5.0,
@@ -381,7 +504,8 @@ def print3d_template(filename,
                      draw_corner_diagonals=False,
                      invert_vertical_axis=True,
                      font_size_px=21,
-                     landscape=False):
+                     landscape=False,
+                     coalesce_strokes=True):
     dwg = ruled_grid5mm(filename,
                         major_tick_len_horz_mm=major_tick_len_horz_mm,
                         major_tick_len_vert_mm=major_tick_len_vert_mm,
@@ -390,7 +514,8 @@ def print3d_template(filename,
                         draw_corner_diagonals=draw_corner_diagonals,
                         invert_vertical_axis=invert_vertical_axis,
                         font_size_px=font_size_px,
-                        landscape=landscape)
+                        landscape=landscape,
+                        coalesce_strokes=coalesce_strokes)
     # Millimeter to pixel conversion
     w_px, h_px, w_mm, h_mm = rm2dimensions()
     def ymm2px(y_mm):
@@ -440,13 +565,17 @@ def print3d_template(filename,
     return dwg
 
 
-def gardening_planner(filename, font_size_px=42):
+def gardening_planner(filename, font_size_px=42, tile_dots=True):
     """
     Renders a quarterly gardening task list/planner.
 
     :filename: Output filename of the SVG.
 
     :font_size_px: Font size of the title in pixels.
+
+    :tile_dots: Define a row of guide dots once and reference it for each
+                row (significantly smaller SVG) instead of adding a
+                separate <circle> per dot.
     """
     w_px, h_px, w_mm, h_mm = rm2dimensions()
 
@@ -500,16 +629,24 @@ def gardening_planner(filename, font_size_px=42):
                           class_='grid'))
     
     # Dots
-    y_mm = title_height_mm + guide_cell_size_mm
-    while y_mm <= h_mm - guide_cell_size_mm:
-        y_px = ymm2px(y_mm)
-        if all([abs(y_mm - y) > 1 for y in hline_positions]):
-            x_mm = guide_cell_size_mm
-            while x_mm <= w_mm - month_title_height_mm - guide_cell_size_mm:
-                x_px = xmm2px(x_mm)
-                grid.add(dwg.circle(center=(x_px, y_px), r=0.5, class_='grid'))
-                x_mm += guide_cell_size_mm
-        y_mm += guide_cell_size_mm
+    if tile_dots:
+        num_cols = int((w_mm - month_title_height_mm - guide_cell_size_mm) // guide_cell_size_mm)
+        dots = dot_row(dwg, 'dots', xmm2px(guide_cell_size_mm), xmm2px(guide_cell_size_mm),
+                       num_cols, 0.5, 'grid')
+    # Rows of dots (i.e. runs of consecutive rows between two horizontal lines)
+    dot_ys_mm = geometry.steps(title_height_mm + guide_cell_size_mm,
+                               h_mm - guide_cell_size_mm, guide_cell_size_mm)
+    is_dot_row = np.all(np.abs(dot_ys_mm[:, None] - np.asarray(hline_positions)[None, :]) > 1, axis=1)
+    for start, num_rows in geometry.runs(is_dot_row):
+        if tile_dots:
+            fill_dots(dwg, grid, dots, ymm2px(dot_ys_mm[start:start+num_rows]).tolist())
+        else:
+            dot_xs_px = xmm2px(geometry.steps(guide_cell_size_mm,
+                                              w_mm - month_title_height_mm - guide_cell_size_mm,
+                                              guide_cell_size_mm)).tolist()
+            for y_px in ymm2px(dot_ys_mm[start:start+num_rows]).tolist():
+                for x_px in dot_xs_px:
+                    grid.add(dwg.circle(center=(x_px, y_px), r=0.5, class_='grid'))
     
     dwg.add(dwg.text('Gartenplaner',
                      insert=(xmm2px(0.35*w_mm), ymm2px(title_height_mm/2)),
@@ -530,7 +667,8 @@ def todo_list(filename, font_size_px=42,
               margin_left_mm=14,
               checkbox_size_mm=3.5,
               distance_box_dots_mm=3.5,
-              distance_box_divider_mm=-1.5):
+              distance_box_divider_mm=-1.5,
+              tile_dots=True):
     """
     Renders a todo list (similar to the built-in, but with
     additional dots for orientation and nicer checkbox indentation)
@@ -555,6 +693,10 @@ def todo_list(filename, font_size_px=42,
 
     :distance_box_divider_mm: Distance between checkbox and item divider (can
                               also be negative).
+
+    :tile_dots: Define a row of guide dots once and reference it for each
+                row (significantly smaller SVG) instead of adding a
+                separate <circle> per dot.
     """
     w_px, h_px, w_mm, h_mm = rm2dimensions()
 
@@ -619,9 +761,18 @@ def todo_list(filename, font_size_px=42,
     divider_left_px = xmm2px(margin_left_mm
                              + checkbox_size_mm
                              + distance_box_divider_mm)
+    if tile_dots:
+        num_cols = math.ceil((w_px - guide_left_px) / guide_width_px)
+        dots = dot_row(dwg, 'dots', guide_left_px, guide_width_px, num_cols,
+                       guide_radius_px, 'dots')
+    # Consecutive rows of dots (only needed to tile the dots)
+    dot_rows = list()
     while guide_row < num_rows:
         y_px = ymm2px(y_mm)
         if (guide_row % num_guides_per_item == 0) and (item_count < num_items):
+            if len(dot_rows) > 0:
+                fill_dots(dwg, grid, dots, dot_rows)
+                dot_rows = list()
             x_px = 0 if guide_row == 0 else divider_left_px            
             grid.add(dwg.line(start=(x_px, y_px), end=(w_px, y_px),
                               class_='divider'))
@@ -630,6 +781,8 @@ def todo_list(filename, font_size_px=42,
                               size=(checkbox_width_px, checkbox_height_px),
                               class_='checkbox'))
             item_count += 1
+        elif tile_dots:
+            dot_rows.append(y_px)
         else:
             # Draw dots for guidance
             x_px = guide_left_px
@@ -638,6 +791,8 @@ def todo_list(filename, font_size_px=42,
                 x_px += guide_width_px
         guide_row += 1
         y_mm += guide_cells_mm
+    if len(dot_rows) > 0:
+        fill_dots(dwg, grid, dots, dot_rows)
 
     return dwg
 
@@ -773,9 +928,209 @@ def template_dict(name, filename, icon_code,
     }
 
 
+def run_inkscape(cmd):
+    """
+    Runs the given inkscape command line, forwards its console output to
+    stdout (so it ends up in the per-template log) and raises a RuntimeError
+    if inkscape fails.
+    """
+    proc = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, universal_newlines=True)
+    if proc.stdout:
+        print(proc.stdout, end='' if proc.stdout.endswith('\n') else '\n')
+    if proc.returncode != 0:
+        raise RuntimeError(f'inkscape failed with exit code {proc.returncode}: {cmd}')
+
+
+def optimize_png(png_filename, bit_depth=4, levels=rasterizer.PANEL_GRAY_LEVELS):
+    """
+    Re-encodes a PNG exported by inkscape (RGBA) as grayscale PNG with the
+    given bit depth, quantized to the given number of gray levels (see
+    rasterizer.write_png). Requires Pillow, returns False if it is missing.
+    """
+    if Image is None:
+        print(f'* Pillow is not installed, cannot convert "{png_filename}" to grayscale.')
+        return False
+    with Image.open(png_filename) as img:
+        rgba = np.asarray(img.convert('RGBA'), dtype=np.float64) / 255
+    # Blend over white (the background of the templates)
+    luma = rgba[..., :3] @ np.array([0.299, 0.587, 0.114])
+    gray = luma * rgba[..., 3] + (1 - rgba[..., 3])
+    rasterizer.write_png(png_filename, np.rint(gray * 255).astype(np.uint8), bit_depth, levels)
+    return True
+
+
+class InkscapeConverter(object):
+    """
+    Performs the inkscape conversions right away, i.e. each conversion
+    starts a separate inkscape process. Exported PNGs are converted to
+    grayscale with the given bit depth and number of gray levels (see
+    optimize_png).
+    """
+
+    def __init__(self, png_bit_depth=4, gray_levels=rasterizer.PANEL_GRAY_LEVELS):
+        self.png_bit_depth = png_bit_depth
+        self.gray_levels = gray_levels
+
+    def text_to_path(self, rmfilename, svg_filename):
+        """Converts all text tags of the SVG to paths (in-place)."""
+        run_inkscape(f'inkscape "{svg_filename}" --export-text-to-path --export-plain-svg "{svg_filename}"')
+
+    def export_png(self, rmfilename, svg_filename, png_filename):
+        """Exports the SVG to a PNG which matches the rm2 screen resolution."""
+        run_inkscape(f'inkscape -z -f "{svg_filename}" -w 1404 -h 1872 -j -e "{png_filename}"')
+        if optimize_png(png_filename, self.png_bit_depth, self.gray_levels):
+            print(f'* Converted PNG to {self.png_bit_depth}-bit grayscale ({self.gray_levels} levels).')
+
+    def remove(self, rmfilename, filename):
+        """Removes an intermediate file once it is no longer needed."""
+        os.remove(filename)
+
+
+class InkscapeSession(InkscapeConverter):
+    """
+    Queues all conversions of a build and runs them through a single
+    'inkscape --shell' session, which avoids paying inkscape's startup
+    time for every single conversion.
+
+    The queue consists of plain tuples, so the queues of parallel workers
+    can be returned to and merged by the main process (see extend()). The
+    exported PNGs are converted to grayscale once the session is done.
+    """
+
+    def __init__(self, png_bit_depth=4, gray_levels=rasterizer.PANEL_GRAY_LEVELS):
+        super().__init__(png_bit_depth, gray_levels)
+        # Tuples of (rmfilename, shell command or None, affected file)
+        self.queue = list()
+
+    def text_to_path(self, rmfilename, svg_filename):
+        self.queue.append((rmfilename,
+            f'"{svg_filename}" --export-text-to-path --export-plain-svg="{svg_filename}"',
+            svg_filename))
+
+    def export_png(self, rmfilename, svg_filename, png_filename):
+        # Exported to a temporary file, which replaces the PNG once the
+        # session succeeded (see run())
+        self.queue.append((rmfilename,
+            f'-f "{svg_filename}" -w 1404 -h 1872 -j -e "{partial_filename(png_filename)}"',
+            png_filename))
+
+    def remove(self, rmfilename, filename):
+        self.queue.append((rmfilename, None, filename))
+
+    def extend(self, queue):
+        """Appends the conversions queued by another session."""
+        self.queue.extend(queue)
+
+    def run(self):
+        """
+        Runs all queued conversions in a single inkscape session. Returns
+        the list of template files (rmfilename) whose conversion failed.
+        """
+        commands = [cmd for _, cmd, _ in self.queue if cmd is not None]
+        if len(commands) == 0:
+            return list()
+        print(f'* Running {len(commands)} conversion(s) in a single inkscape session (requires inkscape).')
+        # inkscape's shell mode doesn't report errors via its exit code, so
+        # we have to check the outputs instead: PNGs are exported to temporary
+        # files (the previous PNGs are kept if the export fails), SVGs are
+        # converted in-place and mustn't contain text afterwards.
+        try:
+            proc = subprocess.run(['inkscape', '--shell'],
+                                  input='\n'.join(commands + ['quit']) + '\n',
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                  universal_newlines=True)
+            if proc.stdout:
+                print(proc.stdout, end='' if proc.stdout.endswith('\n') else '\n')
+            session_ok = proc.returncode == 0
+        except OSError as e:
+            print(f'[ERROR] Cannot start inkscape: {e}')
+            session_ok = False
+        failed = list()
+        for rmfilename, cmd, filename in self.queue:
+            if cmd is None:
+                if os.path.exists(filename):
+                    os.remove(filename)
+                continue
+            output = partial_filename(filename) if filename.endswith('.png') else filename
+            if not session_ok or not os.path.exists(output)\
+                    or (filename.endswith('.svg') and svg_file_has_text(filename)):
+                print(f'[ERROR] inkscape did not produce "{filename}"')
+                if rmfilename not in failed:
+                    failed.append(rmfilename)
+                if output != filename and os.path.exists(output):
+                    os.remove(output)
+            elif filename.endswith('.png'):
+                optimize_png(output, self.png_bit_depth, self.gray_levels)
+                os.replace(output, filename)
+        self.queue = list()
+        return failed
+
+
+def partial_filename(filename):
+    """Returns the temporary filename of an output which is still being exported."""
+    root, ext = os.path.splitext(filename)
+    return f'{root}.partial{ext}'
+
+
+def has_text(dwg):
+    """Checks whether the drawing contains any text tags."""
+    return any(elem.tag == 'text' for elem in dwg.get_xml().iter())
+
+
+def svg_file_has_text(svg_filename):
+    """Checks whether the SVG file contains any text tags (or cannot be parsed)."""
+    try:
+        return any(elem.tag.rsplit('}', 1)[-1] == 'text' for elem in ET.parse(svg_filename).iter())
+    except ET.ParseError:
+        return True
+
+
+def rasterize_png(dwg, png_filename, png_backend, png_bit_depth=4,
+                  gray_levels=rasterizer.PANEL_GRAY_LEVELS):
+    """
+    Exports the drawing to a grayscale PNG via the built-in NumPy rasterizer,
+    unless the png_backend is 'inkscape'. Returns False if inkscape has to be
+    used instead (i.e. the drawing isn't supported and png_backend is 'auto').
+    """
+    if png_backend == 'inkscape':
+        return False
+    try:
+        rasterizer.save_png(dwg, png_filename, *rm2dimensions()[:2],
+                            bit_depth=png_bit_depth, levels=gray_levels)
+        print(f'* Rasterized SVG to {png_bit_depth}-bit grayscale PNG (built-in rasterizer).')
+        return True
+    except rasterizer.UnsupportedSVG as e:
+        if png_backend != 'auto':
+            raise
+        print(f'* Built-in rasterizer cannot render this template ({e}), falling back to inkscape.')
+        return False
+
+
 def save_template(svgtpl_export, svgtpl_display, name, rmfilename,
                   icon_code_portrait, icon_code_landscape,
-                  categories):
+                  categories, converter=None, png_backend='auto',
+                  text_font=None, display_overlay=None):
+    """
+    Saves the template's SVG, PNG and JSON snippet. The inkscape conversions
+    are either performed right away or queued, depending on the given
+    converter (see InkscapeConverter and InkscapeSession).
+
+    The png_backend can be 'inkscape', 'numpy' (built-in rasterizer, see
+    rasterizer.py) or 'auto' (use the built-in rasterizer if the template
+    is supported, otherwise fall back to inkscape). The rasterizer writes
+    the PNG in the converter's grayscale format (bit depth and gray levels).
+
+    If text_font (filename of the xkcd font) is given, text is converted to
+    glyph paths via glyphs.py instead of inkscape.
+
+    Instead of a separately rendered svgtpl_display, the display template
+    can be derived from the export template via display_overlay, i.e. a
+    function which adds the display-only layers to an overlay of the given
+    drawing (see display_overlay()).
+    """
+    if converter is None:
+        converter = InkscapeConverter()
     print(f"""
 ##############################################################
 Rendering template "{name}"
@@ -796,82 +1151,566 @@ Rendering template "{name}"
     with open(f'{rmfilename}.inc.json', 'w') as jif:
         json.dump(tpl_desc, jif, indent=2)
         jif.write('\n')
+    # Convert text to glyph paths (no inkscape needed)
+    if text_font is not None:
+        for dwg in [svgtpl_export, svgtpl_display]:
+            if dwg is not None and has_text(dwg):
+                num_replaced = glyphs.outline_text(dwg, text_font)
+                print(f'* Converted {num_replaced} SVG text tag(s) to glyph paths.')
+    # Derive the display template (after the text conversion, which would
+    # otherwise modify the shared elements twice)
+    if display_overlay is not None:
+        print('* Deriving the display template from the export template.')
+        svgtpl_display = display_overlay(svgtpl_export)
+    # Try the built-in rasterizer first (PNG shows the display template, if given)
+    png_done = rasterize_png(svgtpl_export if svgtpl_display is None else svgtpl_display,
+                             f'{rmfilename}.png', png_backend,
+                             converter.png_bit_depth, converter.gray_levels)
     #### Export to PNG first, if we have a separate display template
-    if svgtpl_display is not None:
-        # Save the corresponding SVG
+    if svgtpl_display is not None and not png_done:
+        # Save the corresponding SVG (to a separate file, because the conversions
+        # may be deferred until after the export template has been saved)
         print('* Saving the display template as SVG')
-        svgtpl_display.save()
+        display_filename = f'{rmfilename}.display.svg'
+        svgtpl_display.saveas(display_filename)
         # Convert text to path
-        print('* Converting SVG text to path tags (requires inkscape).')
-        subprocess.call(f'inkscape "{rmfilename}.svg" --export-text-to-path --export-plain-svg "{rmfilename}.svg"', shell=True)
+        if has_text(svgtpl_display):
+            print('* Converting SVG text to path tags (requires inkscape).')
+            converter.text_to_path(rmfilename, display_filename)
         # Export to PNG
         print('* Converting SVG to PNG (requires inkscape).')
-        subprocess.call(f'inkscape -z -f "{rmfilename}.svg" -w 1404 -h 1872 -j -e "{rmfilename}".png', shell=True)
+        converter.export_png(rmfilename, display_filename, f'{rmfilename}.png')
+        converter.remove(rmfilename, display_filename)
 
     # Save SVG
     svgtpl_export.save()
     # Convert text to path (to avoid problems with remarkable's PDF export)
-    print('* Converting SVG text to path tags (requires inkscape).')
-    subprocess.call(f'inkscape "{rmfilename}.svg" --export-text-to-path --export-plain-svg "{rmfilename}.svg"', shell=True)
+    if has_text(svgtpl_export):
+        print('* Converting SVG text to path tags (requires inkscape).')
+        converter.text_to_path(rmfilename, f'{rmfilename}.svg')
     # Export to PNG (if there's no separate display template)
-    if svgtpl_display is None:
+    if svgtpl_display is None and not png_done:
         print('* Converting SVG to PNG (requires inkscape).')
-        subprocess.call(f'inkscape -z -f "{rmfilename}.svg" -w 1404 -h 1872 -j -e "{rmfilename}".png', shell=True)
+        converter.export_png(rmfilename, f'{rmfilename}.svg', f'{rmfilename}.png')
 
 
-if __name__ == '__main__':
-    # A list of available icons (for a slightly older firmware version) can
-    # be found on reddit: https://www.reddit.com/r/RemarkableTablet/comments/j75nis/reference_image_template_icon_codes_for_23016/
-    # Render the 5mm grid
-    save_template(exam_protocol('ExamProtocolP.svg'), None,
-                  name='Exam Protocol', rmfilename='ExamProtocolP',
+# Registry of all available templates (see register_template)
+TEMPLATES = list()
+
+
+def register_template(name, rmfilename, generator, params=None,
+                      display_params=None, display_overlay=None,
+                      icon_code_portrait=None, icon_code_landscape=None,
+                      categories=None):
+    """
+    Declares a template which can be built by this script.
+
+    :name: Display name of the template on the device.
+
+    :rmfilename: Filename (without extension) of the template files.
+
+    :generator: Function which renders the SVG (its first parameter must
+            be the output filename).
+
+    :params: Keyword arguments for the generator.
+
+    :display_params: If not None, a separate display template (i.e. the
+            PNG shown on the device) will be rendered, using the params
+            updated by these keyword arguments.
+
+    :display_overlay: If not None, the display template is derived from
+            the export template instead of rendering it from scratch, i.e.
+            this function adds the display-only layers (e.g. markers) to
+            an overlay of the export drawing. It's called with the overlay
+            and the params (updated by display_params, if given).
+
+    :icon_code_portrait: Icon code of the portrait version (None if the
+            template shouldn't be available in portrait mode).
+
+    :icon_code_landscape: Icon code of the landscape version (None if the
+            template shouldn't be available in landscape mode).
+
+    :categories: List of categories on the device.
+    """
+    params = dict() if params is None else params
+    display = None if display_params is None else (generator, dict(params, **display_params))
+    if display_overlay is not None:
+        display_overlay = (display_overlay, params if display is None else display[1])
+        display = None
+    TEMPLATES.append(dict(
+        name=name, rmfilename=rmfilename,
+        export=(generator, params),
+        display=display,
+        display_overlay=display_overlay,
+        icon_code_portrait=icon_code_portrait,
+        icon_code_landscape=icon_code_landscape,
+        categories=list() if categories is None else categories))
+
+
+def select_templates(templates, names=None, categories=None):
+    """
+    Returns the templates which match any of the given names (display name or
+    filename) or categories (case-insensitive). If neither names nor categories
+    are given, all templates are returned. Raises a ValueError if a name or
+    category doesn't match any template.
+    """
+    if names is None and categories is None:
+        return list(templates)
+    names = [n.lower() for n in (names or list())]
+    categories = [c.lower() for c in (categories or list())]
+    selected = [tpl for tpl in templates
+                if tpl['name'].lower() in names or tpl['rmfilename'].lower() in names
+                or any(c.lower() in categories for c in tpl['categories'])]
+    unknown = [n for n in names
+               if all(n not in [tpl['name'].lower(), tpl['rmfilename'].lower()] for tpl in templates)]
+    unknown += [c for c in categories
+                if all(c not in [tc.lower() for tc in tpl['categories']] for tpl in templates)]
+    if len(unknown) > 0:
+        raise ValueError(f'No template matches: {unknown}')
+    return selected
+
+
+def list_templates(templates):
+    """Prints an overview of the given templates."""
+    print(f"{'Name':<16} {'File':<16} {'Orientation':<20} Categories")
+    for tpl in templates:
+        orientations = list()
+        if tpl['icon_code_portrait'] is not None:
+            orientations.append('portrait')
+        if tpl['icon_code_landscape'] is not None:
+            orientations.append('landscape')
+        print(f"{tpl['name']:<16} {tpl['rmfilename']:<16} {', '.join(orientations):<20} {', '.join(tpl['categories'])}")
+
+
+# A list of available icons (for a slightly older firmware version) can
+# be found on reddit: https://www.reddit.com/r/RemarkableTablet/comments/j75nis/reference_image_template_icon_codes_for_23016/
+
+# Exam protocol
+register_template('Exam Protocol', 'ExamProtocolP', exam_protocol,
                   icon_code_portrait='\ue98f',
-                  icon_code_landscape=None,
                   categories=['Life/organize'])
 
-    # Render the 5mm grid
-    save_template(grid5mm('Grid5mm.svg'), None,
-                  name='Grid 5mm', rmfilename='Grid5mm',
+# Render the 5mm grid
+register_template('Grid 5mm', 'Grid5mm', grid5mm,
                   icon_code_portrait='\ue99e',
                   icon_code_landscape='\ue9fa',
                   categories=['Grids'])
 
-    # Render a 5mm grid with ruler in portrait mode
-    save_template(ruled_grid5mm('GridRulerP.svg', draw_markers=False),
-                  ruled_grid5mm('GridRulerP.svg', draw_markers=True),
-                  name='Grid Ruler', rmfilename='GridRulerP',
+# Render a 5mm grid with ruler in portrait mode
+register_template('Grid Ruler', 'GridRulerP', ruled_grid5mm,
+                  params=dict(draw_markers=False),
+                  display_overlay=ruled_grid5mm_markers,
                   icon_code_portrait='\ue99e',
-                  icon_code_landscape=None,
                   categories=['Grids'])
 
-    # Render a 5mm grid with ruler in landscape mode
-    save_template(ruled_grid5mm('GridRulerLS.svg', landscape=True, draw_markers=False),
-                  ruled_grid5mm('GridRulerLS.svg', landscape=True, draw_markers=True),
-                  name='Grid Ruler', rmfilename='GridRulerLS',
-                  icon_code_portrait=None,
+# Render a 5mm grid with ruler in landscape mode
+register_template('Grid Ruler', 'GridRulerLS', ruled_grid5mm,
+                  params=dict(landscape=True, draw_markers=False),
+                  display_overlay=ruled_grid5mm_markers,
                   icon_code_landscape='\ue9fa',
                   categories=['Grids'])
-    
-    # 3D printer template (5mm grid with ruler in portrait mode)
-    save_template(print3d_template('Print3dP.svg', draw_markers=False),
-                  print3d_template('Print3dP.svg', draw_markers=True),
-                  name='3D Printing', rmfilename='Print3dP',
+
+# 3D printer template (5mm grid with ruler in portrait mode)
+register_template('3D Printing', 'Print3dP', print3d_template,
+                  params=dict(draw_markers=False),
+                  display_overlay=ruled_grid5mm_markers,
                   icon_code_portrait='\ue99e',
-                  icon_code_landscape=None,
                   categories=['Grids'])
-    
-    # Render a gardening plan/todo list
-    save_template(gardening_planner('GardeningP.svg'),
-                  None,
-                  name='Gardening', rmfilename='GardeningP',
+
+# Render a gardening plan/todo list
+register_template('Gardening', 'GardeningP', gardening_planner,
                   icon_code_portrait='\ue98f',
-                  icon_code_landscape=None,
                   categories=['Life/organize'])
 
-    # Render a generic todo list
-    save_template(todo_list('TodoListP.svg'),
-                  None,
-                  name='TODOs', rmfilename='TodoListP',
+# Render a generic todo list
+register_template('TODOs', 'TodoListP', todo_list,
                   icon_code_portrait='\ue98f',
-                  icon_code_landscape=None,
                   categories=['Life/organize'])
+
+
+# Build manifest (stored next to the outputs) to skip unchanged templates
+BUILD_MANIFEST = 'build_manifest.json'
+
+
+def template_outputs(rmfilename):
+    """Returns the files which are generated for the given template."""
+    return [f'{rmfilename}.svg', f'{rmfilename}.png', f'{rmfilename}.inc.json']
+
+
+def file_digest(filename):
+    """Returns the SHA-256 hex digest of the file's content."""
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def source_digest(funcs):
+    """
+    Returns a digest over the source code of the given functions and of all
+    functions/classes of this module which they (transitively) refer to,
+    e.g. print3d_template also covers ruled_grid5mm.
+    """
+    module = sys.modules[__name__]
+    sources = dict()
+
+    def referenced_names(code):
+        names = set(code.co_names)
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                names |= referenced_names(const)
+        return names
+
+    def visit(obj):
+        if obj.__qualname__ in sources:
+            return
+        sources[obj.__qualname__] = inspect.getsource(obj)
+        if inspect.isclass(obj):
+            codes = [m.__code__ for m in vars(obj).values() if inspect.isfunction(m)]
+        else:
+            codes = [obj.__code__]
+        for code in codes:
+            for name in referenced_names(code):
+                ref = getattr(module, name, None)
+                if (inspect.isfunction(ref) or inspect.isclass(ref))\
+                        and ref.__module__ == obj.__module__:
+                    visit(ref)
+
+    for func in funcs:
+        visit(func)
+    sha = hashlib.sha256()
+    for qualname in sorted(sources):
+        sha.update(qualname.encode('utf-8'))
+        sha.update(sources[qualname].encode('utf-8'))
+    return sha.hexdigest()
+
+
+def project_modules():
+    """
+    Returns the modules of this project (i.e. located next to this script)
+    which this module imports, e.g. geometry and rasterizer.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    modules = [obj for obj in vars(sys.modules[__name__]).values()
+               if isinstance(obj, types.ModuleType) and getattr(obj, '__file__', None) is not None
+               and os.path.dirname(os.path.abspath(obj.__file__)) == directory]
+    return sorted(modules, key=lambda m: m.__name__)
+
+
+def template_job_digest(job, options):
+    """
+    Returns the cache key of a template job, i.e. a digest over the source
+    of its generator(s), their parameters, the template's configuration and
+    the build options which affect the outputs (including the project's
+    modules which the generators use, see project_modules).
+    """
+    funcs = [save_template]
+    params = {k: v for k, v in job.items() if k not in ['export', 'display', 'display_overlay']}
+    for variant in ['export', 'display', 'display_overlay']:
+        if job[variant] is None:
+            params[variant] = None
+        else:
+            generator, kwargs = job[variant]
+            funcs.append(generator)
+            params[variant] = [generator.__name__, kwargs]
+    params['png_backend'] = options['png_backend']
+    params['text_font'] = options['text_font']
+    params['png_bit_depth'] = options['png_bit_depth']
+    params['gray_levels'] = options['gray_levels']
+    sha = hashlib.sha256()
+    sha.update(source_digest(funcs).encode('utf-8'))
+    for module in project_modules():
+        sha.update(module.__name__.encode('utf-8'))
+        sha.update(inspect.getsource(module).encode('utf-8'))
+    if options['text_font'] is not None:
+        sha.update(file_digest(options['text_font']).encode('utf-8'))
+    sha.update(json.dumps(params, sort_keys=True, default=repr).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def display_overlay(job):
+    """
+    Returns the function which derives the job's display template from the
+    export drawing (see register_template), or None.
+    """
+    if job['display_overlay'] is None:
+        return None
+    func, kwargs = job['display_overlay']
+    return lambda dwg: func(overlay_drawing(dwg), **kwargs)
+
+
+def is_up_to_date(manifest_entry, digest):
+    """Checks whether the manifest entry matches the digest and all outputs are unchanged."""
+    if manifest_entry is None or manifest_entry.get('digest') != digest:
+        return False
+    for filename, file_hash in manifest_entry['outputs'].items():
+        if not os.path.exists(filename) or file_digest(filename) != file_hash:
+            return False
+    return True
+
+
+# Default build options:
+# * batch_conversions: Only queue the inkscape conversions, so they can be
+#   run within a few inkscape sessions (see InkscapeSession and
+#   build_templates).
+# * png_backend: 'auto', 'numpy' or 'inkscape' (see save_template).
+# * text_font: Font file to convert text to glyph paths (see save_template),
+#   None to convert text via inkscape.
+# * png_bit_depth, gray_levels: Grayscale format of the PNGs (see
+#   rasterizer.write_png), by default quantized to the panel's gray levels.
+DEFAULT_BUILD_OPTIONS = dict(batch_conversions=False, png_backend='auto', text_font=None,
+                             png_bit_depth=4, gray_levels=rasterizer.PANEL_GRAY_LEVELS)
+
+
+def build_template(job, manifest_entry=None, options=None):
+    """
+    Renders a single template (see register_template) using the given
+    build options (see DEFAULT_BUILD_OPTIONS).
+
+    If batch_conversions is set, the inkscape conversions are only queued
+    and must be run by the caller (see InkscapeSession).
+
+    If the job's digest matches the given manifest entry (and the outputs
+    haven't been modified since), neither the generators nor inkscape are
+    invoked.
+
+    All console output is captured, so that parallel builds don't interleave
+    their logs. Returns a dict with the keys rmfilename, success, skipped,
+    log, queue (queued conversions) and digest.
+    """
+    options = dict(DEFAULT_BUILD_OPTIONS, **(options or dict()))
+    rmfilename = job['rmfilename']
+    batch_conversions = options['batch_conversions']
+    png_format = (options['png_bit_depth'], options['gray_levels'])
+    converter = InkscapeSession(*png_format) if batch_conversions else InkscapeConverter(*png_format)
+    result = dict(rmfilename=rmfilename, success=False, skipped=False,
+                  queue=list(), digest=None)
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        try:
+            result['digest'] = template_job_digest(job, options)
+            if is_up_to_date(manifest_entry, result['digest']):
+                print(f'* Template "{job["name"]}" ({rmfilename}) is up to date, skipping.')
+                result['skipped'] = True
+            else:
+                generator, kwargs = job['export']
+                svgtpl_export = generator(f'{rmfilename}.svg', **kwargs)
+                if job['display'] is not None:
+                    generator, kwargs = job['display']
+                    svgtpl_display = generator(f'{rmfilename}.svg', **kwargs)
+                else:
+                    svgtpl_display = None
+                save_template(svgtpl_export, svgtpl_display,
+                              name=job['name'], rmfilename=rmfilename,
+                              icon_code_portrait=job['icon_code_portrait'],
+                              icon_code_landscape=job['icon_code_landscape'],
+                              categories=job['categories'],
+                              converter=converter,
+                              png_backend=options['png_backend'],
+                              text_font=options['text_font'],
+                              display_overlay=display_overlay(job))
+                if batch_conversions:
+                    result['queue'] = converter.queue
+            result['success'] = True
+        except Exception as e:
+            print(f'[ERROR] Cannot build template "{rmfilename}": {e}')
+    result['log'] = log.getvalue()
+    return result
+
+
+def run_conversions(queue, png_format):
+    """
+    Runs the queued conversions (see InkscapeSession) within a single
+    inkscape session, e.g. in a worker process. Returns the list of failed
+    template files and the captured log.
+    """
+    session = InkscapeSession(*png_format)
+    session.extend(queue)
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        failed = session.run()
+    return failed, log.getvalue()
+
+
+def build_templates(jobs, num_workers, force=False, options=None):
+    """
+    Builds all given template jobs, either sequentially (num_workers = 1)
+    or via a process pool. Each template's log is printed as a whole once
+    the template is done.
+
+    If the batch_conversions option is set, the inkscape conversions are
+    collected and run within one inkscape session per chunk of templates:
+    with a process pool, each chunk (of about len(jobs) / num_workers
+    templates) is converted by the pool as soon as it is complete, i.e.
+    while the remaining templates are still being rendered. A sequential
+    build runs a single session at the end.
+
+    Templates which haven't changed since the last build (according to the
+    build manifest) are skipped, unless force is set.
+
+    Returns the list of failed and the list of skipped template files.
+    """
+    options = dict(DEFAULT_BUILD_OPTIONS, **(options or dict()))
+    manifest = load_json(BUILD_MANIFEST, description='build manifest')
+    failed = list()
+    skipped = list()
+    built = dict()
+    png_format = (options['png_bit_depth'], options['gray_levels'])
+    # Conversions of the templates which haven't been submitted to a session yet
+    pending = dict(queue=list(), templates=0)
+    chunk_size = max(1, math.ceil(len(jobs) / num_workers))
+
+    def report(result):
+        print(result['log'], end='')
+        sys.stdout.flush()
+        if not result['success']:
+            failed.append(result['rmfilename'])
+        elif result['skipped']:
+            skipped.append(result['rmfilename'])
+        else:
+            built[result['rmfilename']] = result['digest']
+        if len(result['queue']) > 0:
+            pending['queue'].extend(result['queue'])
+            pending['templates'] += 1
+
+    def report_conversions(failed_conversions, log):
+        print(log, end='')
+        sys.stdout.flush()
+        failed.extend(f for f in failed_conversions if f not in failed)
+
+    def take_pending():
+        queue = pending['queue']
+        pending['queue'], pending['templates'] = list(), 0
+        return queue
+
+    def job_args(job):
+        entry = None if force else manifest.get(job['rmfilename'])
+        return job, entry, options
+
+    if num_workers == 1:
+        for job in jobs:
+            report(build_template(*job_args(job)))
+        if len(pending['queue']) > 0:
+            print()
+            report_conversions(*run_conversions(take_pending(), png_format))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as pool:
+            futures = [pool.submit(build_template, *job_args(job)) for job in jobs]
+            sessions = list()
+            for future in concurrent.futures.as_completed(futures):
+                report(future.result())
+                if pending['templates'] >= chunk_size:
+                    sessions.append(pool.submit(run_conversions, take_pending(), png_format))
+            if len(pending['queue']) > 0:
+                sessions.append(pool.submit(run_conversions, take_pending(), png_format))
+            for future in concurrent.futures.as_completed(sessions):
+                report_conversions(*future.result())
+
+    # Update the manifest for all successfully (re-)built templates
+    for rmfilename, digest in built.items():
+        if rmfilename in failed:
+            manifest.pop(rmfilename, None)
+            continue
+        outputs = [f for f in template_outputs(rmfilename) if os.path.exists(f)]
+        manifest[rmfilename] = {
+            'digest': digest,
+            'outputs': {f: file_digest(f) for f in outputs}
+        }
+    save_json(manifest, BUILD_MANIFEST)
+    return failed, skipped
+
+
+def parse_args():
+    """Returns the parsed command line arguments."""
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--workers', dest='num_workers', action='store', type=int,
+        default=os.cpu_count(),
+        help='Number of worker processes rendering the templates in parallel (1 disables the process pool), default: %(default)d')
+
+    parser.add_argument('--no-batch', dest='batch_conversions', action='store_false', default=True,
+        help='Start a separate inkscape process for each conversion instead of one inkscape session per '
+             'chunk of templates (the sessions run in parallel, see --workers)')
+
+    parser.add_argument('--force', dest='force', action='store_true', default=False,
+        help=f'Rebuild all templates, even if they are up to date according to {BUILD_MANIFEST}, default: %(default)s')
+
+    parser.add_argument('--png-backend', dest='png_backend', action='store',
+        choices=['auto', 'numpy', 'inkscape'], default='auto',
+        help="Export PNGs via inkscape or the built-in NumPy rasterizer ('auto' uses the "
+             "rasterizer for all supported templates and inkscape otherwise), default: %(default)s")
+
+    parser.add_argument('--png-depth', dest='png_bit_depth', action='store', type=int,
+        choices=[1, 2, 4, 8], default=DEFAULT_BUILD_OPTIONS['png_bit_depth'],
+        help='Bit depth of the grayscale PNGs, default: %(default)d')
+
+    parser.add_argument('--gray-levels', dest='gray_levels', action='store', type=int,
+        default=DEFAULT_BUILD_OPTIONS['gray_levels'],
+        help='Quantize the PNGs to this number of gray levels (the e-ink panel displays 16, '
+             'use 256 with --png-depth 8 to keep all levels), default: %(default)d')
+
+    parser.add_argument('--font', dest='font_filename', action='store', type=str,
+        default=None,
+        help='Font file (xkcd) to convert text to glyph paths, default: look up via fontconfig')
+
+    parser.add_argument('--inkscape-text', dest='inkscape_text', action='store_true', default=False,
+        help='Convert text to paths via inkscape instead of the built-in glyph conversion, default: %(default)s')
+
+    parser.add_argument('--list', dest='list_templates', action='store_true', default=False,
+        help='List the available templates (or the ones selected via --only/--category) and exit')
+
+    parser.add_argument('--only', dest='names', action='store', nargs='+', type=str,
+        help="Only build the templates with these names or filenames (don't forget the quotes), e.g. --only \"Grid Ruler\" Grid5mm")
+
+    parser.add_argument('--category', dest='categories', action='store', nargs='+', type=str,
+        help='Only build the templates of these categories, e.g. --category Grids')
+
+    args = parser.parse_args()
+    if args.num_workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.gray_levels < 2 or args.gray_levels > 2**args.png_bit_depth:
+        parser.error(f'--gray-levels must be between 2 and {2**args.png_bit_depth} for a bit depth of {args.png_bit_depth}')
+    return args
+
+
+def text_font(args):
+    """Returns the font file to convert text to glyph paths or None (to use inkscape instead)."""
+    if args.inkscape_text:
+        return None
+    if glyphs is None:
+        print('* fontTools is not installed, text will be converted to paths via inkscape.')
+        return None
+    font_filename = args.font_filename if args.font_filename is not None else glyphs.find_font_file('xkcd')
+    if font_filename is None or not os.path.exists(font_filename):
+        print('* Cannot find the xkcd font file (see --font), text will be converted to paths via inkscape.')
+        return None
+    return font_filename
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        templates = select_templates(TEMPLATES, args.names, args.categories)
+    except ValueError as e:
+        print(f'[ERROR] {e}')
+        print()
+        list_templates(TEMPLATES)
+        sys.exit(2)
+    if args.list_templates:
+        list_templates(templates)
+        sys.exit(0)
+
+    options = dict(batch_conversions=args.batch_conversions,
+                   png_backend=args.png_backend,
+                   text_font=text_font(args),
+                   png_bit_depth=args.png_bit_depth,
+                   gray_levels=args.gray_levels)
+    failed, skipped = build_templates(templates, args.num_workers, args.force, options)
+    print()
+    if len(failed) > 0:
+        print(f'[ERROR] {len(failed)} of {len(templates)} template(s) failed: {failed}')
+        sys.exit(1)
+    print(f'> Successfully built {len(templates) - len(skipped)} template(s), {len(skipped)} were up to date.')
+    sys.exit(0)
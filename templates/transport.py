@@ -0,0 +1,492 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Connections to the reMarkable, with interchangeable backends:
+* SSHSession: the ssh/scp command line tools. Instead of starting a separate
+  ssh/scp process (and thus paying a full SSH handshake) for each transfer
+  and remote command, it opens a single master connection (OpenSSH's
+  ControlMaster) which all subsequent ssh/scp invocations are multiplexed
+  over.
+* ParamikoSession: in-process SSH client (requires paramiko, i.e.
+  pip install paramiko).
+* LocalDirectory: a local directory which stands in for a directory on the
+  device (e.g. /usr/share/remarkable/templates), the UI restart is faked.
+  This allows testing and benchmarking the installers without a tablet.
+
+Multiple files can also be uploaded as a single tar stream (see
+Transport.upload_tar), which avoids a round trip per file.
+
+All backends count the remote commands, transfers and bytes (see
+Transport.stats), so we can compare the installers' overhead.
+"""
+
+import abc
+import concurrent.futures
+import hashlib
+import io
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+
+class TransportError(Exception):
+    """Raised if the connection to the device fails or a remote command/transfer fails."""
+    pass
+
+
+def make_tar(files, compress=False, data=None):
+    """
+    Creates an in-memory tar archive (bytes) from the (local filename, name
+    within the archive) tuples and the optional (name, bytes) tuples of data.
+    The files will be owned by root on the device.
+    """
+    def as_root(info):
+        info.uid = info.gid = 0
+        info.uname = info.gname = 'root'
+        info.mode = 0o644
+        return info
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz' if compress else 'w') as tar:
+        for filename, arcname in files:
+            tar.add(filename, arcname=arcname, filter=as_root)
+        for arcname, content in (data or list()):
+            info = as_root(tarfile.TarInfo(arcname))
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def parse_checksums(output):
+    """Parses the output of md5sum into a dict (filename: checksum)."""
+    checksums = dict()
+    for line in output.splitlines():
+        checksum, sep, filename = line.partition('  ')
+        if sep:
+            checksums[filename] = checksum
+    return checksums
+
+
+def file_checksum(filename):
+    """Returns the MD5 checksum of the file (to compare it with the device's md5sum output)."""
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def unpack_command(arcnames, remote_dir, compress=False, command=None):
+    """
+    Returns the remote shell command which unpacks a tar stream (read from
+    stdin) into a staging directory next to the target files and then moves
+    the files into place in the given order. A failed/aborted transfer thus
+    leaves the existing files untouched, and each file is replaced atomically
+    (rename within the same file system).
+
+    If a command is given, it runs (within the remote directory) instead of
+    moving the files, the staging directory is available as "$staging".
+    """
+    if command is None:
+        command = ' && '.join(f'mv -f "$staging"/{shlex.quote(n)} {shlex.quote(n)}' for n in arcnames)
+    return (f'cd {shlex.quote(remote_dir)} && staging=$(mktemp -d .upload.XXXXXX) && '
+            'trap \'rm -rf "$staging"\' EXIT && '
+            f'tar -x{"z" if compress else ""}f - -C "$staging" && {command}')
+
+
+class Transport(abc.ABC):
+    """
+    Base class of the connections to the device, use as context manager:
+
+        with SSHSession('10.11.99.1') as session:
+            session.restart_ui()
+
+    Backends must implement run(), download() and upload() (and usually
+    override open() and close()).
+    The remaining operations are implemented via remote shell commands, but
+    can be overridden (see LocalDirectory).
+    """
+
+    def __init__(self):
+        self.is_open = False
+        self.stats = dict(commands=0, transfers=0, bytes_sent=0, bytes_received=0, restarts=0)
+
+    def open(self):
+        """Opens the connection (raises a TransportError if that fails)."""
+        self.is_open = True
+        return self
+
+    def close(self):
+        """Closes the connection."""
+        self.is_open = False
+
+    def __enter__(self):
+        return self if self.is_open else self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def count_command(self, input, output):
+        self.stats['commands'] += 1
+        self.stats['bytes_sent'] += 0 if input is None else len(input)
+        self.stats['bytes_received'] += len(output)
+
+    def count_transfer(self, local_filenames, sent):
+        self.stats['transfers'] += 1
+        self.stats['bytes_sent' if sent else 'bytes_received'] += sum(
+            os.path.getsize(f) for f in local_filenames)
+
+    @abc.abstractmethod
+    def run(self, command, input=None):
+        """
+        Runs the (shell) command on the device and returns its stdout (bytes).
+        The optional input (bytes) is passed to the command's stdin. Raises a
+        TransportError if the command fails.
+        """
+
+    @abc.abstractmethod
+    def download(self, remote_filename, local_filename):
+        """Copies the file from the device."""
+
+    @abc.abstractmethod
+    def upload(self, local_filenames, remote_dir):
+        """Copies the files (in a single transfer) to the given directory on the device."""
+
+    def checksums(self, remote_dir, filenames):
+        """
+        Returns the MD5 checksums (only used to detect changes) of the given
+        files within the remote directory as dict, computed via a single remote
+        command. Missing files are not included.
+        """
+        if len(filenames) == 0:
+            return dict()
+        # md5sum fails if any file is missing, but still reports the others
+        names = ' '.join(shlex.quote(f) for f in filenames)
+        output = self.run(f'cd {shlex.quote(remote_dir)} && md5sum {names} 2>/dev/null; true')
+        return parse_checksums(output.decode('utf-8'))
+
+    def upload_tar(self, files, remote_dir, compress=False):
+        """
+        Uploads the (local filename, remote filename) tuples as a single
+        (optionally gzip compressed) tar stream into the given directory on the
+        device, see unpack_command(). Returns the number of transferred bytes.
+        """
+        data = make_tar(files, compress)
+        self.run(unpack_command([arcname for _, arcname in files], remote_dir, compress), input=data)
+        return len(data)
+
+    def run_python(self, source, args, remote_dir, files=None, compress=False, data=None, input=None):
+        """
+        Runs the given python source within the remote directory (requires
+        python3 on the device), i.e. 'python3 -c source args..', and returns
+        its stdout.
+
+        If files and/or data are given (see make_tar), they're streamed into a
+        staging directory on the device first, the placeholder {staging} in
+        the arguments is replaced by this directory. Otherwise, the optional
+        input (bytes) is passed to the script's stdin.
+        """
+        args = ' '.join('"$staging"' if a == '{staging}' else shlex.quote(a) for a in args)
+        command = f'python3 -c {shlex.quote(source)} {args}'
+        if files is None and data is None:
+            return self.run(f'cd {shlex.quote(remote_dir)} && {command}', input=input)
+        return self.run(unpack_command(None, remote_dir, compress, command),
+                        input=make_tar(files or list(), compress, data))
+
+    def restart_ui(self):
+        """Restarts the device's UI (xochitl)."""
+        self.stats['restarts'] += 1
+        self.run('systemctl restart xochitl')
+
+
+class SSHSession(Transport):
+    """Persistent SSH session to the device via the ssh/scp command line tools."""
+
+    def __init__(self, hostname, user='root', timeout=10):
+        super().__init__()
+        self.hostname = hostname
+        self.user = user
+        self.timeout = timeout
+        self.control_dir = None
+
+    @property
+    def target(self):
+        return f'{self.user}@{self.hostname}'
+
+    @property
+    def control_path(self):
+        return os.path.join(self.control_dir, 'master')
+
+    def options(self):
+        """
+        Returns the options for ssh/scp to reuse the master connection. The
+        master detects a dead connection via keepalives (which aborts all
+        commands/transfers), the same options apply if ssh/scp have to
+        connect on their own.
+        """
+        return ['-o', f'ConnectTimeout={self.timeout}',
+                '-o', f'ServerAliveInterval={self.timeout}',
+                '-o', 'ServerAliveCountMax=2',
+                '-o', f'ControlPath={self.control_path}',
+                '-o', 'ControlMaster=no']
+
+    def open(self):
+        # The socket lives in a private temporary directory (unix socket paths
+        # are rather short, so we don't use the template dir)
+        self.control_dir = tempfile.mkdtemp(prefix='rmssh-')
+        cmd = ['ssh', '-o', f'ConnectTimeout={self.timeout}',
+               '-o', f'ServerAliveInterval={self.timeout}',
+               '-o', 'ServerAliveCountMax=2',
+               '-o', 'ControlMaster=yes',
+               '-o', f'ControlPath={self.control_path}',
+               '-o', 'ControlPersist=yes',
+               '-f', '-N', self.target]
+        try:
+            rv = subprocess.call(cmd)
+        except OSError as e:
+            self.close()
+            raise TransportError(f'Cannot start ssh: {e}')
+        if rv != 0:
+            self.close()
+            raise TransportError(f'Cannot connect to "{self.target}"')
+        return super().open()
+
+    def close(self):
+        super().close()
+        if self.control_dir is None:
+            return
+        if os.path.exists(self.control_path):
+            subprocess.call(['ssh', '-o', f'ControlPath={self.control_path}',
+                             '-O', 'exit', self.target],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+        self.control_dir = None
+
+    def run(self, command, input=None):
+        proc = subprocess.run(['ssh'] + self.options() + [self.target, command],
+                              input=input, stdout=subprocess.PIPE)
+        self.count_command(input, proc.stdout)
+        if proc.returncode != 0:
+            raise TransportError(f'Remote command failed with exit code {proc.returncode}: {command}')
+        return proc.stdout
+
+    def download(self, remote_filename, local_filename):
+        rv = subprocess.call(['scp'] + self.options()
+                             + [f'{self.target}:{shlex.quote(remote_filename)}', local_filename])
+        if rv != 0:
+            raise TransportError(f'Cannot download "{remote_filename}"')
+        self.count_transfer([local_filename], False)
+
+    def upload(self, local_filenames, remote_dir):
+        rv = subprocess.call(['scp'] + self.options() + list(local_filenames)
+                             + [f'{self.target}:{shlex.quote(remote_dir)}/'])
+        if rv != 0:
+            raise TransportError(f'Cannot upload {[os.path.basename(f) for f in local_filenames]}')
+        self.count_transfer(local_filenames, True)
+
+
+class ParamikoSession(Transport):
+    """
+    In-process SSH session to the device (requires paramiko). Uses the SSH
+    agent/default keys and requires the device to be a known host.
+    """
+
+    def __init__(self, hostname, user='root', timeout=10):
+        super().__init__()
+        self.hostname = hostname
+        self.user = user
+        self.timeout = timeout
+        # paramiko's keepalives don't detect a dead connection, so commands
+        # and transfers abort if no data arrives for as long as it takes ssh
+        # to give up (ServerAliveCountMax=2, see SSHSession)
+        self.stall_timeout = 3 * timeout
+        self.client = None
+        self.sftp = None
+
+    def open(self):
+        if paramiko is None:
+            raise TransportError('paramiko is not installed (pip install paramiko)')
+        self.client = paramiko.SSHClient()
+        self.client.load_system_host_keys()
+        try:
+            self.client.connect(self.hostname, username=self.user, timeout=self.timeout,
+                                banner_timeout=self.timeout, auth_timeout=self.timeout)
+            self.client.get_transport().set_keepalive(self.timeout)
+            self.sftp = self.client.open_sftp()
+            self.sftp.get_channel().settimeout(self.stall_timeout)
+        except (paramiko.SSHException, OSError) as e:
+            self.close()
+            raise TransportError(f'Cannot connect to "{self.user}@{self.hostname}": {e}')
+        return super().open()
+
+    def close(self):
+        super().close()
+        if self.sftp is not None:
+            self.sftp.close()
+            self.sftp = None
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def run(self, command, input=None):
+        try:
+            stdin, stdout, stderr = self.client.exec_command(command, timeout=self.stall_timeout)
+            # Feed stdin and drain stderr concurrently, otherwise the command
+            # blocks (and we wait forever) once the channel's window is full
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+                writer = pool.submit(self._write_input, stdin, input)
+                errors = pool.submit(stderr.read)
+                output = stdout.read()
+                writer.result()
+                errors = errors.result()
+            rv = stdout.channel.recv_exit_status()
+        except (paramiko.SSHException, OSError) as e:
+            raise TransportError(f'Remote command failed: {str(e) or "connection stalled"}')
+        if errors:
+            sys.stderr.write(errors.decode('utf-8', errors='replace'))
+        self.count_command(input, output)
+        if rv != 0:
+            raise TransportError(f'Remote command failed with exit code {rv}: {command}')
+        return output
+
+    @staticmethod
+    def _write_input(stdin, input):
+        if input is not None:
+            stdin.write(input)
+        stdin.channel.shutdown_write()
+
+    def download(self, remote_filename, local_filename):
+        try:
+            self.sftp.get(remote_filename, local_filename)
+        except (paramiko.SSHException, OSError) as e:
+            raise TransportError(f'Cannot download "{remote_filename}": {str(e) or "connection stalled"}')
+        self.count_transfer([local_filename], False)
+
+    def upload(self, local_filenames, remote_dir):
+        try:
+            for filename in local_filenames:
+                self.sftp.put(filename, f'{remote_dir}/{os.path.basename(filename)}')
+        except (paramiko.SSHException, OSError) as e:
+            raise TransportError(f'Cannot upload {[os.path.basename(f) for f in local_filenames]}: {str(e) or "connection stalled"}')
+        self.count_transfer(local_filenames, True)
+
+
+class LocalDirectory(Transport):
+    """
+    A local directory which stands in for the given directory on the device
+    (other remote paths are not supported). Remote shell commands aren't
+    supported either, only the (overridden) high-level operations. Restarting
+    the UI is faked.
+    """
+
+    def __init__(self, directory, remote_root='/usr/share/remarkable/templates'):
+        super().__init__()
+        self.directory = directory
+        self.remote_root = remote_root.rstrip('/')
+
+    def open(self):
+        if not os.path.isdir(self.directory):
+            raise TransportError(f'Directory "{self.directory}" does not exist')
+        return super().open()
+
+    def local_path(self, remote_path):
+        """Maps the remote path to the local directory."""
+        remote_path = os.path.normpath(remote_path)
+        if remote_path == self.remote_root:
+            return self.directory
+        if not remote_path.startswith(self.remote_root + '/'):
+            raise TransportError(f'"{remote_path}" is not located within {self.remote_root}')
+        return os.path.join(self.directory, os.path.relpath(remote_path, self.remote_root))
+
+    def run(self, command, input=None):
+        raise TransportError(f'Remote commands are not supported by {type(self).__name__}: {command}')
+
+    def download(self, remote_filename, local_filename):
+        try:
+            shutil.copyfile(self.local_path(remote_filename), local_filename)
+        except OSError as e:
+            raise TransportError(f'Cannot download "{remote_filename}": {e}')
+        self.count_transfer([local_filename], False)
+
+    def upload(self, local_filenames, remote_dir):
+        try:
+            for filename in local_filenames:
+                shutil.copyfile(filename, os.path.join(self.local_path(remote_dir), os.path.basename(filename)))
+        except OSError as e:
+            raise TransportError(f'Cannot upload {[os.path.basename(f) for f in local_filenames]}: {e}')
+        self.count_transfer(local_filenames, True)
+
+    def checksums(self, remote_dir, filenames):
+        directory = self.local_path(remote_dir)
+        self.count_command(None, b'')
+        return {f: file_checksum(os.path.join(directory, f)) for f in filenames
+                if os.path.exists(os.path.join(directory, f))}
+
+    def unpack(self, data, directory, compress):
+        """Unpacks the tar stream into a new staging directory (returns its path)."""
+        staging = tempfile.mkdtemp(prefix='.upload.', dir=directory)
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz' if compress else 'r') as tar:
+            tar.extractall(staging)
+        return staging
+
+    def upload_tar(self, files, remote_dir, compress=False):
+        directory = self.local_path(remote_dir)
+        data = make_tar(files, compress)
+        self.count_command(data, b'')
+        staging = self.unpack(data, directory, compress)
+        try:
+            for _, arcname in files:
+                os.replace(os.path.join(staging, arcname), os.path.join(directory, arcname))
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return len(data)
+
+    def run_python(self, source, args, remote_dir, files=None, compress=False, data=None, input=None):
+        # Runs the script via the local python interpreter
+        directory = self.local_path(remote_dir)
+        staging = None
+        if files is not None or data is not None:
+            input = make_tar(files or list(), compress, data)
+            staging = self.unpack(input, directory, compress)
+        try:
+            args = [staging if a == '{staging}' else a for a in args]
+            proc = subprocess.run([sys.executable, '-c', source] + args, cwd=directory,
+                                  input=input, stdout=subprocess.PIPE)
+        finally:
+            if staging is not None:
+                shutil.rmtree(staging, ignore_errors=True)
+        self.count_command(input, proc.stdout)
+        if proc.returncode != 0:
+            raise TransportError(f'Script failed with exit code {proc.returncode}')
+        return proc.stdout
+
+    def restart_ui(self):
+        self.stats['restarts'] += 1
+        print(f'* Faked UI restart (local directory "{self.directory}")')
+
+
+TRANSPORTS = ['ssh', 'paramiko', 'local']
+
+
+def create_transport(kind, hostname, timeout=10, remote_root='/usr/share/remarkable/templates'):
+    """
+    Returns the (not yet opened) transport of the given kind (see TRANSPORTS).
+    For the local backend, the hostname is the path to the local directory
+    which stands in for the remote_root on the device.
+    """
+    if kind == 'ssh':
+        return SSHSession(hostname, timeout=timeout)
+    if kind == 'paramiko':
+        return ParamikoSession(hostname, timeout=timeout)
+    if kind == 'local':
+        return LocalDirectory(hostname, remote_root)
+    raise ValueError(f'Unknown transport "{kind}", use one of {TRANSPORTS}')
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Cached index of the device's document tree (folders and documents), built
+from the .metadata files within the xochitl content directory.
+
+xochitl stores each document/folder as <uuid>.metadata (JSON with the
+visible name, the parent's uuid, the type, etc.), so resolving a path such
+as /Inbox requires parsing all .metadata files. Instead of reading these
+(thousands of small files) for each request, this script caches the parsed
+entries (xochitl_index.json by default) and refreshes the cache
+incrementally:
+* a single remote command lists all .metadata files with size and mtime,
+* only new or changed .metadata files are fetched (as tar stream),
+* the path lookup table is rebuilt in memory, i.e. lookups take constant time.
+
+The index can also be built from a local backup (see backup_xochitl.py).
+
+Usage:
+  python3 xochitl_index.py --host 10.11.99.1 --lookup /Inbox
+  python3 xochitl_index.py --backup rm2-backup/xochitl-files --list
+"""
+
+import argparse
+import io
+import json
+import os
+import shlex
+import sys
+import tarfile
+
+from backup_xochitl import REMOTE_XOCHITL_DIR
+from jsonstore import load_json, save_json
+from transport import TransportError, create_transport
+
+
+# Default location of the cached index
+INDEX_FILENAME = 'xochitl_index.json'
+
+# Number of .metadata files to fetch per remote command (limits the command line length)
+FETCH_BATCH_SIZE = 500
+
+
+def parse_metadata(uuid, content, size, mtime):
+    """Returns the index entry of a document/folder, parsed from its .metadata file."""
+    try:
+        meta = json.loads(content.decode('utf-8'))
+    except ValueError:
+        print(f'[WARNING] Ignoring invalid metadata of "{uuid}"')
+        meta = dict()
+    return dict(name=meta.get('visibleName', uuid),
+                parent=meta.get('parent', ''),
+                type='folder' if meta.get('type') == 'CollectionType' else 'document',
+                deleted=bool(meta.get('deleted', False)),
+                last_modified=meta.get('lastModified'),
+                size=size, mtime=mtime)
+
+
+def list_remote_metadata(session, remote_dir):
+    """Lists the .metadata files on the device as dict (uuid: (size, mtime)) via a single remote command."""
+    output = session.run(f'cd {shlex.quote(remote_dir)} && '
+                         'find . -maxdepth 1 -name \'*.metadata\' -exec stat -c \'%s %Y %n\' {} +')
+    listing = dict()
+    for line in output.decode('utf-8').splitlines():
+        size, mtime, name = line.split(' ', 2)
+        listing[os.path.basename(name)[:-len('.metadata')]] = (int(size), int(mtime))
+    return listing
+
+
+def fetch_remote_metadata(session, remote_dir, uuids):
+    """Fetches the .metadata files of the given uuids (as tar streams), returns a dict (uuid: content)."""
+    contents = dict()
+    for start in range(0, len(uuids), FETCH_BATCH_SIZE):
+        names = ' '.join(shlex.quote(f'{u}.metadata') for u in uuids[start:start + FETCH_BATCH_SIZE])
+        data = session.run(f'cd {shlex.quote(remote_dir)} && tar -czf - {names}')
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar:
+            for member in tar.getmembers():
+                if member.isfile() and member.name.endswith('.metadata'):
+                    contents[os.path.basename(member.name)[:-len('.metadata')]] = tar.extractfile(member).read()
+    return contents
+
+
+def list_local_metadata(directory):
+    """Lists the .metadata files of a local backup as dict (uuid: (size, mtime))."""
+    listing = dict()
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.endswith('.metadata') and entry.is_file():
+                st = entry.stat()
+                listing[entry.name[:-len('.metadata')]] = (st.st_size, int(st.st_mtime))
+    return listing
+
+
+def fetch_local_metadata(directory, uuids):
+    """Reads the .metadata files of the given uuids from a local backup, returns a dict (uuid: content)."""
+    contents = dict()
+    for uuid in uuids:
+        with open(os.path.join(directory, f'{uuid}.metadata'), 'rb') as f:
+            contents[uuid] = f.read()
+    return contents
+
+
+class XochitlIndex(object):
+    """
+    Index of the document tree: entries (uuid: dict(name, parent, type,
+    deleted, last_modified, size, mtime)) and the lookup table of the paths
+    (e.g. '/Inbox/Paper') of all folders and documents which aren't deleted
+    or in the trash.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = dict() if entries is None else entries
+        self.paths = dict()
+        self.update_paths()
+
+    @staticmethod
+    def load(filename):
+        """Loads the cached index (or returns an empty one)."""
+        return XochitlIndex(load_json(filename, description='index').get('entries'))
+
+    def save(self, filename):
+        """Writes the index (via a temporary file to avoid partial writes)."""
+        save_json(dict(entries=self.entries), filename)
+
+    def refresh(self, listing, fetch):
+        """
+        Updates the index incrementally, given the current listing of the
+        .metadata files (uuid: (size, mtime)) and a function which returns
+        the contents of the given uuids' .metadata files. Only new or changed
+        (size/mtime) files are fetched. Returns the number of added, updated
+        and removed entries.
+        """
+        changed = [uuid for uuid, (size, mtime) in listing.items()
+                   if uuid not in self.entries or self.entries[uuid]['size'] != size
+                   or self.entries[uuid]['mtime'] != mtime]
+        removed = [uuid for uuid in self.entries if uuid not in listing]
+        num_added = sum(1 for uuid in changed if uuid not in self.entries)
+        contents = fetch(changed) if len(changed) > 0 else dict()
+        for uuid in changed:
+            if uuid in contents:
+                self.entries[uuid] = parse_metadata(uuid, contents[uuid], *listing[uuid])
+        for uuid in removed:
+            del self.entries[uuid]
+        self.update_paths()
+        return num_added, len(changed) - num_added, len(removed)
+
+    def resolve(self, uuid):
+        """
+        Returns the path of the entry, or None if it's deleted, in the trash
+        or its parent is unknown.
+        """
+        names = list()
+        visited = set()
+        while uuid != '':
+            entry = self.entries.get(uuid)
+            if entry is None or entry['deleted'] or uuid in visited:
+                return None
+            visited.add(uuid)
+            names.append(entry['name'])
+            uuid = entry['parent']
+        return '/' + '/'.join(reversed(names))
+
+    def update_paths(self):
+        """Rebuilds the lookup table (path: list of uuids, as names aren't unique)."""
+        self.paths = dict()
+        for uuid in self.entries:
+            path = self.resolve(uuid)
+            if path is not None:
+                self.paths.setdefault(path, list()).append(uuid)
+
+    def lookup(self, path):
+        """Returns the uuids of the folders/documents with the given path (empty if it doesn't exist)."""
+        return self.paths.get('/' + path.strip('/'), list())
+
+    def children(self, uuid):
+        """Returns the uuids of the entries within the given folder ('' for the root folder)."""
+        return [u for u, e in self.entries.items() if e['parent'] == uuid and not e['deleted']]
+
+
+def parse_args():
+    """Returns the parsed command line arguments."""
+
+    parser = argparse.ArgumentParser(description='Cached index of the folders and documents')
+
+    parser.add_argument('--host', dest='hostname', action='store', type=str,
+        default='10.11.99.1', help='IP or hostname of the device, default: %(default)s')
+
+    parser.add_argument('--transport', dest='transport', action='store',
+        choices=['ssh', 'paramiko'], default='ssh',
+        help="Connect via the ssh/scp tools ('ssh') or the in-process SSH client ('paramiko', "
+             "requires pip install paramiko), default: %(default)s")
+
+    parser.add_argument('--timeout', dest='timeout', action='store', type=int,
+        default=10, help='Specify connection timeout in seconds, default: %(default)d')
+
+    parser.add_argument('--remote-dir', dest='remote_dir', action='store', type=str,
+        default=REMOTE_XOCHITL_DIR, help='Content directory on the device, default: %(default)s')
+
+    parser.add_argument('--backup', dest='backup_dir', action='store', type=str, default=None,
+        help='Build the index from this local backup (see backup_xochitl.py) instead of the device')
+
+    parser.add_argument('--index', dest='index_filename', action='store', type=str,
+        default=INDEX_FILENAME, help='Cached index file, default: %(default)s')
+
+    parser.add_argument('--no-refresh', dest='refresh', action='store_false', default=True,
+        help="Only use the cached index, don't connect to the device")
+
+    parser.add_argument('--rebuild', dest='rebuild', action='store_true', default=False,
+        help='Discard the cached index and parse all .metadata files again, default: %(default)s')
+
+    parser.add_argument('--lookup', dest='lookup_paths', action='store', nargs='+', type=str,
+        help='Print the uuid(s) of these paths, e.g. /Inbox (exits with 1 if any path does not exist)')
+
+    parser.add_argument('--list', dest='list_paths', action='store_true', default=False,
+        help='List all paths with their uuid and type, default: %(default)s')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    index = XochitlIndex() if args.rebuild else XochitlIndex.load(args.index_filename)
+    if args.refresh:
+        try:
+            if args.backup_dir is not None:
+                counts = index.refresh(list_local_metadata(args.backup_dir),
+                                       lambda uuids: fetch_local_metadata(args.backup_dir, uuids))
+            else:
+                with create_transport(args.transport, args.hostname, args.timeout) as session:
+                    counts = index.refresh(list_remote_metadata(session, args.remote_dir),
+                                           lambda uuids: fetch_remote_metadata(session, args.remote_dir, uuids))
+        except (TransportError, OSError, tarfile.TarError) as e:
+            print(f'[ERROR] Cannot refresh the index: {e}')
+            sys.exit(1)
+        index.save(args.index_filename)
+        print(f'* Index refreshed: {counts[0]} added, {counts[1]} updated, {counts[2]} removed, '
+              f'{len(index.entries)} entries in total')
+
+    if args.list_paths:
+        for path in sorted(index.paths):
+            for uuid in index.paths[path]:
+                print(f"{uuid}  {index.entries[uuid]['type']:<8}  {path}")
+
+    missing = 0
+    for path in (args.lookup_paths or list()):
+        path = '/' + path.strip('/')
+        uuids = index.lookup(path)
+        if len(uuids) == 0:
+            print(f'[ERROR] "{path}" does not exist')
+            missing += 1
+        else:
+            if len(uuids) > 1:
+                print(f'[WARNING] "{path}" is ambiguous ({len(uuids)} entries)')
+            for uuid in uuids:
+                print(f"{uuid}  {index.entries[uuid]['type']:<8}  {path}")
+    sys.exit(1 if missing > 0 else 0)